@@ -1,9 +1,102 @@
+import copy
+import functools
+import queue
 import random
+import threading
+
+import numpy as np
 import torch
-from mwptoolkit.utils.enum_type import FixType, SpecialTokens
+from mwptoolkit.utils.enum_type import FixType, SpecialTokens, EPT
+from mwptoolkit.utils.data_structure import RaggedArray
+from mwptoolkit.data.dataloader.batch_sampler import BucketBatchSampler, sequential_batches
+from mwptoolkit.utils.preprocess_tools import find_ept_numbers_in_text, ept_equ_preprocess, ept_tokens_with_number_pos
+
+
+def _value_to_device(value, device, pin_memory=False):
+    r"""move a tensor, or tensors nested in lists and tuples, to device.
+    """
+    if torch.is_tensor(value):
+        if pin_memory:
+            value = value.pin_memory()
+        return value.to(device, non_blocking=pin_memory)
+    if isinstance(value, (list, tuple)):
+        moved = [_value_to_device(v, device, pin_memory) for v in value]
+        if all(m is v for m, v in zip(moved, value)):
+            return value
+        return type(value)(moved)
+    return value
+
+
+def _batch_to_device(batch, device, host_keys=(), pin_memory=False):
+    r"""move tensors of a batch built on cpu to device, tensors of host_keys stay on cpu.
+
+    tensors nested in lists and tuples, e.g. "spans" of HMS, are moved as well.
+    """
+    moved = {}
+    for key, value in batch.items():
+        if key not in host_keys:
+            value = _value_to_device(value, device, pin_memory)
+        moved[key] = value
+    return moved
+
+
+def _record_value_stream(value, stream):
+    if torch.is_tensor(value):
+        if value.is_cuda:
+            value.record_stream(stream)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _record_value_stream(v, stream)
+
+
+def _record_stream(batch, stream):
+    for value in batch.values():
+        _record_value_stream(value, stream)
+
+
+def prefetchable(load_data):
+    r"""decorator of `load_data`, batches are prefetched in background if `prefetch_batches` is set.
+    """
+    @functools.wraps(load_data)
+    def wrapper(self, type):
+        if self.prefetch_batches:
+            return self._prefetch(load_data, type)
+        return load_data(self, type)
+
+    return wrapper
+
+
+def resumable(load_data):
+    r"""decorator of `load_data`, counts training batches consumed so that an unfinished epoch can be resumed.
+    """
+    @functools.wraps(load_data)
+    def wrapper(self, type):
+        batches = load_data(self, type)
+        if type != "train":
+            return batches
+        return self._count_batches(batches)
+
+    return wrapper
 
 
 class AbstractDataLoader(object):
+    r"""abstract dataloader.
+
+    set `prefetch_batches` to N > 0 to build the next N batches in a background thread. Batches are built on
+    cpu, tensors are pinned and copied to device on a side cuda stream, so that batch assembly overlaps
+    with training. Tensors of `host_tensor_keys` stay on cpu, like they do without prefetching.
+
+    set `bucket_by_length` to batch records of similar question and equation length together, training
+    batches hold `max_batch_tokens` padded question and equation tokens at most if it is set. set `dynamic_padding`
+    to pad batches to the longest sequence in batch instead of `max_len`/`max_equ_len` (longer ones are still cut),
+    without it token budget batches are padded to `max_len`/`max_equ_len` and have a fixed size.
+
+    training batches are reshuffled every epoch with a generator seeded by `random_seed` and epoch if `shuffle`
+    is set. the cursor (epoch, batch index, rng states) is kept in `state_dict()`, a dataloader restored by
+    `load_state_dict()` continues the unfinished epoch from the next batch.
+    """
+    host_tensor_keys = ()
+
     def __init__(self, config, dataset):
         super().__init__()
         self.device = config["device"]
@@ -19,8 +112,18 @@ class AbstractDataLoader(object):
         self.add_sos = config["add_sos"]
         self.add_eos = config["add_eos"]
         self.filt_dirty = config["filt_dirty"]
+        self.model = config["model"].lower()
+        self.prefetch_batches = config["prefetch_batches"]
+        self.bucket_by_length = config["bucket_by_length"]
+        self.max_batch_tokens = config["max_batch_tokens"]
+        self.dynamic_padding = config["dynamic_padding"]
+        self.shuffle = config["shuffle"]
+        self.seed = config["random_seed"]
+        self.epoch = 0
+        self.batch_cursor = 0
 
         self.dataset = dataset
+        self._ept_encoded = {}
         self.in_pad_token = None
         self.in_unk_token = None
 
@@ -29,11 +132,22 @@ class AbstractDataLoader(object):
         self.temp_unk_token = None
         self.temp_pad_token = None
 
-    def _pad_input_batch(self, batch_seq, batch_seq_len):
+    def _input_pad_length(self, batch_seq_len):
         if self.max_len != None:
-            max_length = self.max_len
-        else:
-            max_length = max(batch_seq_len)
+            if self.dynamic_padding:
+                return min(self.max_len, max(batch_seq_len))
+            return self.max_len
+        return max(batch_seq_len)
+
+    def _output_pad_length(self, batch_target_len):
+        if self.max_equ_len != None:
+            if self.dynamic_padding:
+                return min(self.max_equ_len, max(batch_target_len))
+            return self.max_equ_len
+        return max(batch_target_len)
+
+    def _pad_input_batch(self, batch_seq, batch_seq_len):
+        max_length = self._input_pad_length(batch_seq_len)
         for idx, length in enumerate(batch_seq_len):
             if length < max_length:
                 x = batch_seq[idx] + [self.in_pad_token for i in range(max_length - length)]
@@ -43,10 +157,7 @@ class AbstractDataLoader(object):
         return batch_seq
 
     def _pad_output_batch(self, batch_target, batch_target_len):
-        if self.max_equ_len != None:
-            max_length = self.max_equ_len
-        else:
-            max_length = max(batch_target_len)
+        max_length = self._output_pad_length(batch_target_len)
         for idx, length in enumerate(batch_target_len):
             if length < max_length:
                 batch_target[idx] += [self.out_pad_token for i in range(max_length - length)]
@@ -160,4 +271,282 @@ class AbstractDataLoader(object):
         return num_stack
 
     def load_data(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def _get_split(self, type):
+        r"""records and batch size of split type.
+        """
+        if type == "train":
+            return self.dataset.trainset, self.train_batch_size
+        elif type == "valid":
+            return self.dataset.validset, self.test_batch_size
+        elif type == "test":
+            return self.dataset.testset, self.test_batch_size
+        else:
+            raise ValueError("{} type not in ['train', 'valid', 'test'].".format(type))
+
+    def _data_length(self, data):
+        r"""question length and equation length of a record, used to bucket records.
+        """
+        if "question" in data:
+            question_len = len(data["question"]) + int(bool(self.add_sos)) + int(bool(self.add_eos))
+        else:
+            question_len = len(data["ept"]["text"].split())
+        equation = data.get("equation", data.get("prefix equation", []))
+        equation_len = len(equation)
+        if not self.symbol_for_tree and self.equation_fix != FixType.MultiWayTree:
+            # <EOS> of equation
+            equation_len += 1
+        return question_len, equation_len
+
+    def _epoch_rng(self):
+        return random.Random("{}-{}".format(self.seed, self.epoch))
+
+    def _batch_indices(self, type, datas, batch_size):
+        r"""index batches of records of split type, training batches consumed in current epoch are skipped.
+        """
+        if not self.bucket_by_length:
+            indices = list(range(len(datas)))
+            if type == "train" and self.shuffle:
+                self._epoch_rng().shuffle(indices)
+            batches = sequential_batches(indices, batch_size)
+        else:
+            lengths = []
+            for data in datas:
+                question_len, equation_len = self._data_length(data)
+                if self.max_len != None:
+                    question_len = min(question_len, self.max_len)
+                if self.max_equ_len != None:
+                    equation_len = min(equation_len, self.max_equ_len)
+                lengths.append((question_len, equation_len))
+            if type == "train":
+                # lengths batches are padded to, see _input_pad_length and _output_pad_length
+                pad_lengths = (None if self.dynamic_padding else self.max_len, None if self.dynamic_padding else self.max_equ_len)
+                sampler = BucketBatchSampler(lengths, batch_size, self.max_batch_tokens, shuffle=True, rng=self._epoch_rng(),
+                                             pad_lengths=pad_lengths)
+            else:
+                sampler = BucketBatchSampler(lengths, batch_size)
+            batches = sampler.batches()
+        if type == "train":
+            batches = batches[self.batch_cursor:]
+        return batches
+
+    def _count_batches(self, batches):
+        for batch in batches:
+            self.batch_cursor += 1
+            yield batch
+        self.epoch += 1
+        self.batch_cursor = 0
+
+    def state_dict(self):
+        r"""cursor of training iteration, with rng states of python, numpy and torch.
+        """
+        name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        rng_state = {
+            "python": random.getstate(),
+            "numpy": (name, keys.tolist(), pos, has_gauss, cached_gaussian),
+            "torch": torch.get_rng_state(),
+        }
+        if torch.cuda.is_available():
+            rng_state["cuda"] = torch.cuda.get_rng_state_all()
+        return {"epoch": self.epoch, "batch_idx": self.batch_cursor, "rng_state": rng_state}
+
+    def load_state_dict(self, state_dict):
+        self.epoch = state_dict["epoch"]
+        self.batch_cursor = state_dict["batch_idx"]
+        rng_state = state_dict["rng_state"]
+        random.setstate(rng_state["python"])
+        name, keys, pos, has_gauss, cached_gaussian = rng_state["numpy"]
+        np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+        torch.set_rng_state(rng_state["torch"].cpu())
+        if "cuda" in rng_state and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([state.cpu() for state in rng_state["cuda"]])
+
+    def _prefetch(self, load_data, type):
+        r"""yield batches of load_data, which runs in a background thread with a cpu copy of dataloader.
+        """
+        device = torch.device(self.device)
+        use_cuda = device.type == 'cuda'
+        stream = torch.cuda.Stream(device) if use_cuda else None
+        # batches are built on cpu by a shallow copy, vocab, dataset and caches are shared.
+        worker = copy.copy(self)
+        worker.device = torch.device('cpu')
+        batches = queue.Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in load_data(worker, type):
+                    event = None
+                    if use_cuda:
+                        with torch.cuda.stream(stream):
+                            batch = _batch_to_device(batch, device, self.host_tensor_keys, pin_memory=True)
+                            event = torch.cuda.Event()
+                            event.record(stream)
+                    if not put((batch, event, None)):
+                        return
+            except BaseException as e:
+                put((None, None, e))
+            finally:
+                put(end)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is end:
+                    break
+                batch, event, error = item
+                if error is not None:
+                    raise error
+                if event is not None:
+                    current_stream = torch.cuda.current_stream(device)
+                    current_stream.wait_event(event)
+                    _record_stream(batch, current_stream)
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def _ept_equ_idx(self, equ_tokens):
+        r"""convert a preprocessed EPT equation into ids, with BOE/EOE but no padding.
+        """
+        if 'vall' in self.decoder:
+            # Convert item into IDs
+            item = [self.dataset.out_symbol2idx.get(tok, EPT.SEQ_UNK_TOK_ID) if tok != EPT.PAD_ID else tok
+                    for tok in equ_tokens]
+            return [EPT.SEQ_NEW_EQN_ID] + item + [EPT.SEQ_END_EQN_ID]
+
+        # Padding for no-operand functions (i.e. special commands)
+        max_arity_pad = [(None, None)] * 2
+        padded_item = [(EPT.FUN_NEW_EQN, max_arity_pad)]
+        for operator, operands in equ_tokens:
+            # We also had to pad operands.
+            remain_arity = max(0, 2 - len(operands))
+            operands = operands + max_arity_pad[:remain_arity]
+            padded_item.append((operator, operands))
+        padded_item.append((EPT.FUN_END_EQN, max_arity_pad))
+
+        expr_sentence = []
+        for operator, operand in padded_item:
+            operator = self.dataset.out_opsym2idx[operator]
+            # Convert operands
+            new_operands = []
+            for src, a in operand:
+                # For each operand, we attach [Src, Value] after the end of new_args.
+                if src is None:
+                    new_operands += [EPT.PAD_ID, EPT.PAD_ID]
+                else:
+                    # Get the source
+                    new_operands.append(EPT.ARG_TOKENS.index(src))
+                    # Get the index of value
+                    if src == EPT.ARG_CON or 'gen' in self.decoder:
+                        # If we need to look up the vocabulary, then find the index in it.
+                        new_operands.append(self.dataset.out_consym2idx.get(a, EPT.ARG_UNK_ID))
+                    else:
+                        # Otherwise, use the index information that is already specified in the operand.
+                        new_operands.append(a)
+            expr_sentence.append([operator] + new_operands)
+        return expr_sentence
+
+    def _encode_ept_datas(self, datas, strip_text=False):
+        r"""encode records for EPT once, tokenizing questions and converting equations into ids.
+
+        Args:
+            datas (list): records.
+            strip_text (bool): strip question text before tokenizing.
+
+        Returns:
+            dict: encoded records, token ids, number positions and equation ids are stored in RaggedArray.
+        """
+        tokenizer = self.pretrained_tokenzier
+        ques_source = []
+        ques = []
+        num_pos = []
+        equ_source = []
+        equ = []
+        num_list = []
+        ans = []
+        ids = []
+        for data in datas:
+            text, numbers = find_ept_numbers_in_text(data['ept']['text'], True)
+            if strip_text:
+                text = text.strip()
+            equ_tokens = ept_equ_preprocess(data['ept']['expr'], self.decoder)
+
+            ques_idx = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text))
+            tokens, number_indicators = ept_tokens_with_number_pos(ques_idx, tokenizer, numbers)
+            ques_source.append(ques_idx)
+            ques.append(tokenizer.convert_tokens_to_ids(tokens))
+            num_pos.append(number_indicators)
+            equ_source.append(equ_tokens)
+            equ.append(self._ept_equ_idx(equ_tokens))
+            num_list.append(numbers)
+            ans.append(data['ept']['answer'])
+            ids.append(data["id"])
+        width = None if 'vall' in self.decoder else 5
+        return {
+            "ques source": RaggedArray(ques_source),
+            "question": RaggedArray(ques),
+            "num pos": RaggedArray(num_pos),
+            "equation": RaggedArray(equ, width),
+            "equ source": equ_source,
+            "num list": num_list,
+            "ans": ans,
+            "id": ids
+        }
+
+    def _get_ept_encoded(self, type, datas, strip_text=False):
+        r"""encoded records of a split, encoded again only if records of the split are replaced.
+        """
+        cached = self._ept_encoded.get(type)
+        if cached is None or cached[0] is not datas or len(cached[1]["id"]) != len(datas):
+            cached = (datas, self._encode_ept_datas(datas, strip_text))
+            self._ept_encoded[type] = cached
+        return cached[1]
+
+    def _load_ept_batch(self, encoded, indices):
+        r"""build an EPT batch from encoded records, only slicing and padding.
+        """
+        tokenizer = self.pretrained_tokenzier
+        indices = list(indices)
+        # Maximum sequence length with BOS and EOS
+        max_len = min(max([encoded["ques source"].length(i) for i in indices]), 510) + 2
+        ques_batch = encoded["question"].pad(indices, tokenizer.convert_tokens_to_ids("<pad>"), max_len)
+        num_pos_batch = encoded["num pos"].pad(indices, EPT.PAD_ID, max_len)
+        equ_batch = encoded["equation"].pad(indices, EPT.PAD_ID)
+
+        ques_tensor_batch = torch.as_tensor(ques_batch).to(self.device)
+        pad_masks = ques_tensor_batch == tokenizer.pad_token_id
+        num_pos_batch = torch.as_tensor(num_pos_batch).long().to(self.device)
+        equ_tensor_batch = torch.as_tensor(equ_batch).to(self.device)
+
+        equ_source_batch = [encoded["equ source"][i] for i in indices]
+        equ_len_batch = [len(equ_tokens) for equ_tokens in equ_source_batch] + [equ_batch.shape[1]] * len(indices)
+        num_list_batch = [encoded["num list"][i] for i in indices]
+        return {
+            "question": ques_tensor_batch,
+            "equation": equ_tensor_batch,
+            "ques mask": pad_masks,
+            "equ len": equ_len_batch,
+            "num list": num_list_batch,
+            "max numbers": max(len(numbers) for numbers in num_list_batch),
+            "num pos": num_pos_batch,
+            "id": [encoded["id"][i] for i in indices],
+            "ans": [encoded["ans"][i] for i in indices],
+            "num size": [len(num_) for num_ in num_list_batch],
+            "ques_source": [encoded["ques source"][i].tolist() for i in indices],
+            "equ_source": equ_source_batch,
+            "infix equation": [],
+        }
@@ -0,0 +1,86 @@
+import random
+
+
+def sequential_batches(indices, batch_size):
+    r"""cut indices into batches of batch_size in order.
+    """
+    indices = list(indices)
+    return [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+
+
+class BucketBatchSampler(object):
+    r"""group records of similar length into batches.
+
+    records are split into pools of `pool_batches` batches (shuffled first if shuffle is True), every pool
+    is sorted by total length and cut into batches, then the order of batches is shuffled. Without shuffle,
+    all records are sorted at once.
+
+    Args:
+        lengths (list): lengths of every record, e.g. (question length, equation length), or int.
+        batch_size (int): number of records per batch.
+        max_tokens (int|None): if set, batch size varies so that batch size * padded length of batch <= max_tokens,
+            the padded length is the sum of padded lengths of all parts of records.
+        shuffle (bool): shuffle records and batches.
+        pool_batches (int): number of batches in a pool sorted together.
+        rng (random.Random|None): random generator used to shuffle, module `random` if None.
+        pad_lengths (tuple|None): length every part is padded to, a part is padded to the longest in batch if its
+            entry is None. All parts are padded to the longest in batch if pad_lengths is None.
+    """
+    def __init__(self, lengths, batch_size, max_tokens=None, shuffle=False, pool_batches=100, rng=None, pad_lengths=None):
+        super().__init__()
+        self.lengths = [tuple(length) if isinstance(length, (tuple, list)) else (length, ) for length in lengths]
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.pool_batches = pool_batches
+        self.rng = rng if rng is not None else random
+        self.pad_lengths = pad_lengths
+
+    def _sort_key(self, index):
+        length = self.lengths[index]
+        return sum(length), length
+
+    def _padded_length(self, longest):
+        if self.pad_lengths is None:
+            return sum(longest)
+        return sum(length if pad is None else pad for length, pad in zip(longest, self.pad_lengths))
+
+    def _cut(self, indices):
+        if not self.max_tokens:
+            return sequential_batches(indices, self.batch_size)
+        batches = []
+        batch = []
+        longest = None
+        for idx in indices:
+            length = self.lengths[idx]
+            if longest is not None:
+                length = tuple(max(l1, l2) for l1, l2 in zip(longest, length))
+            if batch and (len(batch) + 1) * self._padded_length(length) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                length = self.lengths[idx]
+            batch.append(idx)
+            longest = length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def batches(self):
+        r"""index batches of an epoch.
+        """
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            self.rng.shuffle(indices)
+            pool_size = self.batch_size * self.pool_batches
+        else:
+            pool_size = len(indices)
+        batches = []
+        for start in range(0, len(indices), max(pool_size, 1)):
+            pool = sorted(indices[start:start + pool_size], key=self._sort_key)
+            batches += self._cut(pool)
+        if self.shuffle:
+            self.rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
@@ -6,6 +6,8 @@ from mwptoolkit.data.dataloader.template_dataloader import TemplateDataLoader
 from mwptoolkit.utils.utils import str2float
 
 class DataLoaderMultiEncDec(TemplateDataLoader):
+    host_tensor_keys = ("input1 len",)
+
     def __init__(self, config, dataset):
         super().__init__(config, dataset)
         try:
@@ -194,10 +196,7 @@ class DataLoaderMultiEncDec(TemplateDataLoader):
         return equ_idx
     
     def _pad_output1_batch(self, batch_target, batch_target_len):
-        if self.max_equ_len != None:
-            max_length = self.max_equ_len
-        else:
-            max_length = max(batch_target_len)
+        max_length = self._output_pad_length(batch_target_len)
         for idx, length in enumerate(batch_target_len):
             if length < max_length:
                 batch_target[idx] += [self.out_pad_token1 for i in range(max_length - length)]
@@ -206,10 +205,7 @@ class DataLoaderMultiEncDec(TemplateDataLoader):
         return batch_target
     
     def _pad_output2_batch(self, batch_target, batch_target_len):
-        if self.max_equ_len != None:
-            max_length = self.max_equ_len
-        else:
-            max_length = max(batch_target_len)
+        max_length = self._output_pad_length(batch_target_len)
         for idx, length in enumerate(batch_target_len):
             if length < max_length:
                 batch_target[idx] += [self.out_pad_token2 for i in range(max_length - length)]
@@ -218,10 +214,7 @@ class DataLoaderMultiEncDec(TemplateDataLoader):
         return batch_target
 
     def _pad_input1_batch(self, batch_seq, batch_seq_len):
-        if self.max_len != None:
-            max_length = self.max_len
-        else:
-            max_length = max(batch_seq_len)
+        max_length = self._input_pad_length(batch_seq_len)
         for idx, length in enumerate(batch_seq_len):
             if length < max_length:
                 batch_seq[idx] += [self.in_pad_token1 for i in range(max_length - length)]
@@ -229,10 +222,7 @@ class DataLoaderMultiEncDec(TemplateDataLoader):
                 batch_seq[idx] = batch_seq[idx][:max_length]
         return batch_seq
     def _pad_input2_batch(self, batch_seq, batch_seq_len):
-        if self.max_len != None:
-            max_length = self.max_len
-        else:
-            max_length = max(batch_seq_len)
+        max_length = self._input_pad_length(batch_seq_len)
         for idx, length in enumerate(batch_seq_len):
             if length < max_length:
                 batch_seq[idx] += [self.in_pad_token2 for i in range(max_length - length)]
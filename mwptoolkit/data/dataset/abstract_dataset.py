@@ -1,12 +1,23 @@
 import random
 import os
 import copy
+import hashlib
+import json
+import pickle
+import shutil
+from logging import getLogger
+
 import torch
 from mwptoolkit.utils.utils import read_json_data, write_json_data
 from mwptoolkit.utils.preprocess_tools import operator_mask, EN_rule1_stat, EN_rule2_
 from mwptoolkit.utils.preprocess_tools import get_group_nums, get_deprel_tree, get_span_level_deprel_tree
 from mwptoolkit.utils.preprocess_tools import id_reedit
+from mwptoolkit.utils.parse_service import save_dependency_parsers
 from mwptoolkit.utils.enum_type import DatasetName
+from mwptoolkit.utils.data_structure import RecordArray
+
+DATASET_CACHE_VERSION = 2
+DATASET_CACHE_SPLITS = ['trainset', 'validset', 'testset']
 
 
 class AbstractDataset(object):
@@ -31,6 +42,8 @@ class AbstractDataset(object):
         self.equation_fix = config["equation_fix"]
         self.root = config['root']
         self.rebuild = config['rebuild']
+        self.dataset_cache = config['dataset_cache']
+        self.preprocess_workers = config['preprocess_workers']
         self.max_span_size = 1
 
     def _load_dataset(self):
@@ -134,23 +147,33 @@ class AbstractDataset(object):
         for idx, data in enumerate(self.testset):
             self.testset[idx]["equation"] = EN_rule2_(data["equation"])
 
+    def _get_parse_cache(self):
+        r"""file of cached dependency parses, shared by models using the dataset.
+        """
+        return os.path.join(self.root, self.dataset_path, 'cache', 'deprel_{}.pkl'.format(self.language))
+
     def build_group_nums_for_graph(self):
         use_gpu = True if self.device == torch.device('cuda') else False
-        self.trainset = get_group_nums(self.trainset, self.language, use_gpu)
-        self.validset = get_group_nums(self.validset, self.language, use_gpu)
-        self.testset = get_group_nums(self.testset, self.language, use_gpu)
+        parse_cache = self._get_parse_cache()
+        self.trainset = get_group_nums(self.trainset, self.language, use_gpu, parse_cache)
+        self.validset = get_group_nums(self.validset, self.language, use_gpu, parse_cache)
+        self.testset = get_group_nums(self.testset, self.language, use_gpu, parse_cache)
 
     def build_deprel_tree(self):
-        self.trainset, tokens = get_deprel_tree(self.trainset, self.language)
-        self.validset, _ = get_deprel_tree(self.validset, self.language)
-        self.testset, _ = get_deprel_tree(self.testset, self.language)
+        use_gpu = True if self.device == torch.device('cuda') else False
+        parse_cache = self._get_parse_cache()
+        self.trainset, tokens = get_deprel_tree(self.trainset, self.language, use_gpu, parse_cache)
+        self.validset, _ = get_deprel_tree(self.validset, self.language, use_gpu, parse_cache)
+        self.testset, _ = get_deprel_tree(self.testset, self.language, use_gpu, parse_cache)
 
         #self._update_vocab(tokens)
 
     def build_span_level_deprel_tree(self):
-        self.trainset, train_span_szie = get_span_level_deprel_tree(self.trainset, self.language)
-        self.validset, valid_span_size = get_span_level_deprel_tree(self.validset, self.language)
-        self.testset, test_span_size = get_span_level_deprel_tree(self.testset, self.language)
+        use_gpu = True if self.device == torch.device('cuda') else False
+        parse_cache = self._get_parse_cache()
+        self.trainset, train_span_szie = get_span_level_deprel_tree(self.trainset, self.language, use_gpu, parse_cache)
+        self.validset, valid_span_size = get_span_level_deprel_tree(self.validset, self.language, use_gpu, parse_cache)
+        self.testset, test_span_size = get_span_level_deprel_tree(self.testset, self.language, use_gpu, parse_cache)
         self.max_span_size = max([train_span_szie, valid_span_size, test_span_size])
 
     def cross_validation_load(self, k_fold, start_fold_t=0):
@@ -192,15 +215,96 @@ class AbstractDataset(object):
                     else:
                         self.trainset += copy.deepcopy(folds[fold_t])
             self._preprocess()
+            save_dependency_parsers()
             self._build_vocab()
             yield k
 
     def dataset_load(self):
         r"""dataset process and build vocab
+
+        the processed dataset is read from cache if dataset_cache is set and the cache matches,
+        otherwise it's processed from dataset files and then cached.
         """
+        cache_file = self._get_cache_file() if self.dataset_cache else None
+        if cache_file and not self.rebuild and self._load_cache(cache_file):
+            return
         self._load_dataset()
         self._preprocess()
+        save_dependency_parsers()
         self._build_vocab()
+        if cache_file:
+            self._save_cache(cache_file)
+
+    def _get_cache_key(self):
+        r"""digest of dataset files and preprocessing-relevant settings.
+
+        settings are all plain attributes of dataset (e.g. mask_symbol, equation_fix, model),
+        so that keys of subclasses are included too.
+        """
+        md5 = hashlib.md5()
+        settings = {}
+        for key, value in self.__dict__.items():
+            if key in ['root', 'rebuild', 'dataset_cache', 'preprocess_workers']:
+                continue
+            if isinstance(value, (str, int, float, bool)) or value is None:
+                settings[key] = value
+        md5.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        md5.update(str(DATASET_CACHE_VERSION).encode('utf-8'))
+
+        # only files existing before preprocessing, parse tree files are written by the first run.
+        files = [self.dataset_path + "/trainset.json", self.dataset_path + "/validset.json", self.dataset_path + "/testset.json"]
+        for file in files:
+            file = os.path.join(self.root, file)
+            if not os.path.exists(file):
+                md5.update(b'-')
+                continue
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    md5.update(chunk)
+        return md5.hexdigest()
+
+    def _get_cache_file(self):
+        cache_dir = os.path.join(self.root, self.dataset_path, 'cache')
+        return os.path.join(cache_dir, '{}_{}'.format(self.model.lower(), self._get_cache_key()))
+
+    def _load_cache(self, cache_file):
+        r"""restore processed dataset from cache directory, records of splits are memory-mapped.
+
+        Returns:
+            bool: True if the cache is loaded.
+        """
+        state_file = os.path.join(cache_file, 'state.pkl')
+        if not os.path.exists(state_file):
+            return False
+        try:
+            with open(state_file, 'rb') as f:
+                cache = pickle.load(f)
+            if cache.get('version') != DATASET_CACHE_VERSION:
+                return False
+            splits = {key: RecordArray.load(os.path.join(cache_file, key)) for key in DATASET_CACHE_SPLITS}
+        except:
+            return False
+        logger = getLogger()
+        logger.info("read processed dataset from {} ...".format(cache_file))
+        self.__dict__.update(cache['state'])
+        self.__dict__.update(splits)
+        return True
+
+    def _save_cache(self, cache_file):
+        state = {}
+        for key, value in self.__dict__.items():
+            if key in ['root', 'rebuild', 'dataset_cache', 'preprocess_workers', 'device'] + DATASET_CACHE_SPLITS:
+                continue
+            state[key] = value
+        temp_dir = '{}.tmp{}'.format(cache_file, os.getpid())
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        for key in DATASET_CACHE_SPLITS:
+            RecordArray(getattr(self, key)).save(os.path.join(temp_dir, key))
+        # state file is written last, a directory without it is never loaded.
+        with open(os.path.join(temp_dir, 'state.pkl'), 'wb') as f:
+            pickle.dump({'version': DATASET_CACHE_VERSION, 'state': state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        shutil.rmtree(cache_file, ignore_errors=True)
+        os.replace(temp_dir, cache_file)
 
     def _preprocess(self):
         raise NotImplementedError
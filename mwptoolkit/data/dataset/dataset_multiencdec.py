@@ -6,7 +6,7 @@ import stanza
 from mwptoolkit.data.dataset.template_dataset import TemplateDataset
 from mwptoolkit.utils.enum_type import NumMask, SpecialTokens, FixType, Operators, MaskSymbol, SPECIAL_TOKENS, DatasetName, TaskType
 from mwptoolkit.utils.preprocess_tools import number_transfer, number_transfer_asdiv_a, number_transfer_math23k, number_transfer_ape200k, number_transfer_svamp, write_json_data
-from mwptoolkit.utils.preprocess_tools import num_transfer_draw, num_transfer_multi, num_transfer_alg514, num_transfer_hmwp
+from mwptoolkit.utils.preprocess_tools import num_transfer_draw, num_transfer_multi, num_transfer_alg514, num_transfer_hmwp, parallel_number_transfer
 from mwptoolkit.utils.preprocess_tools import from_infix_to_postfix, from_infix_to_prefix
 from mwptoolkit.utils.preprocess_tools import id_reedit
 from mwptoolkit.utils.utils import read_json_data
@@ -43,14 +43,14 @@ class DatasetMultiEncDec(TemplateDataset):
             elif self.task_type == TaskType.MultiEquation:
                 transfer = num_transfer_multi
         if self.task_type == TaskType.SingleEquation:
-            self.trainset, generate_list, train_copy_nums = transfer(self.trainset, self.mask_symbol, self.min_generate_keep)
-            self.validset, _g, valid_copy_nums = transfer(self.validset, self.mask_symbol, self.min_generate_keep)
-            self.testset, _g, test_copy_nums = transfer(self.testset, self.mask_symbol, self.min_generate_keep)
+            self.trainset, generate_list, train_copy_nums = parallel_number_transfer(transfer, self.trainset, self.mask_symbol, self.min_generate_keep, workers=self.preprocess_workers)
+            self.validset, _g, valid_copy_nums = parallel_number_transfer(transfer, self.validset, self.mask_symbol, self.min_generate_keep, workers=self.preprocess_workers)
+            self.testset, _g, test_copy_nums = parallel_number_transfer(transfer, self.testset, self.mask_symbol, self.min_generate_keep, workers=self.preprocess_workers)
             unk_symbol=[]
         elif self.task_type == TaskType.MultiEquation:
-            self.trainset, generate_list, train_copy_nums, unk_symbol = transfer(self.trainset, self.mask_symbol, self.min_generate_keep, ";")
-            self.validset, _g, valid_copy_nums, _u = transfer(self.validset, self.mask_symbol, self.min_generate_keep, ";")
-            self.testset, _g, test_copy_nums, _u = transfer(self.testset, self.mask_symbol, self.min_generate_keep, ";")
+            self.trainset, generate_list, train_copy_nums, unk_symbol = parallel_number_transfer(transfer, self.trainset, self.mask_symbol, self.min_generate_keep, ";", workers=self.preprocess_workers)
+            self.validset, _g, valid_copy_nums, _u = parallel_number_transfer(transfer, self.validset, self.mask_symbol, self.min_generate_keep, ";", workers=self.preprocess_workers)
+            self.testset, _g, test_copy_nums, _u = parallel_number_transfer(transfer, self.testset, self.mask_symbol, self.min_generate_keep, ";", workers=self.preprocess_workers)
         else:
             raise NotImplementedError
         for idx, data in enumerate(self.trainset):
@@ -9,7 +9,7 @@ import torch
 
 from mwptoolkit.data.dataset.abstract_dataset import AbstractDataset
 from mwptoolkit.utils.preprocess_tools import from_infix_to_postfix, from_infix_to_prefix, from_infix_to_multi_way_tree, postfix_parser
-from mwptoolkit.utils.preprocess_tools import num_transfer_draw, num_transfer_multi, num_transfer_alg514, num_transfer_hmwp
+from mwptoolkit.utils.preprocess_tools import num_transfer_draw, num_transfer_multi, num_transfer_alg514, num_transfer_hmwp, parallel_number_transfer
 from mwptoolkit.utils.preprocess_tools import deprel_tree_to_file, get_group_nums_, span_level_deprel_tree_to_file, get_span_level_deprel_tree_, get_deprel_tree_, preprocess_ept_dataset_
 from mwptoolkit.utils.preprocess_tools import id_reedit, read_aux_jsonl_data
 from mwptoolkit.utils.enum_type import MaskSymbol, Operators, SPECIAL_TOKENS, NumMask, SpecialTokens, FixType, DatasetName, EPT
@@ -46,9 +46,9 @@ class MultiEquationDataset(AbstractDataset):
             transfer = num_transfer_hmwp
         else:
             transfer = num_transfer_multi
-        self.trainset, generate_list, train_copy_nums, unk_symbol = transfer(self.trainset, self.mask_symbol, self.min_generate_keep, ";")
-        self.validset, _g, valid_copy_nums, _u = transfer(self.validset, self.mask_symbol, self.min_generate_keep, ";")
-        self.testset, _g, test_copy_nums, _u = transfer(self.testset, self.mask_symbol, self.min_generate_keep, ";")
+        self.trainset, generate_list, train_copy_nums, unk_symbol = parallel_number_transfer(transfer, self.trainset, self.mask_symbol, self.min_generate_keep, ";", workers=self.preprocess_workers)
+        self.validset, _g, valid_copy_nums, _u = parallel_number_transfer(transfer, self.validset, self.mask_symbol, self.min_generate_keep, ";", workers=self.preprocess_workers)
+        self.testset, _g, test_copy_nums, _u = parallel_number_transfer(transfer, self.testset, self.mask_symbol, self.min_generate_keep, ";", workers=self.preprocess_workers)
 
         if self.rule1:
             if self.linear and self.single:
@@ -99,7 +99,7 @@ class MultiEquationDataset(AbstractDataset):
                 logger = getLogger()
                 logger.info("build deprel tree infomation to {} ...".format(self.parse_tree_path))
                 deprel_tree_to_file(self.trainset, self.validset, self.testset, \
-                                        self.parse_tree_path, self.language, use_gpu)
+                                        self.parse_tree_path, self.language, use_gpu, self._get_parse_cache())
                 self.trainset, self.validset, self.testset, token_list =\
                     get_deprel_tree_(self.trainset, self.validset, self.testset, self.parse_tree_path)
         if self.model.lower() in ['hms']:
@@ -112,7 +112,7 @@ class MultiEquationDataset(AbstractDataset):
                 logger = getLogger()
                 logger.info("build span-level deprel tree infomation to {} ...".format(self.parse_tree_path))
                 span_level_deprel_tree_to_file(self.trainset, self.validset, self.testset, \
-                                                self.parse_tree_path, self.language, use_gpu)
+                                                self.parse_tree_path, self.language, use_gpu, self._get_parse_cache())
                 self.trainset, self.validset, self.testset, self.max_span_size =\
                     get_span_level_deprel_tree_(self.trainset, self.validset, self.testset, self.parse_tree_path)
         if self.model.lower() in ['graph2tree']:
@@ -125,7 +125,7 @@ class MultiEquationDataset(AbstractDataset):
                 logger = getLogger()
                 logger.info("build deprel tree infomation to {} ...".format(self.parse_tree_path))
                 deprel_tree_to_file(self.trainset, self.validset, self.testset, \
-                                        self.parse_tree_path, self.language, use_gpu)
+                                        self.parse_tree_path, self.language, use_gpu, self._get_parse_cache())
                 self.trainset, self.validset, self.testset =\
                     get_group_nums_(self.trainset, self.validset, self.testset, self.parse_tree_path)
         if self.model.lower() in ["ept"]:
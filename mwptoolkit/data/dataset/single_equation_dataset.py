@@ -9,7 +9,7 @@ import torch
 
 from mwptoolkit.data.dataset.abstract_dataset import AbstractDataset
 from mwptoolkit.utils.preprocess_tools import from_infix_to_postfix, from_infix_to_prefix, from_infix_to_multi_way_tree, postfix_parser
-from mwptoolkit.utils.preprocess_tools import number_transfer_math23k, number_transfer_ape200k, number_transfer_svamp,number_transfer_asdiv_a
+from mwptoolkit.utils.preprocess_tools import number_transfer_math23k, number_transfer_ape200k, number_transfer_svamp,number_transfer_asdiv_a, parallel_number_transfer
 from mwptoolkit.utils.preprocess_tools import deprel_tree_to_file, get_group_nums_, span_level_deprel_tree_to_file, get_span_level_deprel_tree_, get_deprel_tree_, preprocess_ept_dataset_
 from mwptoolkit.utils.enum_type import MaskSymbol, NumMask, SpecialTokens, FixType, Operators, DatasetName, EPT
 from mwptoolkit.utils.enum_type import OPERATORS, SPECIAL_TOKENS
@@ -44,9 +44,9 @@ class SingleEquationDataset(AbstractDataset):
             transfer = number_transfer_asdiv_a
         else:
             NotImplementedError
-        self.trainset, generate_list, train_copy_nums = transfer(self.trainset, self.mask_symbol, self.min_generate_keep)
-        self.validset, _g, valid_copy_nums = transfer(self.validset, self.mask_symbol, self.min_generate_keep)
-        self.testset, _g, test_copy_nums = transfer(self.testset, self.mask_symbol, self.min_generate_keep)
+        self.trainset, generate_list, train_copy_nums = parallel_number_transfer(transfer, self.trainset, self.mask_symbol, self.min_generate_keep, workers=self.preprocess_workers)
+        self.validset, _g, valid_copy_nums = parallel_number_transfer(transfer, self.validset, self.mask_symbol, self.min_generate_keep, workers=self.preprocess_workers)
+        self.testset, _g, test_copy_nums = parallel_number_transfer(transfer, self.testset, self.mask_symbol, self.min_generate_keep, workers=self.preprocess_workers)
 
         if self.rule1:
             if self.linear and self.single:
@@ -96,7 +96,7 @@ class SingleEquationDataset(AbstractDataset):
                 logger = getLogger()
                 logger.info("build deprel tree infomation to {} ...".format(self.parse_tree_path))
                 deprel_tree_to_file(self.trainset, self.validset, self.testset, \
-                                        self.parse_tree_path, self.language, use_gpu)
+                                        self.parse_tree_path, self.language, use_gpu, self._get_parse_cache())
                 self.trainset, self.validset, self.testset, token_list =\
                     get_deprel_tree_(self.trainset, self.validset, self.testset, self.parse_tree_path)
         if self.model.lower() in ['hms']:
@@ -109,7 +109,7 @@ class SingleEquationDataset(AbstractDataset):
                 logger = getLogger()
                 logger.info("build span-level deprel tree infomation to {} ...".format(self.parse_tree_path))
                 span_level_deprel_tree_to_file(self.trainset, self.validset, self.testset, \
-                                                self.parse_tree_path, self.language, use_gpu)
+                                                self.parse_tree_path, self.language, use_gpu, self._get_parse_cache())
                 self.trainset, self.validset, self.testset, self.max_span_size =\
                     get_span_level_deprel_tree_(self.trainset, self.validset, self.testset, self.parse_tree_path)
         if self.model.lower() in ['graph2tree']:
@@ -122,7 +122,7 @@ class SingleEquationDataset(AbstractDataset):
                 logger = getLogger()
                 logger.info("build deprel tree infomation to {} ...".format(self.parse_tree_path))
                 deprel_tree_to_file(self.trainset, self.validset, self.testset, \
-                                        self.parse_tree_path, self.language, use_gpu)
+                                        self.parse_tree_path, self.language, use_gpu, self._get_parse_cache())
                 self.trainset, self.validset, self.testset =\
                     get_group_nums_(self.trainset, self.validset, self.testset, self.parse_tree_path)
         if self.model.lower() in ["ept"]:
@@ -0,0 +1,132 @@
+import re
+
+import numpy as np
+
+PAD = -1
+OPERAND = 0
+ADD = 1
+SUB = 2
+MUL = 3
+DIV = 4
+POW = 5
+INVALID = 6
+
+OPERATOR_CODES = {"+": ADD, "-": SUB, "*": MUL, "/": DIV, "^": POW}
+
+_number_values = {}
+
+
+def parse_number(p):
+    r"""value of a number symbol, e.g. '3', '3.5', '3/4', '(3/4)', '50%' and '1(1/2)'.
+
+    Returns:
+        float|None: None if symbol is not a number.
+    """
+    if p in _number_values:
+        return _number_values[p]
+    try:
+        pos = re.search(r"\d+\(", p)
+        if pos:
+            value = eval(p[pos.start():pos.end() - 1] + "+" + p[pos.end() - 1:])
+        elif p[-1] == "%":
+            value = float(p[:-1]) / 100
+        else:
+            value = eval(p)
+        value = float(value)
+    except:
+        value = None
+    _number_values[p] = value
+    return value
+
+
+def compile_expressions(expressions, prefix=False):
+    r"""compile a batch of postfix (or prefix) expressions into code array and operand value array.
+
+    Args:
+        expressions (list): list of symbol lists, numbers are bound in, e.g. ['3', '5', '+'].
+        prefix (bool): expressions are prefix if True, they are stored reversed.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): codes and values, shape [batch_size, max_len].
+    """
+    batch_size = len(expressions)
+    max_len = max([len(exp) if exp else 0 for exp in expressions] + [1])
+    codes = np.full((batch_size, max_len), PAD, dtype=np.int64)
+    values = np.zeros((batch_size, max_len), dtype=np.float64)
+    for b, exp in enumerate(expressions):
+        if exp is None or len(exp) == 0:
+            codes[b, 0] = INVALID
+            continue
+        if prefix:
+            exp = exp[::-1]
+        for t, p in enumerate(exp):
+            if p in OPERATOR_CODES:
+                codes[b, t] = OPERATOR_CODES[p]
+                continue
+            value = parse_number(p)
+            if value is None:
+                codes[b, t] = INVALID
+            else:
+                codes[b, t] = OPERAND
+                values[b, t] = value
+    return codes, values
+
+
+def compute_expressions(codes, values, prefix=False):
+    r"""evaluate compiled expressions of a batch in one stack machine pass.
+
+    every step pushes operands and applies operators of all expressions at once.
+    an expression is invalid if operands are not enough, a number is divided by 0,
+    the exponent is not 2 or 3, or more than one value is left on stack.
+
+    Args:
+        codes (numpy.ndarray): operator/operand codes, shape [batch_size, max_len].
+        values (numpy.ndarray): operand values, shape [batch_size, max_len].
+        prefix (bool): codes are reversed prefix expressions if True.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): value and valid mask of expressions, shape [batch_size].
+    """
+    batch_size, max_len = codes.shape
+    stack = np.zeros((batch_size, max_len + 1), dtype=np.float64)
+    sp = np.zeros(batch_size, dtype=np.int64)
+    valid = np.ones(batch_size, dtype=bool)
+    rows = np.arange(batch_size)
+    for t in range(max_len):
+        code = codes[:, t]
+        valid &= code != INVALID
+
+        push = valid & (code == OPERAND)
+        stack[rows[push], sp[push]] = values[push, t]
+        sp[push] += 1
+
+        is_op = valid & (code > OPERAND) & (code < INVALID)
+        valid &= ~(is_op & (sp < 2))
+        is_op &= valid
+        idx = rows[is_op]
+        if len(idx) == 0:
+            continue
+        top = stack[idx, sp[idx] - 1]
+        second = stack[idx, sp[idx] - 2]
+        if prefix:
+            left, right = top, second
+        else:
+            left, right = second, top
+        op = code[idx]
+        with np.errstate(all='ignore'):
+            result = np.select([op == ADD, op == SUB, op == MUL, op == DIV, op == POW],
+                               [left + right, left - right, left * right, left / right, left**right])
+        bad = ((op == DIV) & (right == 0)) | ((op == POW) & (right != 2.) & (right != 3.)) | ~np.isfinite(result)
+        valid[idx[bad]] = False
+        idx = idx[~bad]
+        stack[idx, sp[idx] - 2] = result[~bad]
+        sp[idx] -= 1
+    valid &= sp == 1
+    return stack[:, 0], valid
+
+
+def compute_expressions_batch(expressions, prefix=False):
+    r"""compile and evaluate a batch of postfix (or prefix) expressions.
+    """
+    codes, values = compile_expressions(expressions, prefix)
+    return compute_expressions(codes, values, prefix)
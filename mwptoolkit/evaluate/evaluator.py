@@ -1,33 +1,15 @@
 import copy
+import os
 import re
-import threading
+import numpy as np
 import sympy as sym
+from mwptoolkit.evaluate.batch_calculator import compute_expressions_batch
+from mwptoolkit.evaluate.solve_cache import get_solve_cache
+from mwptoolkit.evaluate.solver_pool import get_solver_pool
 from mwptoolkit.utils.enum_type import SpecialTokens, OPERATORS, NumMask, MaskSymbol
 from mwptoolkit.utils.preprocess_tools import from_infix_to_postfix
 
 
-class Solver(threading.Thread):
-    r"""time-limited solving equation machanism based threading.
-    """
-    def __init__(self, func, equations, unk_symbol):
-        super(Solver, self).__init__()
-        self.func = func
-        self.equations = equations
-        self.unk_symbol = unk_symbol
-
-    def run(self):
-        try:
-            self.result = self.func(self.equations, self.unk_symbol)
-        except:
-            self.result = None
-
-    def get_result(self):
-        try:
-            return self.result
-        except:
-            return None
-
-
 class AbstractEvaluator(object):
     def __init__(self, symbol2idx, idx2symbol, config):
         super().__init__()
@@ -64,12 +46,190 @@ class AbstractEvaluator(object):
         except:
             self.unk_idx = None
 
+        solve_timeout = config["solve_timeout"] if config["solve_timeout"] else 10
+        self.solver = get_solver_pool(config["solver_workers"], solve_timeout)
+        if config["persist_solve_cache"] and config["dataset_path"]:
+            cache_path = os.path.join(config["dataset_path"], "solve_cache.pkl")
+        else:
+            cache_path = None
+        solve_cache_size = config["solve_cache_size"] if config["solve_cache_size"] else 100000
+        self.solve_cache = get_solve_cache(solve_cache_size, cache_path)
+
     def result(self):
         raise NotImplementedError
 
     def result_multi(self):
         raise NotImplementedError
 
+    def result_batch(self):
+        raise NotImplementedError
+
+    def result_multi_batch(self):
+        raise NotImplementedError
+
+    def _result_batch(self, test_list, tar_list, to_calculable=None, prefix=False):
+        r"""evaluate single equations of a batch, all expressions are calculated together by vectorized stack machine.
+
+        Args:
+            test_list (list): predicted equations.
+            tar_list (list): target equations.
+            to_calculable (function|None): convert an equation to postfix (prefix) expression, no conversion if None.
+            prefix (bool): expressions are prefix if True.
+
+        Returns:
+            tuple(list, list): value accuracy and equation accuracy of every pair.
+        """
+        test_exps = []
+        tar_exps = []
+        for test, tar in zip(test_list, tar_list):
+            for exp, exps in [(test, test_exps), (tar, tar_exps)]:
+                try:
+                    exps.append(to_calculable(exp) if to_calculable else exp)
+                except:
+                    exps.append(None)
+        test_values, test_valid = compute_expressions_batch(test_exps, prefix)
+        tar_values, tar_valid = compute_expressions_batch(tar_exps, prefix)
+        with np.errstate(all='ignore'):
+            val_acc = test_valid & tar_valid & (np.abs(test_values - tar_values) < 1e-4)
+        equ_acc = np.array([test == tar for test, tar in zip(test_list, tar_list)], dtype=bool)
+        val_acc = val_acc | equ_acc
+        return val_acc.tolist(), equ_acc.tolist()
+
+    @staticmethod
+    def _split_results(results):
+        val_acc = [result[0] for result in results]
+        equ_acc = [result[1] for result in results]
+        return val_acc, equ_acc
+
+    def solve_batch(self, tasks):
+        r"""solve a batch of equation systems, solutions are looked up in solve cache first,
+        and only distinct systems missing in cache are sent to the solver pool.
+
+        Args:
+            tasks (list): list of (equations, unknowns).
+
+        Returns:
+            list: solution of every task.
+        """
+        keys = []
+        miss_keys = []
+        miss_key_set = set()
+        miss_tasks = []
+        for equations, unk_list in tasks:
+            try:
+                key = self.solve_cache.canonical_key(equations, unk_list)
+            except:
+                key = None
+            keys.append(key)
+            if key is None:
+                continue
+            if key not in self.solve_cache and key not in miss_key_set:
+                miss_keys.append(key)
+                miss_key_set.add(key)
+                miss_tasks.append((equations, unk_list))
+        miss_solves = self.solver.solve_batch(miss_tasks)
+        solves = dict(zip(miss_keys, miss_solves))
+        for key, solve in solves.items():
+            # None is a timeout or failure of solver, it is not cached so that it is solved again later.
+            if solve is not None:
+                self.solve_cache.put(key, solve)
+        results = []
+        for key, task in zip(keys, tasks):
+            if key is None:
+                results.append(self.solver.solve(*task))
+            elif key in solves:
+                results.append(solves[key])
+            else:
+                results.append(self.solve_cache.get(key))
+        return results
+
+    def _compare_solves(self, test_solves, test_unk, tar_solves, tar_unk):
+        r"""compare solutions of predicted equations and target equations.
+        """
+        flag = False
+        if len(tar_unk) == 1:
+            if len(tar_solves) == 1:
+                test_ans = test_solves[list(test_unk.values())[0]]
+                tar_ans = tar_solves[list(tar_unk.values())[0]]
+                if abs(test_ans - tar_ans) < 1e-4:
+                    flag = True
+            else:
+                flag = True
+                for test_ans, tar_ans in zip(test_solves, tar_solves):
+                    if abs(test_ans[0] - tar_ans[0]) > 1e-4:
+                        flag = False
+                        break
+
+        else:
+            if len(tar_solves) == len(tar_unk):
+                flag = True
+                for tar_x in list(tar_unk.values()):
+                    test_ans = test_solves[tar_x]
+                    tar_ans = tar_solves[tar_x]
+                    if abs(test_ans - tar_ans) > 1e-4:
+                        flag = False
+                        break
+            else:
+                for test_ans, tar_ans in zip(test_solves, tar_solves):
+                    try:
+                        te_ans = float(test_ans[0])
+                    except:
+                        te_ans = float(test_ans[1])
+                    try:
+                        ta_ans = float(tar_ans[0])
+                    except:
+                        ta_ans = float(tar_ans[1])
+                    if abs(te_ans - ta_ans) > 1e-4:
+                        flag = False
+                        break
+        return flag
+
+    def _result_multi_batch(self, test_list, tar_list, build_equations):
+        r"""evaluate multiple equations of a batch, all equation systems are solved together by the solver pool.
+
+        Args:
+            test_list (list): predicted equations.
+            tar_list (list): target equations.
+            build_equations (function): convert an equation to (sympy equations, unknown symbols).
+
+        Returns:
+            list: (value accuracy, equation accuracy, test, tar) of every pair.
+        """
+        results = [None] * len(test_list)
+        tasks = []
+        task_idxs = []
+        task_unks = []
+        for idx, (test, tar) in enumerate(zip(test_list, tar_list)):
+            if test == []:
+                results[idx] = (False, False, test, tar)
+                continue
+            if test == tar:
+                results[idx] = (True, True, test, tar)
+                continue
+            try:
+                test_equations, test_unk = build_equations(test)
+                tar_equations, tar_unk = build_equations(tar)
+            except:
+                results[idx] = (False, False, test, tar)
+                continue
+            if test_equations is None or tar_equations is None or len(test_unk) != len(tar_unk):
+                results[idx] = (False, False, test, tar)
+                continue
+            tasks.append((test_equations, list(test_unk.values())))
+            tasks.append((tar_equations, list(tar_unk.values())))
+            task_idxs.append(idx)
+            task_unks.append((test_unk, tar_unk))
+        solves = self.solve_batch(tasks)
+        self.solve_cache.save()
+        for i, idx in enumerate(task_idxs):
+            test_unk, tar_unk = task_unks[i]
+            try:
+                flag = self._compare_solves(solves[2 * i], test_unk, solves[2 * i + 1], tar_unk)
+            except:
+                flag = False
+            results[idx] = (flag, False, test_list[idx], tar_list[idx])
+        return results
+
 
 class SeqEvaluator(AbstractEvaluator):
     r"""evaluator for normal equation sequnence.
@@ -95,65 +255,25 @@ class SeqEvaluator(AbstractEvaluator):
         except:
             return False, False, tar_exp, tar_exp
 
+    def result_batch(self, res_exps, tar_exps):
+        r"""evaluate single equations of a batch.
+
+        Returns:
+            tuple(list, list): value accuracy and equation accuracy of every pair.
+        """
+        if (self.single and self.linear) != True:  # single but non-linear
+            return self._split_results(self.result_multi_batch(res_exps, tar_exps))
+        return self._result_batch(res_exps, tar_exps, from_infix_to_postfix)
+
     def result_multi(self, res_exp, tar_exp):
         r"""evaluate multiple euqations.
         """
-        #print(test_tar)# tensor([20,  8, 10, 12,  5, 13, 11,  2])
-        #res_exp = self.out_expression_list(test_res, num_list, copy.deepcopy(num_stack))
-        #tar_exp = self.out_expression_list(test_tar, num_list, copy.deepcopy(num_stack))
-        #print(tar_exp)# ['x', '=', '(', '4', '*', '3', ')']
-        if res_exp == []:
-            return False, False, res_exp, tar_exp
-        if res_exp == tar_exp:
-            return True, True, res_exp, tar_exp
-        try:
-            test_solves, test_unk = self.compute_expression_by_postfix_multi(res_exp)
-            tar_solves, tar_unk = self.compute_expression_by_postfix_multi(tar_exp)
-            if len(test_unk) != len(tar_unk):
-                return False, False, res_exp, tar_exp
-            flag = False
-            if len(tar_unk) == 1:
-                if len(tar_solves) == 1:
-                    test_ans = test_solves[list(test_unk.values())[0]]
-                    tar_ans = tar_solves[list(tar_unk.values())[0]]
-                    if abs(test_ans - tar_ans) < 1e-4:
-                        flag = True
-                else:
-                    flag = True
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        if abs(test_ans[0] - tar_ans[0]) > 1e-4:
-                            flag = False
-                            break
+        return self.result_multi_batch([res_exp], [tar_exp])[0]
 
-            else:
-                if len(tar_solves) == len(tar_unk):
-                    flag = True
-                    for tar_x in list(tar_unk.values()):
-                        test_ans = test_solves[tar_x]
-                        tar_ans = tar_solves[tar_x]
-                        if abs(test_ans - tar_ans) > 1e-4:
-                            flag = False
-                            break
-                else:
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        try:
-                            te_ans = float(test_ans[0])
-
-                        except:
-                            te_ans = float(test_ans[1])
-                        try:
-                            ta_ans = float(tar_ans[0])
-                        except:
-                            ta_ans = float(tar_ans[1])
-                        if abs(te_ans - ta_ans) > 1e-4:
-                            flag = False
-                            break
-            if flag == True:
-                return True, False, tar_exp, tar_exp
-            else:
-                return False, False, tar_exp, tar_exp
-        except:
-            return False, False, tar_exp, tar_exp
+    def result_multi_batch(self, res_exps, tar_exps):
+        r"""evaluate multiple equations of a batch.
+        """
+        return self._result_multi_batch(res_exps, tar_exps, self.build_equations_by_postfix)
 
     def out_expression_list(self, test, num_list, num_stack=None):
         #alphabet="abcdefghijklmnopqrstuvwxyz"
@@ -224,7 +344,7 @@ class SeqEvaluator(AbstractEvaluator):
             return st.pop()
         return None
 
-    def compute_postfix_expression_multi(self, post_fix):
+    def build_postfix_equations(self, post_fix):
         st = list()
         operators = ["+", "-", "^", "*", "/", "=", "<BRG>"]
         unk_symbols = {}
@@ -280,15 +400,16 @@ class SeqEvaluator(AbstractEvaluator):
                 return None, unk_symbols
         if len(st) == 1:
             equations = st.pop()
-            unk_list = list(unk_symbols.values())
-            t = Solver(sym.solve, equations, unk_list)
-            t.setDaemon(True)
-            t.start()
-            t.join(10)
-            result = t.get_result()
-            return result, unk_symbols
+            return equations, unk_symbols
         return None, unk_symbols
 
+    def compute_postfix_expression_multi(self, post_fix):
+        equations, unk_symbols = self.build_postfix_equations(post_fix)
+        if equations is None:
+            return None, unk_symbols
+        result = self.solve_batch([(equations, list(unk_symbols.values()))])[0]
+        return result, unk_symbols
+
     def compute_expression_by_postfix(self, expression):
         try:
             post_exp = from_infix_to_postfix(expression)
@@ -305,6 +426,12 @@ class SeqEvaluator(AbstractEvaluator):
             return None, None
         return self.compute_postfix_expression_multi(post_exp)
 
+    def build_equations_by_postfix(self, expression):
+        r"""return equations and unknown number list
+        """
+        post_exp = from_infix_to_postfix(expression)
+        return self.build_postfix_equations(post_exp)
+
     def eval_source(self, test_res, test_tar, num_list, num_stack):
         num_len = len(num_list)
         new_test_res = []
@@ -392,65 +519,25 @@ class PreEvaluator(AbstractEvaluator):
         except:
             return False, False, test, tar
 
-    def result_multi(self, test,tar):
+    def result_batch(self, tests, tars):
+        r"""evaluate single equations of a batch.
+
+        Returns:
+            tuple(list, list): value accuracy and equation accuracy of every pair.
+        """
+        if (self.single and self.linear) != True:  # single but non-linear
+            return self._split_results(self.result_multi_batch(tests, tars))
+        return self._result_batch(tests, tars, None, prefix=True)
+
+    def result_multi(self, test, tar):
         r"""evaluate multiple euqations.
         """
-        #test = self.out_expression_list(test_res, num_list, copy.deepcopy(num_stack))
-        #tar = self.out_expression_list(test_tar, num_list, copy.deepcopy(num_stack))
-        #test = tar
-        #print(test, tar)
-        if test is []:
-            return False, False, test, tar
-        if test == tar:
-            return True, True, test, tar
-        try:
-            test_solves, test_unk = self.compute_prefix_expression_multi(test)
-            tar_solves, tar_unk = self.compute_prefix_expression_multi(tar)
-            if len(test_unk) != len(tar_unk):
-                return False, False, test, tar
-            flag = False
-            if len(tar_unk) == 1:
-                if len(tar_solves) == 1:
-                    test_ans = test_solves[list(test_unk.values())[0]]
-                    tar_ans = tar_solves[list(tar_unk.values())[0]]
-                    if abs(test_ans - tar_ans) < 1e-4:
-                        flag = True
-                else:
-                    flag = True
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        if abs(test_ans[0] - tar_ans[0]) > 1e-4:
-                            flag = False
-                            break
+        return self.result_multi_batch([test], [tar])[0]
 
-            else:
-                if len(tar_solves) == len(tar_unk):
-                    flag = True
-                    for tar_x in list(tar_unk.values()):
-                        test_ans = test_solves[tar_x]
-                        tar_ans = tar_solves[tar_x]
-                        if abs(test_ans - tar_ans) > 1e-4:
-                            flag = False
-                            break
-                else:
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        try:
-                            te_ans = float(test_ans[0])
-                        except:
-                            te_ans = float(test_ans[1])
-                        try:
-                            ta_ans = float(tar_ans[0])
-                        except:
-                            ta_ans = float(tar_ans[1])
-                        if abs(te_ans - ta_ans) > 1e-4:
-                            flag = False
-                            break
-            if flag == True:
-                return True, False, test, tar
-            else:
-                return False, False, test, tar
-        except:
-            return False, False, test, tar
-        return False, False, test, tar
+    def result_multi_batch(self, tests, tars):
+        r"""evaluate multiple equations of a batch.
+        """
+        return self._result_multi_batch(tests, tars, self.build_prefix_equations)
 
     def out_expression_list(self, test, num_list, num_stack=None):
         #alphabet="abcdefghijklmnopqrstuvwxyz"
@@ -527,7 +614,7 @@ class PreEvaluator(AbstractEvaluator):
             return st.pop()
         return None
 
-    def compute_prefix_expression_multi(self, pre_fix):
+    def build_prefix_equations(self, pre_fix):
         st = list()
         operators = ["+", "-", "^", "*", "/", "=", "<BRG>"]
         unk_symbols = {}
@@ -561,7 +648,7 @@ class PreEvaluator(AbstractEvaluator):
                 a = st.pop()
                 b = st.pop()
                 if b == 0:
-                    return None
+                    return None, unk_symbols
                 st.append(a / b)
             elif p == "-" and len(st) > 1:
                 a = st.pop()
@@ -571,7 +658,7 @@ class PreEvaluator(AbstractEvaluator):
                 a = st.pop()
                 b = st.pop()
                 if float(b) != 2.0 and float(b) != 3.0:
-                    return None
+                    return None, unk_symbols
                 st.append(a**b)
             elif p == "=":
                 a = st.pop()
@@ -582,17 +669,18 @@ class PreEvaluator(AbstractEvaluator):
                 b = st.pop()
                 st.append(a + b)
             else:
-                return None
+                return None, unk_symbols
         if len(st) == 1:
             equations = st.pop()
-            unk_list = list(unk_symbols.values())
-            t = Solver(sym.solve, equations, unk_list)
-            t.setDaemon(True)
-            t.start()
-            t.join(10)
-            result = t.get_result()
-            return result, unk_symbols
-        return None
+            return equations, unk_symbols
+        return None, unk_symbols
+
+    def compute_prefix_expression_multi(self, pre_fix):
+        equations, unk_symbols = self.build_prefix_equations(pre_fix)
+        if equations is None:
+            return None, unk_symbols
+        result = self.solve_batch([(equations, list(unk_symbols.values()))])[0]
+        return result, unk_symbols
 
     def eval_source(self, test_res, test_tar, num_list, num_stack=None):
         raise NotImplementedError
@@ -624,64 +712,25 @@ class PostEvaluator(AbstractEvaluator):
         except:
             return False, False, test, tar
 
+    def result_batch(self, tests, tars):
+        r"""evaluate single equations of a batch.
+
+        Returns:
+            tuple(list, list): value accuracy and equation accuracy of every pair.
+        """
+        if (self.single and self.linear) != True:  # single but non-linear
+            return self._split_results(self.result_multi_batch(tests, tars))
+        return self._result_batch(tests, tars)
+
     def result_multi(self, test, tar):
         r"""evaluate multiple euqations.
         """
-        #test = self.out_expression_list(test_res, num_list, copy.deepcopy(num_stack))
-        #tar = self.out_expression_list(test_tar, num_list, copy.deepcopy(num_stack))
-        if test is []:
-            return False, False, test, tar
-        if test == tar:
-            return True, True, test, tar
-        try:
-            test_solves, test_unk = self.compute_postfix_expression_multi(test)
-            tar_solves, tar_unk = self.compute_postfix_expression_multi(tar)
-            if len(test_unk) != len(tar_unk):
-                return False, False, test, tar
-            flag = False
-            if len(tar_unk) == 1:
-                if len(tar_solves) == 1:
-                    test_ans = test_solves[list(test_unk.values())[0]]
-                    tar_ans = tar_solves[list(tar_unk.values())[0]]
-                    if abs(test_ans - tar_ans) < 1e-4:
-                        flag = True
-                else:
-                    flag = True
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        if abs(test_ans[0] - tar_ans[0]) > 1e-4:
-                            flag = False
-                            break
+        return self.result_multi_batch([test], [tar])[0]
 
-            else:
-                if len(tar_solves) == len(tar_unk):
-                    flag = True
-                    for tar_x in list(tar_unk.values()):
-                        test_ans = test_solves[tar_x]
-                        tar_ans = tar_solves[tar_x]
-                        if abs(test_ans - tar_ans) > 1e-4:
-                            flag = False
-                            break
-                else:
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        try:
-                            te_ans = float(test_ans[0])
-
-                        except:
-                            te_ans = float(test_ans[1])
-                        try:
-                            ta_ans = float(tar_ans[0])
-                        except:
-                            ta_ans = float(tar_ans[1])
-                        if abs(te_ans - ta_ans) > 1e-4:
-                            flag = False
-                            break
-            if flag == True:
-                return True, False, test, tar
-            else:
-                return False, False, test, tar
-        except:
-            return False, False, test, tar
-        return False, False, test, tar
+    def result_multi_batch(self, tests, tars):
+        r"""evaluate multiple equations of a batch.
+        """
+        return self._result_multi_batch(tests, tars, self.build_postfix_equations)
 
     def out_expression_list(self, test, num_list, num_stack=None):
         #alphabet="abcdefghijklmnopqrstuvwxyz"
@@ -752,7 +801,7 @@ class PostEvaluator(AbstractEvaluator):
             return st.pop()
         return None
 
-    def compute_postfix_expression_multi(self, post_fix):
+    def build_postfix_equations(self, post_fix):
         st = list()
         operators = ["+", "-", "^", "*", "/", "=", "<BRG>"]
         unk_symbols = {}
@@ -808,15 +857,16 @@ class PostEvaluator(AbstractEvaluator):
                 return None, unk_symbols
         if len(st) == 1:
             equations = st.pop()
-            unk_list = list(unk_symbols.values())
-            t = Solver(sym.solve, equations, unk_list)
-            t.setDaemon(True)
-            t.start()
-            t.join(10)
-            result = t.get_result()
-            return result, unk_symbols
+            return equations, unk_symbols
         return None, unk_symbols
 
+    def compute_postfix_expression_multi(self, post_fix):
+        equations, unk_symbols = self.build_postfix_equations(post_fix)
+        if equations is None:
+            return None, unk_symbols
+        result = self.solve_batch([(equations, list(unk_symbols.values()))])[0]
+        return result, unk_symbols
+
     def eval_source(self):
         raise NotImplementedError
 
@@ -843,64 +893,26 @@ class MultiWayTreeEvaluator(AbstractEvaluator):
         except:
             return False, False, tar_exp, tar_exp
 
+    def result_batch(self, res_exps, tar_exps):
+        r"""evaluate single equations of a batch.
+
+        Returns:
+            tuple(list, list): value accuracy and equation accuracy of every pair.
+        """
+        if (self.single and self.linear) != True:  # single but non-linear
+            return self._split_results(self.result_multi_batch(res_exps, tar_exps))
+        return self._result_batch(res_exps, tar_exps, from_infix_to_postfix)
+
     def result_multi(self, res_exp, tar_exp):
         r"""evaluate multiple euqations.
         """
-        #res_exp = self.out_expression_list(test_res, num_list, copy.deepcopy(num_stack))
-        #tar_exp = self.out_expression_list(test_tar, num_list, copy.deepcopy(num_stack))
-        if res_exp == []:
-            return False, False, res_exp, tar_exp
-        if res_exp == tar_exp:
-            return True, True, res_exp, tar_exp
-        try:
-            test_solves, test_unk = self.compute_expression_by_postfix_multi(res_exp)
-            tar_solves, tar_unk = self.compute_expression_by_postfix_multi(tar_exp)
-            if len(test_unk) != len(tar_unk):
-                return False, False, res_exp, tar_exp
-            flag = False
-            if len(tar_unk) == 1:
-                if len(tar_solves) == 1:
-                    test_ans = test_solves[list(test_unk.values())[0]]
-                    tar_ans = tar_solves[list(tar_unk.values())[0]]
-                    if abs(test_ans - tar_ans) < 1e-4:
-                        flag = True
-                else:
-                    flag = True
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        if abs(test_ans[0] - tar_ans[0]) > 1e-4:
-                            flag = False
-                            break
+        return self.result_multi_batch([res_exp], [tar_exp])[0]
+
+    def result_multi_batch(self, res_exps, tar_exps):
+        r"""evaluate multiple equations of a batch.
+        """
+        return self._result_multi_batch(res_exps, tar_exps, self.build_equations_by_postfix)
 
-            else:
-                if len(tar_solves) == len(tar_unk):
-                    flag = True
-                    for tar_x in list(tar_unk.values()):
-                        test_ans = test_solves[tar_x]
-                        tar_ans = tar_solves[tar_x]
-                        if abs(test_ans - tar_ans) > 1e-4:
-                            flag = False
-                            break
-                else:
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        try:
-                            te_ans = float(test_ans[0])
-
-                        except:
-                            te_ans = float(test_ans[1])
-                        try:
-                            ta_ans = float(tar_ans[0])
-                        except:
-                            ta_ans = float(tar_ans[1])
-                        if abs(te_ans - ta_ans) > 1e-4:
-                            flag = False
-                            break
-            if flag == True:
-                return True, False, tar_exp, tar_exp
-            else:
-                return False, False, tar_exp, tar_exp
-        except:
-            return False, False, tar_exp, tar_exp
-    
     def out_expression_list(self, test, num_list, num_stack=None):
         num_len = len(num_list)
         max_index = len(self.idx2symbol)
@@ -977,7 +989,7 @@ class MultiWayTreeEvaluator(AbstractEvaluator):
             return st.pop()
         return None
 
-    def compute_postfix_expression_multi(self, post_fix):
+    def build_postfix_equations(self, post_fix):
         st = list()
         operators = ["+", "-", "^", "*", "/", "=", "<BRG>"]
         unk_symbols = {}
@@ -1033,15 +1045,16 @@ class MultiWayTreeEvaluator(AbstractEvaluator):
                 return None, unk_symbols
         if len(st) == 1:
             equations = st.pop()
-            unk_list = list(unk_symbols.values())
-            t = Solver(sym.solve, equations, unk_list)
-            t.setDaemon(True)
-            t.start()
-            t.join(10)
-            result = t.get_result()
-            return result, unk_symbols
+            return equations, unk_symbols
         return None, unk_symbols
 
+    def compute_postfix_expression_multi(self, post_fix):
+        equations, unk_symbols = self.build_postfix_equations(post_fix)
+        if equations is None:
+            return None, unk_symbols
+        result = self.solve_batch([(equations, list(unk_symbols.values()))])[0]
+        return result, unk_symbols
+
     def compute_expression_by_postfix(self, expression):
         try:
             post_exp = from_infix_to_postfix(expression)
@@ -1058,6 +1071,12 @@ class MultiWayTreeEvaluator(AbstractEvaluator):
             return None, None
         return self.compute_postfix_expression_multi(post_exp)
 
+    def build_equations_by_postfix(self, expression):
+        r"""return equations and unknown number list
+        """
+        post_exp = from_infix_to_postfix(expression)
+        return self.build_postfix_equations(post_exp)
+
     def eval_source(self, test_res, test_tar, num_list, num_stack):
         num_len = len(num_list)
         new_test_res = []
@@ -1138,60 +1157,24 @@ class MultiEncDecEvaluator(PostEvaluator,PreEvaluator):
                 return False, False, test, tar
         except:
             return False, False, test, tar
-    def prefix_result_multi(self,test,tar):
-        if test is []:
-            return False, False, test, tar
-        if test == tar:
-            return True, True, test, tar
-        try:
-            test_solves, test_unk = self.compute_prefix_expression_multi(test)
-            tar_solves, tar_unk = self.compute_prefix_expression_multi(tar)
-            if len(test_unk) != len(tar_unk):
-                return False, False, test, tar
-            flag = False
-            if len(tar_unk) == 1:
-                if len(tar_solves) == 1:
-                    test_ans = test_solves[list(test_unk.values())[0]]
-                    tar_ans = tar_solves[list(tar_unk.values())[0]]
-                    if abs(test_ans - tar_ans) < 1e-4:
-                        flag = True
-                else:
-                    flag = True
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        if abs(test_ans[0] - tar_ans[0]) > 1e-4:
-                            flag = False
-                            break
+    def prefix_result_batch(self, tests, tars):
+        r"""evaluate single equations of a batch.
+
+        Returns:
+            tuple(list, list): value accuracy and equation accuracy of every pair.
+        """
+        if (self.single and self.linear) != True:  # single but non-linear
+            return self._split_results(self.prefix_result_multi_batch(tests, tars))
+        return self._result_batch(tests, tars, None, prefix=True)
+
+    def prefix_result_multi(self, test, tar):
+        return self.prefix_result_multi_batch([test], [tar])[0]
+
+    def prefix_result_multi_batch(self, tests, tars):
+        r"""evaluate multiple equations of a batch.
+        """
+        return self._result_multi_batch(tests, tars, self.build_prefix_equations)
 
-            else:
-                if len(tar_solves) == len(tar_unk):
-                    flag = True
-                    for tar_x in list(tar_unk.values()):
-                        test_ans = test_solves[tar_x]
-                        tar_ans = tar_solves[tar_x]
-                        if abs(test_ans - tar_ans) > 1e-4:
-                            flag = False
-                            break
-                else:
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        try:
-                            te_ans = float(test_ans[0])
-                        except:
-                            te_ans = float(test_ans[1])
-                        try:
-                            ta_ans = float(tar_ans[0])
-                        except:
-                            ta_ans = float(tar_ans[1])
-                        if abs(te_ans - ta_ans) > 1e-4:
-                            flag = False
-                            break
-            if flag == True:
-                return True, False, test, tar
-            else:
-                return False, False, test, tar
-        except:
-            return False, False, test, tar
-        return False, False, test, tar
-    
     def postfix_result(self,test,tar):
         if (self.single and self.linear) != True:  # single but non-linear
             return self.postfix_result_multi(test,tar)
@@ -1210,65 +1193,34 @@ class MultiEncDecEvaluator(PostEvaluator,PreEvaluator):
         except:
             return False, False, test, tar
     
-    def postfix_result_multi(self,test,tar):
-        if test is []:
-            return False, False, test, tar
-        if test == tar:
-            return True, True, test, tar
-        try:
-            test_solves, test_unk = self.compute_postfix_expression_multi(test)
-            tar_solves, tar_unk = self.compute_postfix_expression_multi(tar)
-            if len(test_unk) != len(tar_unk):
-                return False, False, test, tar
-            flag = False
-            if len(tar_unk) == 1:
-                if len(tar_solves) == 1:
-                    test_ans = test_solves[list(test_unk.values())[0]]
-                    tar_ans = tar_solves[list(tar_unk.values())[0]]
-                    if abs(test_ans - tar_ans) < 1e-4:
-                        flag = True
-                else:
-                    flag = True
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        if abs(test_ans[0] - tar_ans[0]) > 1e-4:
-                            flag = False
-                            break
+    def postfix_result_batch(self, tests, tars):
+        r"""evaluate single equations of a batch.
 
-            else:
-                if len(tar_solves) == len(tar_unk):
-                    flag = True
-                    for tar_x in list(tar_unk.values()):
-                        test_ans = test_solves[tar_x]
-                        tar_ans = tar_solves[tar_x]
-                        if abs(test_ans - tar_ans) > 1e-4:
-                            flag = False
-                            break
-                else:
-                    for test_ans, tar_ans in zip(test_solves, tar_solves):
-                        try:
-                            te_ans = float(test_ans[0])
-
-                        except:
-                            te_ans = float(test_ans[1])
-                        try:
-                            ta_ans = float(tar_ans[0])
-                        except:
-                            ta_ans = float(tar_ans[1])
-                        if abs(te_ans - ta_ans) > 1e-4:
-                            flag = False
-                            break
-            if flag == True:
-                return True, False, test, tar
-            else:
-                return False, False, test, tar
-        except:
-            return False, False, test, tar
-        return False, False, test, tar
+        Returns:
+            tuple(list, list): value accuracy and equation accuracy of every pair.
+        """
+        if (self.single and self.linear) != True:  # single but non-linear
+            return self._split_results(self.postfix_result_multi_batch(tests, tars))
+        return self._result_batch(tests, tars)
+
+    def postfix_result_multi(self, test, tar):
+        return self.postfix_result_multi_batch([test], [tar])[0]
+
+    def postfix_result_multi_batch(self, tests, tars):
+        r"""evaluate multiple equations of a batch.
+        """
+        return self._result_multi_batch(tests, tars, self.build_postfix_equations)
 
     def result(self,test,tar):
         raise NotImplementedError
     def result_multi(self, test, tar):
         raise NotImplementedError
+
+    def result_batch(self, tests, tars):
+        raise NotImplementedError
+
+    def result_multi_batch(self, tests, tars):
+        raise NotImplementedError
 # class SeqEvaluator(AbstractEvaluator):
 #     r"""evaluator for normal equation sequnence.
 #     """
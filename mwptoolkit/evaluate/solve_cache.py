@@ -0,0 +1,118 @@
+import atexit
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+import sympy as sym
+
+
+class SolveCache(object):
+    r"""content-addressed LRU cache of equation solutions.
+
+    Equation systems are keyed on their canonical form, the sympy expressions with
+    number values bound in, so that the same system built from different equation
+    sequences (e.g. ``x=3+5`` and ``x=5+3``) is solved only once.
+
+    Args:
+        capacity (int): max number of cached solutions, the least recently used one is evicted first.
+        cache_path (str|None): file to persist the cache, cache is kept in memory only if None.
+            Only solutions are cached, None results of timeouts and failures are never stored.
+        save_interval (float): min interval between two saves of the cache, in seconds.
+    """
+    def __init__(self, capacity=100000, cache_path=None, save_interval=60):
+        super().__init__()
+        self.capacity = capacity
+        self.cache_path = cache_path
+        self.save_interval = save_interval
+        self._cache = OrderedDict()
+        self._dirty = False
+        self._last_save_time = time.time()
+        if cache_path and os.path.exists(cache_path):
+            self.load()
+
+    @staticmethod
+    def canonical_key(equations, unk_list):
+        r"""canonical form of an equation system.
+
+        Args:
+            equations (list|sympy.Expr): sympy equations.
+            unk_list (list): unknown symbols.
+
+        Returns:
+            str: digest of canonical form.
+        """
+        if not isinstance(equations, list):
+            equations = [equations]
+        equ_forms = sorted([sym.srepr(equation) for equation in equations])
+        unk_forms = [str(unk) for unk in unk_list]
+        canonical_form = ';'.join(equ_forms) + '|' + ','.join(unk_forms)
+        return hashlib.md5(canonical_form.encode('utf-8')).hexdigest()
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key):
+        value = self._cache[key]
+        self._cache.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if value is None:
+            return
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        self._dirty = True
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except:
+            return
+        for key, value in cache:
+            # skip failures persisted by older versions
+            if value is not None:
+                self._cache[key] = value
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def save(self, force=False):
+        r"""write the cache to cache_path, skipped if the last save is within save_interval unless force.
+        """
+        if not self.cache_path or not self._dirty:
+            return
+        if not force and time.time() - self._last_save_time < self.save_interval:
+            return
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(list(self._cache.items()), f)
+        os.replace(temp_path, self.cache_path)
+        self._dirty = False
+        self._last_save_time = time.time()
+
+
+_solve_caches = {}
+
+
+def get_solve_cache(capacity=100000, cache_path=None):
+    r"""get the process-wide solve cache of cache_path.
+    """
+    if cache_path not in _solve_caches:
+        _solve_caches[cache_path] = SolveCache(capacity, cache_path)
+    return _solve_caches[cache_path]
+
+
+@atexit.register
+def _save_solve_caches():
+    for cache in _solve_caches.values():
+        try:
+            cache.save(force=True)
+        except:
+            pass
@@ -0,0 +1,190 @@
+import atexit
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+import sympy as sym
+
+
+def _solve_worker(conn):
+    r"""worker loop, receive (equations, unknowns) and send back the solution of sympy.
+    """
+    conn.send(True)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        equations, unk_list = task
+        try:
+            result = sym.solve(equations, unk_list)
+        except:
+            result = None
+        try:
+            conn.send(result)
+        except:
+            conn.send(None)
+
+
+class SolverPool(object):
+    r"""time-limited equation solving mechanism based on a persistent process pool.
+
+    Every worker process owns a pipe, a task running longer than `timeout` seconds is
+    stopped by terminating its worker, which is replaced by a new one. Workers get tasks
+    once they are started, the time limit does not count start up.
+
+    Args:
+        num_workers (int|None): number of worker processes, default the number of cpu cores.
+        timeout (float): time limit of solving one equation system, in seconds.
+    """
+    def __init__(self, num_workers=None, timeout=10):
+        super().__init__()
+        self.num_workers = num_workers if num_workers else (os.cpu_count() or 1)
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._conns = []
+        self._ready = []
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_solve_worker, args=(child_conn, ), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _restart_worker(self, w_idx):
+        process = self._workers[w_idx]
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self._conns[w_idx].close()
+        self._workers[w_idx], self._conns[w_idx] = self._start_worker()
+        self._ready[w_idx] = False
+
+    def _ensure_workers(self):
+        while len(self._workers) < self.num_workers:
+            process, conn = self._start_worker()
+            self._workers.append(process)
+            self._conns.append(conn)
+            self._ready.append(False)
+
+    def solve_batch(self, tasks):
+        r"""solve a batch of equation systems.
+
+        Args:
+            tasks (list): list of (equations, unknowns).
+
+        Returns:
+            list: solution of every task, None if the task failed or timed out.
+        """
+        results = [None] * len(tasks)
+        if len(tasks) == 0:
+            return results
+        self._ensure_workers()
+        pending = deque(range(len(tasks)))
+        idle = [w_idx for w_idx in range(self.num_workers) if self._ready[w_idx]]
+        starting = set(w_idx for w_idx in range(self.num_workers) if not self._ready[w_idx])
+        busy = {}
+        start_failures = 0
+        while pending or busy:
+            while pending and idle:
+                w_idx = idle.pop()
+                t_idx = pending.popleft()
+                try:
+                    self._conns[w_idx].send(tasks[t_idx])
+                except (BrokenPipeError, EOFError, OSError):
+                    self._restart_worker(w_idx)
+                    starting.add(w_idx)
+                    pending.appendleft(t_idx)
+                    continue
+                except:
+                    # task can not be pickled
+                    idle.append(w_idx)
+                    continue
+                busy[w_idx] = (t_idx, time.time() + self.timeout)
+
+            conn2worker = {self._conns[w_idx]: w_idx for w_idx in list(busy) + list(starting)}
+            deadlines = [deadline for _, deadline in busy.values()]
+            timeout = max(0., min(deadlines) - time.time()) if deadlines else None
+            ready = wait(list(conn2worker.keys()), timeout=timeout)
+            for conn in ready:
+                w_idx = conn2worker[conn]
+                if w_idx in starting:
+                    try:
+                        self._ready[w_idx] = conn.recv()
+                    except:
+                        start_failures += 1
+                        if start_failures > self.num_workers:
+                            raise RuntimeError("solver workers can not be started")
+                        self._restart_worker(w_idx)
+                        continue
+                    starting.remove(w_idx)
+                    idle.append(w_idx)
+                    continue
+                t_idx, _ = busy.pop(w_idx)
+                try:
+                    results[t_idx] = conn.recv()
+                except:
+                    results[t_idx] = None
+                    self._restart_worker(w_idx)
+                    starting.add(w_idx)
+                    continue
+                idle.append(w_idx)
+
+            now = time.time()
+            for w_idx, (t_idx, deadline) in list(busy.items()):
+                if deadline <= now:
+                    busy.pop(w_idx)
+                    self._restart_worker(w_idx)
+                    starting.add(w_idx)
+        return results
+
+    def solve(self, equations, unk_list):
+        r"""solve one equation system.
+        """
+        return self.solve_batch([(equations, unk_list)])[0]
+
+    def close(self):
+        for process, conn in zip(self._workers, self._conns):
+            try:
+                conn.send(None)
+            except:
+                pass
+        for process, conn in zip(self._workers, self._conns):
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            conn.close()
+        self._workers = []
+        self._conns = []
+        self._ready = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_solver_pools = {}
+
+
+def get_solver_pool(num_workers=None, timeout=10):
+    r"""get the process-wide solver pool, worker processes are started at the first solving.
+    """
+    key = (num_workers, timeout)
+    if key not in _solver_pools:
+        _solver_pools[key] = SolverPool(num_workers, timeout)
+    return _solver_pools[key]
+
+
+@atexit.register
+def _close_solver_pools():
+    for pool in _solver_pools.values():
+        pool.close()
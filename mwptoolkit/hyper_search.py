@@ -1,12 +1,16 @@
-from functools import partial
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from logging import getLogger
+import copy
+import itertools
+import math
+import multiprocessing
 import os
+import random
+import shutil
 
 import torch
-import ray
-from ray import tune
-from ray.tune import CLIReporter
-from ray.tune.schedulers import ASHAScheduler, AsyncHyperBandScheduler
 
 from mwptoolkit.config.configuration import Config
 from mwptoolkit.evaluate.evaluator import AbstractEvaluator, SeqEvaluator, PostEvaluator, PreEvaluator, MultiWayTreeEvaluator, MultiEncDecEvaluator
@@ -17,16 +21,102 @@ from mwptoolkit.utils.logger import init_logger
 
 from mwptoolkit.quick_start import run_toolkit
 
-def train_process(search_parameter,configs):
-    for key,value in search_parameter.items():
-        configs[key]=value
-    dataset = create_dataset(configs)
-    dataset.dataset_load()
+SearchDomain = namedtuple("SearchDomain", ["kind", "space"])
 
-    dataloader = create_dataloader(configs)(configs, dataset)
 
-    model = get_model(configs["model"])(configs, dataset).to(configs["device"])
+def parse_search_space(search_parameter):
+    r"""parse search parameters of search space files, e.g. "hidden_size=[128,256]" or "learning_rate=(1e-4,1e-2)".
+
+    a list is searched by grid, tuple (0,1) is sampled uniformly and other 2-tuples log-uniformly,
+    other values are fixed.
+
+    Args:
+        search_parameter (list): parameters like "name=space", later ones override former ones.
+
+    Returns:
+        dict: parameter name to SearchDomain("grid"|"uniform"|"loguniform", space) or fixed value.
+    """
+    search_space = {}
+    for parameter in search_parameter:
+        name, space = parameter.split('=', 1)
+        space = eval(space)
+        if isinstance(space, list):
+            search_space[name] = SearchDomain("grid", space)
+        elif isinstance(space, tuple) and len(space) == 2:
+            if space[0] == 0 and space[1] == 1:
+                search_space[name] = SearchDomain("uniform", space)
+            else:
+                search_space[name] = SearchDomain("loguniform", space)
+        else:
+            search_space[name] = space
+    return search_space
+
+
+def _tune_search_space(search_space):
+    from ray import tune
+    parameter_dict = {}
+    for name, domain in search_space.items():
+        if not isinstance(domain, SearchDomain):
+            parameter_dict[name] = domain
+        elif domain.kind == "grid":
+            parameter_dict[name] = tune.grid_search(domain.space)
+        elif domain.kind == "uniform":
+            parameter_dict[name] = tune.uniform(domain.space[0], domain.space[1])
+        else:
+            parameter_dict[name] = tune.loguniform(domain.space[0], domain.space[1])
+    return parameter_dict
+
 
+def sample_trials(search_space, num_samples, rng):
+    r"""parameters of trials, every grid point is sampled num_samples times like `ray.tune`.
+
+    Args:
+        search_space (dict): search space returned by `parse_search_space`.
+        num_samples (int): number of samples of every grid point.
+        rng (random.Random): random generator of uniform and log-uniform parameters.
+
+    Returns:
+        list: parameters of every trial.
+    """
+    grid_names = [name for name, domain in search_space.items() if isinstance(domain, SearchDomain) and domain.kind == "grid"]
+    trials = []
+    for _ in range(num_samples):
+        for grid_values in itertools.product(*[search_space[name].space for name in grid_names]):
+            grid = dict(zip(grid_names, grid_values))
+            parameters = {}
+            for name, domain in search_space.items():
+                if name in grid:
+                    parameters[name] = grid[name]
+                elif not isinstance(domain, SearchDomain):
+                    parameters[name] = domain
+                elif domain.kind == "uniform":
+                    parameters[name] = rng.uniform(domain.space[0], domain.space[1])
+                else:
+                    low, high = domain.space
+                    parameters[name] = math.exp(rng.uniform(math.log(low), math.log(high)))
+            trials.append(parameters)
+    return trials
+
+
+def rung_epochs(num_trials, epoch_nums, reduction_factor, grace_epochs=None):
+    r"""epochs trained by the end of every rung of successive halving.
+
+    rungs start at grace_epochs and grow by reduction_factor up to epoch_nums. if grace_epochs is None,
+    it is chosen so that one trial is left when the last rung starts.
+    """
+    if grace_epochs is None:
+        halvings = int(math.log(max(num_trials, 1)) / math.log(reduction_factor) + 1e-9)
+        grace_epochs = max(1, epoch_nums // reduction_factor**halvings)
+    epochs = []
+    milestone = grace_epochs
+    while milestone < epoch_nums:
+        epochs.append(milestone)
+        milestone *= reduction_factor
+    epochs.append(epoch_nums)
+    return epochs
+
+
+def build_evaluator(configs):
     if configs["equation_fix"] == FixType.Prefix:
         evaluator = PreEvaluator(configs["out_symbol2idx"], configs["out_idx2symbol"], configs)
     elif configs["equation_fix"] == FixType.Nonfix:
@@ -35,14 +125,61 @@ def train_process(search_parameter,configs):
         evaluator = PostEvaluator(configs["out_symbol2idx"], configs["out_idx2symbol"], configs)
     else:
         raise NotImplementedError
-    
+
     if configs['model'].lower() in ['multiencdec']:
         evaluator = MultiEncDecEvaluator(configs["out_symbol2idx"], configs["out_idx2symbol"], configs)
+    return evaluator
+
+
+def build_trainer(configs, dataset):
+    dataloader = create_dataloader(configs)(configs, dataset)
+
+    model = get_model(configs["model"])(configs, dataset).to(configs["device"])
+
+    evaluator = build_evaluator(configs)
 
     trainer = get_trainer(configs["task_type"], configs["model"], configs["supervising_mode"])(configs, model, dataloader, evaluator)
-    trainer.param_search()
+    return trainer
+
+
+def train_process(search_parameter,checkpoint_dir=None,configs=None,dataset=None):
+    r"""run a trial of hyper parameter search.
+
+    Args:
+        search_parameter (dict): parameters of the trial, sampled by tuner.
+        checkpoint_dir (str|None): tuner checkpoint to restore the trial from.
+        configs (Config): config of search.
+        dataset (AbstractDataset|None): loaded dataset shared by trials, built for the trial if None.
+    """
+    for key,value in search_parameter.items():
+        configs[key]=value
+    if dataset is None:
+        dataset = create_dataset(configs)
+        dataset.dataset_load()
+
+    trainer = build_trainer(configs, dataset)
+    trainer.param_search(checkpoint_dir)
+
+
+def _train_best_config(model_name, dataset_name, task_type, config_dict, configs, best_config):
+    logger = getLogger()
+    logger.info("best config:{}".format(best_config))
+
+    config_dict.update(best_config)
+
+    run_toolkit(model_name,dataset_name,task_type,config_dict)
+
+    model_config=read_json_data(configs["model_config_path"])
+    model_config.update(best_config)
+    write_json_data(model_config,configs["best_config_path"])
+    logger.info("best config saved at {}".format(configs["best_config_path"]))
+
 
 def hyper_search_process(model_name, dataset_name, task_type, search_parameter, config_dict={}):
+    import ray
+    from ray import tune
+    from ray.tune.schedulers import AsyncHyperBandScheduler
+
     configs = Config(model_name, dataset_name, task_type, config_dict)
 
     init_seed(configs['random_seed'], True)
@@ -53,6 +190,10 @@ def hyper_search_process(model_name, dataset_name, task_type, search_parameter,
     logger.info(configs)
     ray.init(num_gpus=configs['gpu_nums'])
 
+    # dataset is preprocessed once and put into object store, trials on a node read the same copy.
+    dataset = create_dataset(configs)
+    dataset.dataset_load()
+
     # scheduler = ASHAScheduler(
     #     metric="accuracy",
     #     mode="max",
@@ -63,24 +204,194 @@ def hyper_search_process(model_name, dataset_name, task_type, search_parameter,
         metric="accuracy",
         mode="max")
     result=tune.run(
-        partial(train_process,configs=configs),
+        tune.with_parameters(train_process,configs=configs,dataset=dataset),
         resources_per_trial={"cpu": configs['cpu_per_trial'], "gpu": configs['gpu_per_trial']},
-        config=search_parameter,
+        config=_tune_search_space(search_parameter),
         scheduler=scheduler,
         num_samples=configs["samples"],
         raise_on_failed_trial=False
     )
     best_config=result.get_best_config(metric="accuracy", mode="max")
-
-    logger.info("best config:{}".format(best_config))
     #print("Best config: ", best_config)
-    
 
-    config_dict.update(best_config)
+    _train_best_config(model_name, dataset_name, task_type, config_dict, configs, best_config)
 
-    run_toolkit(model_name,dataset_name,task_type,config_dict)
 
-    model_config=read_json_data(configs["model_config_path"])
-    model_config.update(best_config)
-    write_json_data(model_config,configs["best_config_path"])
-    logger.info("best config saved at {}".format(configs["best_config_path"]))
+class LocalReporter(object):
+    r"""tuner of a trial run by local search, collects reports in place of `ray.tune`.
+
+    Args:
+        checkpoint_dir (str): directory of trial checkpoint, overwritten at every report.
+    """
+    def __init__(self, checkpoint_dir):
+        super().__init__()
+        self._checkpoint_dir = checkpoint_dir
+        self.results = []
+
+    @contextmanager
+    def checkpoint_dir(self, step):
+        os.makedirs(self._checkpoint_dir, exist_ok=True)
+        yield self._checkpoint_dir
+
+    def report(self, **metrics):
+        self.results.append(metrics)
+
+
+_trial_configs = None
+_trial_dataset = None
+
+
+def _init_trial_worker(configs, dataset, num_threads, device_slots=None):
+    global _trial_configs, _trial_dataset
+    _trial_configs = configs
+    _trial_dataset = dataset
+    torch.set_num_threads(num_threads)
+    if device_slots is not None:
+        # every worker takes its own gpu.
+        device_index = device_slots.get()
+        torch.cuda.set_device(device_index)
+        _trial_configs["device"] = torch.device("cuda", device_index)
+
+
+def _run_local_trial(parameters, checkpoint_dir, stop_epoch):
+    r"""train a trial from its checkpoint until stop_epoch, return results reported at every epoch.
+    """
+    configs = copy.deepcopy(_trial_configs)
+    for key, value in parameters.items():
+        configs[key] = value
+    configs["resume"] = False
+    configs["search_report_steps"] = 0
+    init_seed(configs['random_seed'], True)
+    trainer = build_trainer(configs, _trial_dataset)
+    reporter = LocalReporter(checkpoint_dir)
+    if os.path.exists(os.path.join(checkpoint_dir, "search_state.pth")):
+        trainer.param_search(checkpoint_dir, reporter, stop_epoch)
+    else:
+        trainer.param_search(None, reporter, stop_epoch)
+    return reporter.results
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _leaderboard_entry(trial_id, parameters, history, status):
+    entry = {"trial": trial_id, "config": parameters, "status": status, "epochs": 0,
+             "best_accuracy": None, "best_equation_accuracy": None, "best_epoch": None, "history": history}
+    if history:
+        best = max(history, key=lambda result: result["accuracy"])
+        entry["epochs"] = history[-1]["epoch"]
+        entry["best_accuracy"] = best["accuracy"]
+        entry["best_equation_accuracy"] = best["equation_accuracy"]
+        entry["best_epoch"] = best["epoch"]
+    return entry
+
+
+def _sort_leaderboard(leaderboard):
+    return sorted(leaderboard, key=lambda entry: (entry["best_accuracy"] is None, -(entry["best_accuracy"] or 0.), entry["trial"]))
+
+
+def local_search_process(model_name, dataset_name, task_type, search_parameter, config_dict={}):
+    r"""hyper parameter search by successive halving over a local process pool, without ray.
+
+    `samples` samples of every grid point of search space are trained for `search_grace_epochs` epochs,
+    then the best 1/`search_reduction_factor` of trials by valid value accuracy go on to the next rung,
+    which trains `search_reduction_factor` times as many epochs, until `epoch_nums`. trials of a rung run
+    in parallel on `search_workers` processes with `cpu_per_trial` threads each, the dataset is loaded
+    once and shared by workers. on cuda, there are at most gpus / `gpu_per_trial` workers and every
+    worker trains on its own gpu, workers share a gpu only if `gpu_per_trial` is less than 1. a leaderboard
+    of all trials is written to `leaderboard_path` after every rung, the best config is trained and saved at last.
+
+    Args:
+        search_parameter (dict): search space returned by `parse_search_space`.
+    """
+    configs = Config(model_name, dataset_name, task_type, config_dict)
+
+    init_seed(configs['random_seed'], True)
+
+    init_logger(configs)
+    logger = getLogger()
+
+    logger.info(configs)
+
+    reduction_factor = configs["search_reduction_factor"]
+    grace_epochs = configs["search_grace_epochs"]
+    if reduction_factor is None or reduction_factor < 2:
+        raise ValueError("search_reduction_factor must be at least 2, got {}.".format(reduction_factor))
+    if grace_epochs is not None and grace_epochs < 1:
+        raise ValueError("search_grace_epochs must be at least 1, got {}.".format(grace_epochs))
+
+    trials = sample_trials(search_parameter, configs["samples"] or 1, random.Random(configs["random_seed"]))
+    if len(trials) == 0:
+        raise ValueError("search space has no trial.")
+
+    dataset = create_dataset(configs)
+    dataset.dataset_load()
+
+    rungs = rung_epochs(len(trials), configs["epoch_nums"], reduction_factor, grace_epochs)
+    cores = _available_cores()
+    num_workers = configs["search_workers"] or max(1, cores // (configs["cpu_per_trial"] or 1))
+    num_workers = min(num_workers, len(trials))
+    mp_context = multiprocessing.get_context("spawn")
+    device_slots = None
+    if configs["device"].type == "cuda":
+        gpu_per_trial = configs["gpu_per_trial"] or 1
+        gpu_nums = torch.cuda.device_count()
+        num_workers = min(num_workers, max(1, int(gpu_nums / gpu_per_trial)))
+        device_slots = mp_context.Queue()
+        for worker in range(num_workers):
+            device_slots.put(int(worker * gpu_per_trial) % max(1, gpu_nums))
+    num_threads = configs["cpu_per_trial"] or max(1, cores // num_workers)
+    logger.info("local search of {} trials on {} workers, rungs end at epoch {}".format(len(trials), num_workers, rungs))
+
+    search_dir = os.path.splitext(configs["checkpoint_path"])[0] + "-search"
+    histories = [[] for _ in trials]
+    status = ["running" for _ in trials]
+    alive = list(range(len(trials)))
+    executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context,
+                                   initializer=_init_trial_worker, initargs=(configs, dataset, num_threads, device_slots))
+    try:
+        for rung, stop_epoch in enumerate(rungs):
+            futures = {}
+            for trial_id in alive:
+                checkpoint_dir = os.path.join(search_dir, "trial_{:03d}".format(trial_id))
+                futures[executor.submit(_run_local_trial, trials[trial_id], checkpoint_dir, stop_epoch)] = trial_id
+            for future in as_completed(futures):
+                trial_id = futures[future]
+                try:
+                    histories[trial_id] += future.result()
+                except Exception as e:
+                    status[trial_id] = "failed"
+                    logger.warning("trial {} failed: {}".format(trial_id, repr(e)))
+                    continue
+                entry = _leaderboard_entry(trial_id, trials[trial_id], histories[trial_id], status[trial_id])
+                logger.info("trial [%3d] epoch [%3d] | best valid value acc [%2.3f] | config %s"\
+                                %(trial_id, entry["epochs"], entry["best_accuracy"] or 0., trials[trial_id]))
+
+            alive = [trial_id for trial_id in alive if status[trial_id] != "failed"]
+            if rung == len(rungs) - 1:
+                for trial_id in alive:
+                    status[trial_id] = "finished"
+            else:
+                ranked = _sort_leaderboard([_leaderboard_entry(trial_id, trials[trial_id], histories[trial_id], status[trial_id]) for trial_id in alive])
+                keep = max(1, len(ranked) // reduction_factor)
+                for entry in ranked[keep:]:
+                    status[entry["trial"]] = "stopped at epoch {}".format(stop_epoch)
+                    shutil.rmtree(os.path.join(search_dir, "trial_{:03d}".format(entry["trial"])), ignore_errors=True)
+                alive = [entry["trial"] for entry in ranked[:keep]]
+            leaderboard = _sort_leaderboard([_leaderboard_entry(trial_id, parameters, histories[trial_id], status[trial_id])\
+                                                for trial_id, parameters in enumerate(trials)])
+            write_json_data(leaderboard, configs["leaderboard_path"])
+            logger.info("rung [%d] ends at epoch [%d], %d trials left, leaderboard saved at %s"\
+                            %(rung + 1, stop_epoch, len(alive), configs["leaderboard_path"]))
+            if len(alive) == 0:
+                break
+    finally:
+        executor.shutdown()
+        shutil.rmtree(search_dir, ignore_errors=True)
+
+    if leaderboard[0]["best_accuracy"] is None:
+        raise RuntimeError("all trials of hyper parameter search failed.")
+    _train_best_config(model_name, dataset_name, task_type, config_dict, configs, leaderboard[0]["config"])
@@ -1,5 +1,7 @@
 from torch import nn
 
+from mwptoolkit.utils.mixed_precision import backward
+
 
 class AbstractLoss(object):
     def __init__(self, name, criterion):
@@ -22,6 +24,6 @@ class AbstractLoss(object):
     def backward(self):
         if type(self.acc_loss) is int:
             raise ValueError("No loss to back propagate.")
-        self.acc_loss.backward()
+        backward(self.acc_loss)
 
 
@@ -1,5 +1,6 @@
 import copy
 import itertools
+from collections import OrderedDict
 import torch
 import stanza
 from torch import nn
@@ -8,10 +9,10 @@ from mwptoolkit.module.Encoder.graph_based_encoder import GraphBasedEncoder
 from mwptoolkit.module.Embedder.basic_embedder import BaiscEmbedder
 from mwptoolkit.module.Decoder.tree_decoder import TreeDecoder
 from mwptoolkit.module.Layer.tree_layers import NodeGenerater, SubTreeMerger, TreeNode, TreeEmbedding
-from mwptoolkit.module.Strategy.beam_search import TreeBeam
+from mwptoolkit.module.Strategy.beam_search import TreeBeamSearch
 from mwptoolkit.loss.masked_cross_entropy_loss import MaskedCrossEntropyLoss
 from mwptoolkit.utils.enum_type import SpecialTokens, NumMask
-from mwptoolkit.utils.utils import str2float, copy_list
+from mwptoolkit.utils.utils import str2float, copy_list, sequence_mask, gather_number_outputs
 
 
 class Graph2Tree(nn.Module):
@@ -62,28 +63,21 @@ class Graph2Tree(nn.Module):
         self.merge = SubTreeMerger(self.hidden_size, self.embedding_size, self.dropout_ratio)
 
         self.loss = MaskedCrossEntropyLoss()
+        # least recently used edges of problems, kept on cpu.
+        self._graph_cache = OrderedDict()
+        self.graph_cache_size = 4096
 
     def forward(self,seq, seq_length,group_nums,num_list, nums_stack, num_size, generate_nums, num_pos,\
                 num_start,target=None, target_length=None,UNK_TOKEN=None):
         # sequence mask for attention
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
 
         #build graph inputs
         #graphs=self.build_graph_input(seq_source,seq_length,num_list,num_pos)
         graphs = self.build_graph(seq_length, num_list, num_pos, group_nums)
 
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.embedder(seq)
         pade_outputs, encoder_outputs = self.encoder(seq_emb, seq_length, graphs)
@@ -116,24 +110,14 @@ class Graph2Tree(nn.Module):
         num_start = self.num_start
 
         # sequence mask for attention
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
 
         #build graph inputs
         #graphs=self.build_graph_input(seq_source,seq_length,num_list,num_pos)
-        graphs = self.build_graph(seq_length, num_list, num_pos, group_nums)
+        graphs = self.build_graph(seq_length, num_list, num_pos, group_nums, batch_data['id'])
 
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.embedder(seq)
         pade_outputs, encoder_outputs = self.encoder(seq_emb, seq_length, graphs)
@@ -162,24 +146,14 @@ class Graph2Tree(nn.Module):
         generate_nums = self.generate_nums
         num_start = self.num_start
         # sequence mask for attention
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
 
         #build graph inputs
         #graphs=self.build_graph_input(seq_source,seq_length,num_list,num_pos)
-        graphs = self.build_graph(seq_length, num_list, num_pos, group_nums)
+        graphs = self.build_graph(seq_length, num_list, num_pos, group_nums, batch_data['id'])
 
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.embedder(seq)
         pade_outputs, encoder_outputs = self.encoder(seq_emb, seq_length, graphs)
@@ -187,8 +161,11 @@ class Graph2Tree(nn.Module):
         #encoder_outputs = pade_outputs[:, :, :self.hidden_size] + pade_outputs[:, :, self.hidden_size:]
 
         all_node_outputs = self.generate_node_(encoder_outputs, problem_output, padding_hidden, seq_mask, num_mask, num_pos, num_start)
-        all_outputs = self.convert_idx2symbol(all_node_outputs, num_list[0], copy_list(nums_stack[0]))
-        targets = self.convert_idx2symbol(target[0], num_list[0], copy_list(nums_stack[0]))
+        all_outputs = []
+        targets = []
+        for b in range(batch_size):
+            all_outputs += self.convert_idx2symbol(all_node_outputs[b], num_list[b], copy_list(nums_stack[b]))
+            targets += self.convert_idx2symbol(target[b], num_list[b], copy_list(nums_stack[b]))
         return all_outputs, targets
 
     def generate_node(self,encoder_outputs,problem_output,target,target_length,\
@@ -244,138 +221,79 @@ class Graph2Tree(nn.Module):
 
     def generate_node_(self,encoder_outputs,problem_output,padding_hidden,seq_mask,num_mask,num_pos,\
                         num_start):
-        batch_size = encoder_outputs.size(0)
-        # Prepare input and output variables
-        node_stacks = [[TreeNode(_)] for _ in problem_output.split(1, dim=0)]
-
-        num_size = len(num_pos[0])
+        num_size = max([len(_) for _ in num_pos])
         all_nums_encoder_outputs = self.get_all_number_encoder_outputs(encoder_outputs, num_pos, num_size, self.encoder.hidden_size)
 
-        embeddings_stacks = [[] for _ in range(batch_size)]
-        left_childs = [None for _ in range(batch_size)]
-        beams = [TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, [])]
-        for t in range(self.max_length):
-            current_beams = []
-            while len(beams) > 0:
-                b = beams.pop()
-                if len(b.node_stack[0]) == 0:
-                    current_beams.append(b)
-                    continue
-                # left_childs = torch.stack(b.left_childs)
-                left_childs = b.left_childs
-
-                num_score, op, current_embeddings, current_context, current_nums_embeddings = self.decoder(b.node_stack, left_childs, encoder_outputs, all_nums_encoder_outputs, padding_hidden,
-                                                                                                           seq_mask, num_mask)
-
-                out_score = nn.functional.log_softmax(torch.cat((op, num_score), dim=1), dim=1)
-
-                # out_score = p_leaf * out_score
-
-                topv, topi = out_score.topk(self.beam_size)
-
-                for tv, ti in zip(topv.split(1, dim=1), topi.split(1, dim=1)):
-                    current_node_stack = self.copy_list(b.node_stack)
-                    current_left_childs = []
-                    current_embeddings_stacks = self.copy_list(b.embedding_stack)
-                    current_out = copy.deepcopy(b.out)
-
-                    out_token = int(ti)
-                    current_out.append(out_token)
-
-                    node = current_node_stack[0].pop()
-
-                    if out_token < num_start:
-                        generate_input = torch.LongTensor([out_token]).to(self.device)
-
-                        left_child, right_child, node_label = self.node_generater(current_embeddings, generate_input, current_context)
-
-                        current_node_stack[0].append(TreeNode(right_child))
-                        current_node_stack[0].append(TreeNode(left_child, left_flag=True))
+        beam_search = TreeBeamSearch(self.decoder, self.node_generater, self.merge, num_start, self.beam_size, self.max_length)
+        all_node_outputs, scores = beam_search.search(encoder_outputs, problem_output, all_nums_encoder_outputs, padding_hidden, seq_mask, num_mask)
+        return all_node_outputs
 
-                        current_embeddings_stacks[0].append(TreeEmbedding(node_label[0].unsqueeze(0), False))
-                    else:
-                        current_num = current_nums_embeddings[0, out_token - num_start].unsqueeze(0)
-
-                        while len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                            sub_stree = current_embeddings_stacks[0].pop()
-                            op = current_embeddings_stacks[0].pop()
-                            current_num = self.merge(op.embedding, sub_stree.embedding, current_num)
-                        current_embeddings_stacks[0].append(TreeEmbedding(current_num, True))
-                    if len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                        current_left_childs.append(current_embeddings_stacks[0][-1].embedding)
-                    else:
-                        current_left_childs.append(None)
-                    current_beams.append(TreeBeam(b.score + float(tv), current_node_stack, current_embeddings_stacks, current_left_childs, current_out))
-            beams = sorted(current_beams, key=lambda x: x.score, reverse=True)
-            beams = beams[:self.beam_size]
-            flag = True
-            for b in beams:
-                if len(b.node_stack[0]) != 0:
-                    flag = False
-            if flag:
-                break
-        return beams[0].out
+    def build_graph(self, seq_length, num_list, num_pos, group_nums, ids=None):
+        r"""build the five input graphs of a batch, shape [batch_size, 5, max_len, max_len].
 
-    def build_graph(self, seq_length, num_list, num_pos, group_nums):
-        max_len = seq_length.max()
+        edges of recently seen problems are cached on cpu per problem id, the batch graph is
+        filled from the edges of all problems with one scatter.
+        """
+        max_len = int(max(seq_length))
         batch_size = len(seq_length)
-        batch_graph = []
+        batch_edges = []
         for b_i in range(batch_size):
-            x = torch.zeros((max_len, max_len))
-            for idx in range(seq_length[b_i]):
-                x[idx, idx] = 1
-            quantity_cell_graph = torch.clone(x)
-            graph_greater = torch.clone(x)
-            graph_lower = torch.clone(x)
-            graph_quanbet = torch.clone(x)
-            graph_attbet = torch.clone(x)
-            for idx, n_pos in enumerate(num_pos[b_i]):
-                for pos in group_nums[b_i][idx]:
-                    quantity_cell_graph[n_pos, pos] = 1
-                    quantity_cell_graph[pos, n_pos] = 1
-                    graph_quanbet[n_pos, pos] = 1
-                    graph_quanbet[pos, n_pos] = 1
-                    graph_attbet[n_pos, pos] = 1
-                    graph_attbet[pos, n_pos] = 1
-            for idx_i in range(len(num_pos[b_i])):
-                for idx_j in range(len(num_pos[b_i])):
-                    num_i = str2float(num_list[b_i][idx_i])
-                    num_j = str2float(num_list[b_i][idx_j])
-                    # if '%' in num_list[b_i][idx_i]:
-                    #     num_i=eval(num_list[b_i][idx_i][:-1]+'/100')
-                    # elif '(' in num_list[b_i][idx_i]:
-                    #     num_i=eval(num_list[b_i][idx_i][1:-1])
-                    # else:
-                    #     num_i=float(num_list[b_i][idx_i])
-                    # if '%' in num_list[b_i][idx_j]:
-                    #     num_j=eval(num_list[b_i][idx_j][:-1]+'/100')
-                    # elif '(' in num_list[b_i][idx_j]:
-                    #     num_j=eval(num_list[b_i][idx_j][1:-1])
-                    # else:
-                    #     num_j=float(num_list[b_i][idx_j])
-                    if num_i > num_j:
-                        graph_greater[num_pos[b_i][idx_i]][num_pos[b_i][idx_j]] = 1
-                        graph_lower[num_pos[b_i][idx_j]][num_pos[b_i][idx_i]] = 1
-                    else:
-                        graph_greater[num_pos[b_i][idx_j]][num_pos[b_i][idx_i]] = 1
-                        graph_lower[num_pos[b_i][idx_i]][num_pos[b_i][idx_j]] = 1
-            group_num_ = itertools.chain.from_iterable(group_nums[b_i])
-            combn = itertools.permutations(group_num_, 2)
-            for idx in combn:
-                graph_quanbet[idx] = 1
-                graph_quanbet[idx] = 1
-                graph_attbet[idx] = 1
-                graph_attbet[idx] = 1
-            quantity_cell_graph = quantity_cell_graph.to(self.device)
-            graph_greater = graph_greater.to(self.device)
-            graph_lower = graph_lower.to(self.device)
-            graph_quanbet = graph_quanbet.to(self.device)
-            graph_attbet = graph_attbet.to(self.device)
-            graph = torch.stack([quantity_cell_graph, graph_greater, graph_lower, graph_quanbet, graph_attbet], dim=0)
-            batch_graph.append(graph)
-        batch_graph = torch.stack(batch_graph)
+            length = int(seq_length[b_i])
+            key = (ids[b_i], length) if ids is not None else None
+            edges = self._graph_cache.get(key) if key is not None else None
+            if edges is None:
+                edges = self.graph_edges(length, num_list[b_i], num_pos[b_i], group_nums[b_i])
+                if key is not None:
+                    self._graph_cache[key] = edges
+                    if len(self._graph_cache) > self.graph_cache_size:
+                        self._graph_cache.popitem(last=False)
+            else:
+                self._graph_cache.move_to_end(key)
+            batch_edges.append(edges)
+        batch_index = torch.repeat_interleave(torch.arange(batch_size), torch.tensor([len(edges) for edges in batch_edges]))
+        batch_index = batch_index.to(self.device)
+        batch_edges = torch.cat(batch_edges, dim=0).to(self.device)
+        batch_graph = torch.zeros((batch_size, 5, max_len, max_len), device=self.device)
+        batch_graph[batch_index, batch_edges[:, 0], batch_edges[:, 1], batch_edges[:, 2]] = 1
         return batch_graph
 
+    def graph_edges(self, length, num_list, num_pos, group_nums):
+        r"""edges of the five graphs of one problem.
+
+        Returns:
+            torch.LongTensor: edges (graph index, row, column), shape [edge_num, 3].
+                graphs are quantity cell graph, greater graph, lower graph, quantity between graph and attribute between graph.
+        """
+        edges = []
+        diag = torch.arange(length)
+        for graph_i in range(5):
+            edges.append(torch.stack([torch.full_like(diag, graph_i), diag, diag], dim=1))
+
+        # quantity cell edges between every number and the words of its group.
+        num_idx = [n_pos for idx, n_pos in enumerate(num_pos) for _ in group_nums[idx]]
+        cell_idx = [pos for idx in range(len(num_pos)) for pos in group_nums[idx]]
+        rows = torch.LongTensor(num_idx + cell_idx)
+        cols = torch.LongTensor(cell_idx + num_idx)
+        for graph_i in (0, 3, 4):
+            edges.append(torch.stack([torch.full_like(rows, graph_i), rows, cols], dim=1))
+
+        # greater graph holds pos_i -> pos_j if num_i >= num_j (not num_j > num_i), lower graph the transpose.
+        pos = torch.LongTensor(list(num_pos))
+        values = torch.tensor([str2float(num_list[idx]) for idx in range(len(num_pos))], dtype=torch.float64)
+        greater = values.unsqueeze(1) > values.unsqueeze(0)
+        greater = greater | ~greater.t()
+        pos_i, pos_j = pos.unsqueeze(1).expand_as(greater)[greater], pos.unsqueeze(0).expand_as(greater)[greater]
+        edges.append(torch.stack([torch.full_like(pos_i, 1), pos_i, pos_j], dim=1))
+        edges.append(torch.stack([torch.full_like(pos_i, 2), pos_j, pos_i], dim=1))
+
+        # quantity and attribute between edges among all words of the groups.
+        group_pos = torch.LongTensor(list(itertools.chain.from_iterable(group_nums)))
+        pair = ~torch.eye(len(group_pos), dtype=torch.bool)
+        rows, cols = group_pos.unsqueeze(1).expand_as(pair)[pair], group_pos.unsqueeze(0).expand_as(pair)[pair]
+        for graph_i in (3, 4):
+            edges.append(torch.stack([torch.full_like(rows, graph_i), rows, cols], dim=1))
+        return torch.cat(edges, dim=0)
+
     def build_graph_input(self, sentences, sent_len, num_list, num_pos):
         max_len = sent_len.max()
         nlp = stanza.Pipeline(self.language, processors='depparse,tokenize,pos,lemma', tokenize_pretokenized=True, logging_level='error')
@@ -491,31 +409,8 @@ class Graph2Tree(nn.Module):
         return group_nums, quantity_cell_graph, graph_greater, graph_lower, graph_quanbet, graph_attbet
 
     def get_all_number_encoder_outputs(self, encoder_outputs, num_pos, num_size, hidden_size):
-        indices = list()
-        sen_len = encoder_outputs.size(1)
-        batch_size = encoder_outputs.size(0)
-        masked_index = []
-        temp_1 = [1 for _ in range(hidden_size)]
-        temp_0 = [0 for _ in range(hidden_size)]
-        for b in range(batch_size):
-            for i in num_pos[b]:
-                if i == -1:
-                    indices.append(0)
-                    masked_index.append(temp_1)
-                    continue
-                indices.append(i + b * sen_len)
-                masked_index.append(temp_0)
-            indices += [0 for _ in range(len(num_pos[b]), num_size)]
-            masked_index += [temp_1 for _ in range(len(num_pos[b]), num_size)]
-        indices = torch.LongTensor(indices).to(self.device)
-        masked_index = torch.BoolTensor(masked_index).to(self.device)
-
-        masked_index = masked_index.view(batch_size, num_size, hidden_size)
-        all_outputs = encoder_outputs.contiguous()
-        all_embedding = all_outputs.view(-1, encoder_outputs.size(2))  # S x B x H -> (B x S) x H
-        all_num = all_embedding.index_select(0, indices)
-        all_num = all_num.view(batch_size, num_size, hidden_size)
-        return all_num.masked_fill_(masked_index, 0.0)
+        all_num, _ = gather_number_outputs(encoder_outputs, num_pos, num_size)
+        return all_num
 
     def generate_tree_input(self, target, decoder_output, nums_stack_batch, num_start, unk):
         # when the decoder input is copied num but the num has two pos, chose the max
@@ -573,6 +468,12 @@ class Graph2Tree(nn.Module):
         output_list.append(res)
         return output_list
 
+    def __getstate__(self):
+        # the graph cache is not copied with model, e.g. model snapshots for evaluation.
+        state = super().__getstate__()
+        state['_graph_cache'] = OrderedDict()
+        return state
+
     def __str__(self) -> str:
         info = super().__str__()
         total = sum(p.numel() for p in self.parameters())
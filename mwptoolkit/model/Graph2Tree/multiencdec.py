@@ -11,10 +11,10 @@ from mwptoolkit.module.Decoder.tree_decoder import TreeDecoder
 from mwptoolkit.module.Layer.layers import AttnDecoderRNN
 from mwptoolkit.module.Layer.tree_layers import NodeGenerater, SubTreeMerger, TreeNode, TreeEmbedding
 from mwptoolkit.module.Embedder.basic_embedder import BaiscEmbedder
-from mwptoolkit.module.Strategy.beam_search import TreeBeam, Beam
+from mwptoolkit.module.Strategy.beam_search import TreeBeamSearch, Beam
 from mwptoolkit.loss.masked_cross_entropy_loss import MaskedCrossEntropyLoss
 from mwptoolkit.utils.enum_type import SpecialTokens, NumMask
-from mwptoolkit.utils.utils import copy_list
+from mwptoolkit.utils.utils import copy_list, sequence_mask, gather_number_outputs
 
 
 class MultiEncDec(nn.Module):
@@ -119,18 +119,8 @@ class MultiEncDec(nn.Module):
     def forward(self,input1_var, input2_var, input_length, target1, target1_length, target2, target2_length,\
                 num_stack_batch, num_size_batch,generate_list,num_pos_batch, num_order_batch, parse_graph):
         # sequence mask for attention
-        seq_mask = []
-        max_len = max(input_length)
-        for i in input_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.ByteTensor(seq_mask)
-
-        num_mask = []
-        max_num_size = max(num_size_batch) + len(generate_list)
-        for i in num_size_batch:
-            d = i + len(generate_list)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.ByteTensor(num_mask)
+        seq_mask = sequence_mask(input_length).byte()
+        num_mask = sequence_mask(torch.as_tensor(num_size_batch) + len(generate_list)).byte()
 
         num_pos_pad = []
         max_num_pos_size = max(num_size_batch)
@@ -163,7 +153,7 @@ class MultiEncDec(nn.Module):
         target2 = target2.transpose(0, 1)
         parse_graph_pad = torch.LongTensor(parse_graph)
 
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0)
+        padding_hidden = torch.zeros(1, self.hidden_size)
         batch_size = len(input_length)
 
         encoder_outputs, encoder_hidden = self.encoder(input1_var, input2_var, input_length, parse_graph_pad)
@@ -205,18 +195,8 @@ class MultiEncDec(nn.Module):
         equ_mask1 = batch_data['equ mask1']
         equ_mask2 = batch_data['equ mask2']
         # sequence mask for attention
-        seq_mask = []
-        max_len = max(input_length)
-        for i in input_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size_batch) + len(generate_list)
-        for i in num_size_batch:
-            d = i + len(generate_list)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
+        seq_mask = sequence_mask(input_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size_batch) + len(generate_list), device=self.device)
 
         num_pos_pad = []
         max_num_pos_size = max(num_size_batch)
@@ -249,7 +229,7 @@ class MultiEncDec(nn.Module):
         # target2 = target2.transpose(0, 1)
         parse_graph_pad = parse_graph.long()
 
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(input_length)
 
         encoder_outputs, encoder_hidden = self.encoder(input1_var, input2_var, input_length, parse_graph_pad)
@@ -286,18 +266,8 @@ class MultiEncDec(nn.Module):
         parse_graph = batch_data['parse graph']
         num_list = batch_data['num list']
         # sequence mask for attention
-        seq_mask = []
-        max_len = max(input_length)
-        for i in input_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size_batch) + len(generate_list)
-        for i in num_size_batch:
-            d = i + len(generate_list)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
+        seq_mask = sequence_mask(input_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size_batch) + len(generate_list), device=self.device)
 
         num_pos_pad = []
         max_num_pos_size = max(num_size_batch)
@@ -330,7 +300,7 @@ class MultiEncDec(nn.Module):
         # target2 = target2.transpose(0, 1)
         parse_graph_pad = parse_graph.long()
 
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(input_length)
 
         encoder_outputs, encoder_hidden = self.encoder(input1_var, input2_var, input_length, parse_graph_pad)
@@ -341,10 +311,10 @@ class MultiEncDec(nn.Module):
         num_outputs = num_outputs.masked_fill_(masked_index.bool(), 0.0)
 
         decoder_hidden = encoder_hidden[:self.n_layers]  # Use last (forward) hidden state from encoder
-        all_output1 = self.evaluate_tree_double(encoder_outputs, problem_output, num_outputs, batch_size, padding_hidden, seq_mask, num_mask)
+        all_output1, scores1 = self.evaluate_tree_double(encoder_outputs, problem_output, num_outputs, batch_size, padding_hidden, seq_mask, num_mask)
         all_output2 = self.evaluate_attn_double(encoder_outputs, decoder_hidden, batch_size, seq_mask)
-        if all_output1.score >= all_output2.score:
-            output1=self.convert_idx2symbol1(all_output1.out,num_list[0],copy_list(num_stack1_batch[0]))
+        if scores1[0] >= all_output2.score:
+            output1=self.convert_idx2symbol1(all_output1[0],num_list[0],copy_list(num_stack1_batch[0]))
             targets1=self.convert_idx2symbol1(target1[0],num_list[0],copy_list(num_stack1_batch[0]))
             return "tree", output1, targets1
         else:
@@ -493,77 +463,8 @@ class MultiEncDec(nn.Module):
         return all_decoder_outputs
 
     def evaluate_tree_double(self, encoder_outputs, problem_output, all_nums_encoder_outputs, batch_size, padding_hidden, seq_mask, num_mask):
-        # Prepare input and output variables
-        node_stacks = [[TreeNode(_)] for _ in problem_output.split(1, dim=0)]
-
-        #num_start = output_lang.num_start
-        # B x P x N
-        embeddings_stacks = [[] for _ in range(batch_size)]
-        left_childs = [None for _ in range(batch_size)]
-
-        beams = [TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, [])]
-
-        for t in range(self.max_out_len):
-            current_beams = []
-            while len(beams) > 0:
-                b = beams.pop()
-                if len(b.node_stack[0]) == 0:
-                    current_beams.append(b)
-                    continue
-                # left_childs = torch.stack(b.left_childs)
-                left_childs = b.left_childs
-
-                num_score, op, current_embeddings, current_context, current_nums_embeddings = self.predict(b.node_stack, left_childs, encoder_outputs, all_nums_encoder_outputs, padding_hidden,
-                                                                                                           seq_mask, num_mask)
-
-                out_score = nn.functional.log_softmax(torch.cat((op, num_score), dim=1), dim=1)
-
-                topv, topi = out_score.topk(self.beam_size)
-
-                for tv, ti in zip(topv.split(1, dim=1), topi.split(1, dim=1)):
-                    current_node_stack = copy_list(b.node_stack)
-                    current_left_childs = []
-                    current_embeddings_stacks = copy_list(b.embedding_stack)
-                    current_out = copy.deepcopy(b.out)
-
-                    out_token = int(ti)
-                    current_out.append(out_token)
-
-                    node = current_node_stack[0].pop()
-
-                    if out_token < self.num_start1:
-                        generate_input = torch.LongTensor([out_token]).to(self.device)
-                        # if USE_CUDA:
-                        #     generate_input = generate_input.cuda()
-                        left_child, right_child, node_label = self.generate(current_embeddings, generate_input, current_context)
-
-                        current_node_stack[0].append(TreeNode(right_child))
-                        current_node_stack[0].append(TreeNode(left_child, left_flag=True))
-
-                        current_embeddings_stacks[0].append(TreeEmbedding(node_label[0].unsqueeze(0), False))
-                    else:
-                        current_num = current_nums_embeddings[0, out_token - self.num_start1].unsqueeze(0)
-
-                        while len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                            sub_stree = current_embeddings_stacks[0].pop()
-                            op = current_embeddings_stacks[0].pop()
-                            current_num = self.merge(op.embedding, sub_stree.embedding, current_num)
-                        current_embeddings_stacks[0].append(TreeEmbedding(current_num, True))
-                    if len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                        current_left_childs.append(current_embeddings_stacks[0][-1].embedding)
-                    else:
-                        current_left_childs.append(None)
-                    current_beams.append(TreeBeam(b.score + float(tv), current_node_stack, current_embeddings_stacks, current_left_childs, current_out))
-            beams = sorted(current_beams, key=lambda x: x.score, reverse=True)
-            beams = beams[:self.beam_size]
-            flag = True
-            for b in beams:
-                if len(b.node_stack[0]) != 0:
-                    flag = False
-            if flag:
-                break
-
-        return beams[0]
+        beam_search = TreeBeamSearch(self.predict, self.generate, self.merge, self.num_start1, self.beam_size, self.max_out_len)
+        return beam_search.search(encoder_outputs, problem_output, all_nums_encoder_outputs, padding_hidden, seq_mask, num_mask)
 
     def evaluate_attn_double(self, encoder_outputs, decoder_hidden, batch_size, seq_mask):
         # Create starting vectors for decoder
@@ -625,32 +526,8 @@ class MultiEncDec(nn.Module):
                 beam_list = temp_list[:self.beam_size]
         return beam_list[0]
     def get_all_number_encoder_outputs(self, encoder_outputs, num_pos, num_size, hidden_size):
-        indices = list()
-        sen_len = encoder_outputs.size(1)
-        batch_size = encoder_outputs.size(0)
-        masked_index = []
-        temp_1 = [1 for _ in range(hidden_size)]
-        temp_0 = [0 for _ in range(hidden_size)]
-        for b in range(batch_size):
-            for i in num_pos[b]:
-                if i == -1:
-                    indices.append(0)
-                    masked_index.append(temp_1)
-                    continue
-                indices.append(i + b * sen_len)
-                masked_index.append(temp_0)
-            indices += [0 for _ in range(len(num_pos[b]), num_size)]
-            masked_index += [temp_1 for _ in range(len(num_pos[b]), num_size)]
-        # indices = torch.LongTensor(indices)
-        # masked_index = torch.ByteTensor(masked_index)
-        indices = torch.LongTensor(indices).to(self.device)
-        masked_index = torch.BoolTensor(masked_index).to(self.device)
-        masked_index = masked_index.view(batch_size, num_size, hidden_size)
-        all_outputs = encoder_outputs.transpose(0, 1).contiguous()
-        all_embedding = all_outputs.view(-1, encoder_outputs.size(2))  # S x B x H -> (B x S) x H
-        all_num = all_embedding.index_select(0, indices)
-        all_num = all_num.view(batch_size, num_size, hidden_size)
-        return all_num.masked_fill_(masked_index.bool(), 0.0), masked_index
+        all_num, masked_index = gather_number_outputs(encoder_outputs, num_pos, num_size)
+        return all_num, masked_index.unsqueeze(2).expand_as(all_num)
 
     def generate_tree_input(self, target, decoder_output, nums_stack_batch):
         # when the decoder input is copied num but the num has two pos, chose the max
@@ -161,16 +161,15 @@ class AlbertGen(nn.Module):
         else:
             token_logits = []
             input_seq = torch.LongTensor([self.out_sos_idx] * batch_size).view(batch_size, -1).to(device)
-            pre_tokens = [input_seq]
+            cache = self.decoder.init_cache()
             for idx in range(seq_len):
-                self_attn_mask = self.self_attentioner(input_seq.size(-1)).bool()
-                decoder_input = self.pos_embedder(self.out_embedder(input_seq))
+                decoder_input = self.pos_embedder(self.out_embedder(input_seq), offset=idx)
                 decoder_outputs = self.decoder(decoder_input,
-                                               self_attn_mask=self_attn_mask,
                                                external_states=encoder_outputs,
-                                               external_padding_mask=source_padding_mask)
+                                               external_padding_mask=source_padding_mask,
+                                               cache=cache)
 
-                token_logit = self.out(decoder_outputs[:, -1, :].unsqueeze(1))
+                token_logit = self.out(decoder_outputs)
                 token_logits.append(token_logit)
                 if self.decoding_strategy == "topk_sampling":
                     output = topk_sampling(token_logit, top_k=5)
@@ -179,10 +178,9 @@ class AlbertGen(nn.Module):
                 else:
                     raise NotImplementedError
                 if self.share_vocab:
-                    pre_tokens.append(self.decode(output))
+                    input_seq = self.decode(output)
                 else:
-                    pre_tokens.append(output)
-                input_seq = torch.cat(pre_tokens, dim=1)
+                    input_seq = output
             token_logits = torch.cat(token_logits, dim=1)
             token_logits = token_logits.view(-1, token_logits.size(-1))
         return token_logits
@@ -191,18 +189,17 @@ class AlbertGen(nn.Module):
         batch_size = encoder_outputs.size(0)
         device = encoder_outputs.device
         input_seq = torch.LongTensor([self.out_sos_idx] * batch_size).view(batch_size, -1).to(device)
-        pre_tokens = [input_seq]
         all_outputs = []
+        cache = self.decoder.init_cache()
         for gen_idx in range(self.max_output_len):
-            self_attn_mask = self.self_attentioner(input_seq.size(-1)).bool()
-            # decoder_input = self.out_embedder(input_seq) + self.pos_embedder(input_seq)
-            decoder_input = self.pos_embedder(self.out_embedder(input_seq))
+            # only the new token is fed, keys and values of former tokens are cached in decoder
+            decoder_input = self.pos_embedder(self.out_embedder(input_seq), offset=gen_idx)
             decoder_outputs = self.decoder(decoder_input,
-                                           self_attn_mask=self_attn_mask,
                                            external_states=encoder_outputs,
-                                           external_padding_mask=source_padding_mask)
+                                           external_padding_mask=source_padding_mask,
+                                           cache=cache)
 
-            token_logits = self.out(decoder_outputs[:, -1, :].unsqueeze(1))
+            token_logits = self.out(decoder_outputs)
             if self.decoding_strategy == "topk_sampling":
                 output = topk_sampling(token_logits, top_k=5)
             elif self.decoding_strategy == "greedy_search":
@@ -211,10 +208,9 @@ class AlbertGen(nn.Module):
                 raise NotImplementedError
             all_outputs.append(output)
             if self.share_vocab:
-                pre_tokens.append(self.decode(output))
+                input_seq = self.decode(output)
             else:
-                pre_tokens.append(output)
-            input_seq = torch.cat(pre_tokens, dim=1)
+                input_seq = output
         all_outputs = torch.cat(all_outputs, dim=1)
         # print (all_outputs)
         all_outputs = self.decode_(all_outputs)
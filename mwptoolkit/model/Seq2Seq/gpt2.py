@@ -93,27 +93,67 @@ class GPT2(nn.Module):
         y=''.join(x)
         return y
 
-    def generate_t(self,seq,target=None):
+    def build_prompts(self, seq):
+        r"""encode questions into left-padded prompts ending with <ans>.
+
+        Args:
+            seq (list): question strings.
+
+        Returns:
+            tuple(torch.Tensor, torch.Tensor):
+                - input ids, shape [batch_size, src_length].
+                - attention mask, 0 at left padding, shape [batch_size, src_length].
+        """
         srcs = []
-        tgts = []
-        for idx,s in enumerate(seq):
+        for idx, s in enumerate(seq):
             src = self.tokenizer.encode(seq[idx])
-            tgt = self.tokenizer.encode(target[idx])
             srcs.append(src)
+        src_length = max([len(_) for _ in srcs]) + 1
+        ans_ids = self.tokenizer.encode(['<ans>'])
+
+        attn_masks = []
+        for i in range(len(srcs)):
+            pad_length = src_length - len(srcs[i])
+            srcs[i] = pad_length * [self.eos_token_id] + srcs[i] + ans_ids
+            attn_masks.append(pad_length * [0] + (len(srcs[i]) - pad_length) * [1])
+        srcs_tensor = torch.LongTensor(srcs).to(self.device)
+        attn_masks = torch.LongTensor(attn_masks).to(self.device)
+        return srcs_tensor, attn_masks
+
+    def get_position_ids(self, attn_masks):
+        r"""positions count from the first unpadded token of every row.
+        """
+        position_ids = attn_masks.cumsum(dim=1) - 1
+        return position_ids.clamp(min=0)
+
+    def select_past(self, past, index):
+        r"""keep rows of index in cached key values of every layer.
+        """
+        if hasattr(past, "batch_select_indices"):
+            past.batch_select_indices(index)
+            return past
+        selected = []
+        for layer_past in past:
+            if isinstance(layer_past, torch.Tensor):
+                # [2, batch_size, num_heads, seq_length, head_size]
+                selected.append(layer_past.index_select(1, index))
+            else:
+                selected.append(tuple([p.index_select(0, index) for p in layer_past]))
+        return tuple(selected)
+
+    def generate_t(self,seq,target=None):
+        tgts = []
+        for idx,s in enumerate(target):
+            tgt = self.tokenizer.encode(target[idx])
             tgts.append(tgt)
 
-        src_length = max([len(_) for _ in srcs]) + 1
         tgt_length = max([len(_) for _ in tgts]) + 1
 
-
         for i in range(len(tgts)):
             tgts[i] += (tgt_length - len(tgts[i])) * [self.eos_token_id]
         tgts_tensor = torch.LongTensor(tgts)
 
-        for i in range(len(srcs)):
-            srcs[i] = (src_length - len(srcs[i])) * [self.eos_token_id] + srcs[i] +self.tokenizer.encode(['<ans>'])
-        srcs_tensor = torch.LongTensor(srcs)
-        src_length+=1
+        srcs_tensor, src_attn_masks = self.build_prompts(seq)
 
 
         seq_mask = (tgts_tensor != self.eos_token_id)[:, :-1].float()
@@ -129,40 +169,47 @@ class GPT2(nn.Module):
         seq_mask = seq_mask.to(self.device)
 
         inputs = torch.cat([srcs_tensor, tgts_inputs_tensor], 1)
-        logits = self.decoder(inputs)[0]
+        attn_masks = torch.cat([src_attn_masks, torch.ones_like(tgts_inputs_tensor)], 1)
+        position_ids = self.get_position_ids(attn_masks)
+        logits = self.decoder(inputs, attention_mask=attn_masks, position_ids=position_ids)[0]
         logits = logits[:, -tgts_outputs_tensor.shape[1]:, :].contiguous()
         logits = logits.view(-1, logits.shape[-1])
         return logits,tgts_outputs_tensor
 
     def generate_without_t(self,seq):
-
-        srcs = []
-        for idx, s in enumerate(seq):
-            src = self.tokenizer.encode(seq[idx])
-            srcs.append(src)
-        src_length = max([len(_) for _ in srcs]) + 1
-
-        for i in range(len(srcs)):
-            srcs[i] = (src_length - len(srcs[i])) * [self.eos_token_id] + srcs[i] + self.tokenizer.encode(
-                ['<ans>'])
-        srcs_tensor = torch.LongTensor(srcs)
-        src_length += 1
-
-        srcs_tensor = srcs_tensor.to(self.device)
-        inputs = srcs_tensor
-
-        all_output = []
+        r"""greedy decoding, reusing past key values of the decoder.
+
+        only the new token of unfinished rows is fed at every step,
+        rows that have emitted eos are dropped from the batch and the cache.
+        """
+        inputs, attn_masks = self.build_prompts(seq)
+        position_ids = self.get_position_ids(attn_masks)
+        batch_size = inputs.size(0)
+
+        all_output = torch.full((batch_size, self.max_out_len), self.eos_token_id, dtype=torch.long, device=self.device)
+        active_rows = torch.arange(batch_size, device=self.device)
+        past = None
         for idx in range(self.max_out_len):
-            outputs = self.decoder(inputs)
-            token_logit=outputs[0][:,-1,:]
-            tokens=token_logit.topk(1,dim=1)[1]
-            # mask=tokens==self.tokenizer.pad_token_id
-            all_output.append(tokens)
-            inputs=torch.cat((inputs,tokens),dim=1)
-        all_output=torch.cat(all_output,dim=1)
+            outputs = self.decoder(inputs, past_key_values=past, attention_mask=attn_masks, position_ids=position_ids, use_cache=True)
+            token_logit = outputs[0][:, -1, :]
+            past = outputs[1]
+            tokens = token_logit.topk(1, dim=1)[1]
+            all_output[active_rows, idx] = tokens.squeeze(1)
+
+            unfinished = tokens.squeeze(1) != self.eos_token_id
+            if not unfinished.any():
+                break
+            if not unfinished.all():
+                keep = unfinished.nonzero().squeeze(1)
+                active_rows = active_rows[keep]
+                tokens = tokens[keep]
+                attn_masks = attn_masks[keep]
+                position_ids = position_ids[keep]
+                past = self.select_past(past, keep)
+            inputs = tokens
+            attn_masks = torch.cat([attn_masks, attn_masks.new_ones(attn_masks.size(0), 1)], dim=1)
+            position_ids = position_ids[:, -1:] + 1
         all_output = self.decode_(all_output)
-        # print (all_output)
-        # print ("all_output:", all_output.size())
         return all_output
 
     def decode_(self,outputs):
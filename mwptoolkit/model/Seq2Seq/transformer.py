@@ -200,22 +200,20 @@ class Transformer(nn.Module):
         else:
             token_logits = []
             input_seq = torch.LongTensor([self.out_sos_token] * batch_size).view(batch_size, -1).to(device)
-            pre_tokens = [input_seq]
+            cache = self.decoder.init_cache()
             for idx in range(seq_len):
-                self_attn_mask = self.self_attentioner(input_seq.size(-1)).bool()
                 #decoder_input = self.pos_embedder(self.out_embedder(input_seq))
-                decoder_input = self.out_embedder(input_seq) + self.pos_embedder(input_seq).to(device)
-                decoder_outputs = self.decoder(decoder_input, self_attn_mask=self_attn_mask, external_states=encoder_outputs, external_padding_mask=source_padding_mask)
+                decoder_input = self.out_embedder(input_seq) + self.pos_embedder(input_seq, offset=idx).to(device)
+                decoder_outputs = self.decoder(decoder_input, external_states=encoder_outputs, external_padding_mask=source_padding_mask, cache=cache)
 
-                token_logit = self.out(decoder_outputs[:, -1, :].unsqueeze(1))
+                token_logit = self.out(decoder_outputs)
                 token_logits.append(token_logit)
                 #output=greedy_search(token_logit)
-                output = torch.topk(token_logit.squeeze(), 1, dim=-1)[1]
+                output = torch.topk(token_logit.squeeze(1), 1, dim=-1)[1]
                 if self.share_vocab:
-                    pre_tokens.append(self.convert_out_idx_2_in_idx(output))
+                    input_seq = self.convert_out_idx_2_in_idx(output)
                 else:
-                    pre_tokens.append(output)
-                input_seq = torch.cat(pre_tokens, dim=1)
+                    input_seq = output
             token_logits = torch.cat(token_logits, dim=1)
             token_logits = token_logits.view(-1, token_logits.size(-1))
         token_logits = torch.log_softmax(token_logits, dim=1)
@@ -245,15 +243,15 @@ class Transformer(nn.Module):
         batch_size = encoder_outputs.size(0)
         device = encoder_outputs.device
         input_seq = torch.LongTensor([self.out_sos_token] * batch_size).view(batch_size, -1).to(device)
-        pre_tokens = [input_seq]
         all_outputs = []
+        cache = self.decoder.init_cache()
         for gen_idx in range(self.max_output_len):
-            self_attn_mask = self.self_attentioner(input_seq.size(-1)).bool()
-            decoder_input = self.out_embedder(input_seq) + self.pos_embedder(input_seq).to(device)
+            # only the new token is fed, keys and values of former tokens are cached in decoder
+            decoder_input = self.out_embedder(input_seq) + self.pos_embedder(input_seq, offset=gen_idx).to(device)
             #decoder_input = self.pos_embedder(self.out_embedder(input_seq))
-            decoder_outputs = self.decoder(decoder_input, self_attn_mask=self_attn_mask, external_states=encoder_outputs, external_padding_mask=source_padding_mask)
+            decoder_outputs = self.decoder(decoder_input, external_states=encoder_outputs, external_padding_mask=source_padding_mask, cache=cache)
 
-            token_logits = self.out(decoder_outputs[:, -1, :].unsqueeze(1))
+            token_logits = self.out(decoder_outputs)
             if self.decoding_strategy == "topk_sampling":
                 output = topk_sampling(token_logits, top_k=5)
             elif self.decoding_strategy == "greedy_search":
@@ -262,10 +260,9 @@ class Transformer(nn.Module):
                 raise NotImplementedError
             all_outputs.append(output)
             if self.share_vocab:
-                pre_tokens.append(self.convert_out_idx_2_in_idx(output))
+                input_seq = self.convert_out_idx_2_in_idx(output)
             else:
-                pre_tokens.append(output)
-            input_seq = torch.cat(pre_tokens, dim=1)
+                input_seq = output
         all_outputs = torch.cat(all_outputs, dim=1)
         return all_outputs
 
@@ -2,14 +2,16 @@ import torch
 from torch import nn
 import copy
 import random
+import numpy as np
 from mwptoolkit.module.Encoder.rnn_encoder import BasicRNNEncoder
 from mwptoolkit.module.Embedder.basic_embedder import BaiscEmbedder
 from mwptoolkit.module.Decoder.tree_decoder import TreeDecoder
 from mwptoolkit.module.Layer.tree_layers import *
-from mwptoolkit.module.Strategy.beam_search import TreeBeam
-from mwptoolkit.module.Strategy.weakly_supervising import Weakly_Supervising, out_expression_list
+from mwptoolkit.module.Strategy.beam_search import TreeBeamSearch
+from mwptoolkit.module.Strategy.weakly_supervising import out_expression_list
+from mwptoolkit.module.Strategy.fix_search import get_fix_search_pool
 from mwptoolkit.loss.masked_cross_entropy_loss import MaskedCrossEntropyLoss
-from mwptoolkit.utils.utils import copy_list, get_weakly_supervised
+from mwptoolkit.utils.utils import copy_list, sequence_mask, gather_number_outputs, get_weakly_supervised
 from mwptoolkit.utils.enum_type import NumMask, SpecialTokens
 
 
@@ -25,6 +27,8 @@ class GTS(nn.Module):
         self.dropout_ratio = config["dropout_ratio"]
         self.num_layers = config["num_layers"]
         self.rnn_cell_type = config["rnn_cell_type"]
+        self.fix_workers = config["fix_workers"]
+        self.fix_timeout = config["fix_timeout"]
 
         self.vocab_size = len(dataset.in_idx2word)
         self.out_symbol2idx = dataset.out_symbol2idx
@@ -61,20 +65,10 @@ class GTS(nn.Module):
                 num_start,target=None, target_length=None,max_length=30,beam_size=5,UNK_TOKEN=None):
         # sequence mask for attention
         beam_size = self.beam_size
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.embedder(seq)
         pade_outputs, _ = self.encoder(seq_emb, seq_length)
@@ -106,20 +100,10 @@ class GTS(nn.Module):
         num_start = self.num_start
         # sequence mask for attention
         beam_size = self.beam_size
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.embedder(seq)
         pade_outputs, _ = self.encoder(seq_emb, seq_length)
@@ -152,20 +136,10 @@ class GTS(nn.Module):
         # sequence mask for attention
         beam_size = self.beam_size
         max_length = self.max_out_len
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.embedder(seq)
         pade_outputs, _ = self.encoder(seq_emb, seq_length)
@@ -175,8 +149,11 @@ class GTS(nn.Module):
         #print("problem_output", problem_output.size())
 
         all_node_outputs = self.generate_node_(encoder_outputs, problem_output, padding_hidden, seq_mask, num_mask, num_pos, num_start, beam_size, max_length)
-        all_outputs = self.convert_idx2symbol(all_node_outputs, num_list[0], copy_list(nums_stack[0]))
-        targets = self.convert_idx2symbol(target[0], num_list[0], copy_list(nums_stack[0]))
+        all_outputs = []
+        targets = []
+        for b in range(batch_size):
+            all_outputs += self.convert_idx2symbol(all_node_outputs[b], num_list[b], copy_list(nums_stack[b]))
+            targets += self.convert_idx2symbol(target[b], num_list[b], copy_list(nums_stack[b]))
 
         return all_outputs, targets
 
@@ -240,104 +217,16 @@ class GTS(nn.Module):
 
     def generate_node_(self,encoder_outputs,problem_output,padding_hidden,seq_mask,num_mask,num_pos,\
                         num_start,beam_size,max_length):
-        batch_size = encoder_outputs.size(0)
-        # Prepare input and output variables
-        node_stacks = [[TreeNode(_)] for _ in problem_output.split(1, dim=0)]
-
-        num_size = len(num_pos[0])
+        num_size = max([len(_) for _ in num_pos])
         all_nums_encoder_outputs = self.get_all_number_encoder_outputs(encoder_outputs, num_pos, num_size, self.encoder.hidden_size)
 
-        embeddings_stacks = [[] for _ in range(batch_size)]
-        left_childs = [None for _ in range(batch_size)]
-        beams = [TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, [])]
-        for t in range(max_length):
-            current_beams = []
-            while len(beams) > 0:
-                b = beams.pop()
-                if len(b.node_stack[0]) == 0:
-                    current_beams.append(b)
-                    continue
-                # left_childs = torch.stack(b.left_childs)
-                left_childs = b.left_childs
-
-                num_score, op, current_embeddings, current_context, current_nums_embeddings = self.decoder(b.node_stack, left_childs, encoder_outputs, all_nums_encoder_outputs, padding_hidden,
-                                                                                                           seq_mask, num_mask)
-
-                out_score = nn.functional.log_softmax(torch.cat((op, num_score), dim=1), dim=1)
-
-                # out_score = p_leaf * out_score
-
-                topv, topi = out_score.topk(beam_size)
-
-                for tv, ti in zip(topv.split(1, dim=1), topi.split(1, dim=1)):
-                    current_node_stack = self.copy_list(b.node_stack)
-                    current_left_childs = []
-                    current_embeddings_stacks = self.copy_list(b.embedding_stack)
-                    current_out = copy.deepcopy(b.out)
-
-                    out_token = int(ti)
-                    current_out.append(out_token)
-
-                    node = current_node_stack[0].pop()
-
-                    if out_token < num_start:
-                        generate_input = torch.LongTensor([out_token]).to(self.device)
-
-                        left_child, right_child, node_label = self.node_generater(current_embeddings, generate_input, current_context)
-
-                        current_node_stack[0].append(TreeNode(right_child))
-                        current_node_stack[0].append(TreeNode(left_child, left_flag=True))
-
-                        current_embeddings_stacks[0].append(TreeEmbedding(node_label[0].unsqueeze(0), False))
-                    else:
-                        current_num = current_nums_embeddings[0, out_token - num_start].unsqueeze(0)
-
-                        while len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                            sub_stree = current_embeddings_stacks[0].pop()
-                            op = current_embeddings_stacks[0].pop()
-                            current_num = self.merge(op.embedding, sub_stree.embedding, current_num)
-                        current_embeddings_stacks[0].append(TreeEmbedding(current_num, True))
-                    if len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                        current_left_childs.append(current_embeddings_stacks[0][-1].embedding)
-                    else:
-                        current_left_childs.append(None)
-                    current_beams.append(TreeBeam(b.score + float(tv), current_node_stack, current_embeddings_stacks, current_left_childs, current_out))
-            beams = sorted(current_beams, key=lambda x: x.score, reverse=True)
-            beams = beams[:beam_size]
-            flag = True
-            for b in beams:
-                if len(b.node_stack[0]) != 0:
-                    flag = False
-            if flag:
-                break
-        return beams[0].out
+        beam_search = TreeBeamSearch(self.decoder, self.node_generater, self.merge, num_start, beam_size, max_length)
+        all_node_outputs, scores = beam_search.search(encoder_outputs, problem_output, all_nums_encoder_outputs, padding_hidden, seq_mask, num_mask)
+        return all_node_outputs
 
     def get_all_number_encoder_outputs(self, encoder_outputs, num_pos, num_size, hidden_size):
-        indices = list()
-        sen_len = encoder_outputs.size(1)
-        batch_size = encoder_outputs.size(0)
-        masked_index = []
-        temp_1 = [1 for _ in range(hidden_size)]
-        temp_0 = [0 for _ in range(hidden_size)]
-        for b in range(batch_size):
-            for i in num_pos[b]:
-                if i == -1:
-                    indices.append(0)
-                    masked_index.append(temp_1)
-                    continue
-                indices.append(i + b * sen_len)
-                masked_index.append(temp_0)
-            indices += [0 for _ in range(len(num_pos[b]), num_size)]
-            masked_index += [temp_1 for _ in range(len(num_pos[b]), num_size)]
-        indices = torch.LongTensor(indices).to(self.device)
-        masked_index = torch.BoolTensor(masked_index).to(self.device)
-
-        masked_index = masked_index.view(batch_size, num_size, hidden_size)
-        all_outputs = encoder_outputs.contiguous()
-        all_embedding = all_outputs.view(-1, encoder_outputs.size(2))  # S x B x H -> (B x S) x H
-        all_num = all_embedding.index_select(0, indices)
-        all_num = all_num.view(batch_size, num_size, hidden_size)
-        return all_num.masked_fill_(masked_index, 0.0)
+        all_num, _ = gather_number_outputs(encoder_outputs, num_pos, num_size)
+        return all_num
 
     def generate_tree_input(self, target, decoder_output, nums_stack_batch, num_start, unk):
         target_input = copy.deepcopy(target)
@@ -390,12 +279,8 @@ class GTS(nn.Module):
         print("num_size", num_size)
         print("*"*89)
         '''
-        seq_mask = []
-        max_len = max(seq_length)
         # print("nums_stack", nums_stack)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])  #
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
         gen_length1 = [2 * len(i) - 1 for i in nums_stack]
         gen_length2 = [2 * len(i) + 1 for i in nums_stack]
         gen_length3 = [2 * len(i) + 3 for i in nums_stack]
@@ -405,14 +290,9 @@ class GTS(nn.Module):
         # print("gen_length1", gen_length1)
         # print("gen_length3", gen_length3)
 
-        num_mask = []
-        max_num_size = max(num_size) + 2
-        for i in num_size:
-            d = i + 2
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
 
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
 
         seq_emb = self.embedder(seq)
@@ -436,6 +316,12 @@ class GTS(nn.Module):
         fix_target_length = []  #
         fix_input_length = []  #
         fix_found = [False for _ in range(batch_size)]  #
+        strategy = get_weakly_supervised(supervising_mode)
+        if self.fix_workers and supervising_mode in ['fix', 'mafix']:
+            fix_search_pool = get_fix_search_pool(self.fix_workers, self.fix_timeout)
+        else:
+            fix_search_pool = None
+        searches = []
         for gen_length in gen_lengths:
             target_length = gen_length
             max_target_length = max(target_length)
@@ -481,7 +367,7 @@ class GTS(nn.Module):
                         if t == target_length[i] - 1:
                             op2[i, :] = -1e10  # last is a number
                         if mask_flag:
-                            num_score2[i][:2] = -1e10  # for the first iterations, do not generate 1 and 3.14
+                            num_score2[i][:len(generate_nums)] = -1e10  # for the first iterations, do not generate constants like 1 and 3.14
                         if t == 1 and target_length[i] == 5 and epoch < 5:
                             if random.random() > 0.7:
                                 num_score2[i, :] = -1e2
@@ -543,39 +429,60 @@ class GTS(nn.Module):
 
             generate_exps = generate_exps.transpose(0, 1)
             all_node_outputs_mask = torch.stack(all_node_outputs_mask, dim=1)  # B x S x N
+            items = self.weak_search_items(generate_exps, all_node_outputs_mask, nums_stack, target_length, num_start, len(generate_nums), fix_found, Lang)
+            if fix_search_pool is not None:
+                # search on the pool while the next gen_length is decoded, fixes are applied in order below
+                tasks = [(generate_exp[:target_length[idx]], num_ans[idx], probs, list(all_list), num_start, n_step, np.random.randint(2**31 - 1))
+                         for idx, exp, num, generate_exp, all_list, probs in items]
+                searches.append((target_length, items, fix_search_pool.submit(tasks)))
+                continue
             buffer_batch_new = buffer_batch.copy()  #
             buffer_batch_new_exp = buffer_batch_exp.copy()
-            for idx, exp, num in zip(range(batch_size), generate_exps, nums_stack):
-                if fix_found[idx] == True:
-                    continue
-                generate_exp = out_expression_list(exp, Lang, num)  #
-                all_list = Lang.dataset.out_idx2symbol[:num_start + 2] + num  #
-                probs = all_node_outputs_mask[idx].detach().cpu().numpy()  #
-                probs = probs[:target_length[idx]]  #
-                probs = probs[:, :num_start + 2 + len(num)]
-
+            for idx, exp, num, generate_exp, all_list, probs in items:
                 fix_input_length, fix_target_list, \
                 fix_index, fix_target_length, \
-                fix_found, buffer_batch_new, buffer_batch_new_exp = get_weakly_supervised(supervising_mode)(idx, exp, num, generate_exp, target_length, num_ans, all_list,
+                fix_found, buffer_batch_new, buffer_batch_new_exp = strategy(idx, exp, num, generate_exp, target_length, num_ans, all_list,
                                                         probs, num_start, n_step, fix_input_length,
                                                         fix_target_list, fix_index, fix_target_length, fix_found,
                                                         buffer_batch_new, buffer_batch_new_exp,
                                                         seq_length, Lang)
-                #print("fix_input_length", fix_input_length)
-                #print("fix_index", fix_index)
-                #print("fix_found", fix_found)
-                #print("~" * 89)
-
-            # print("generate_exps", generate_exps.size())
-            # print("all_node_outputs_mask", all_node_outputs_mask.size())
-
-            # fix_input_length, fix_target_list, fix_index, fix_target_length, buffer_batch_new, buffer_batch_new_exp = Weakly_Supervising(
-            #    generate_exps, all_node_outputs_mask, buffer_batch, buffer_batch_exp, nums_stack, batch_size, num_start,
-            #    target_length, \
-            #    fix_input_length, fix_target_list, fix_index, fix_target_length, fix_found, \
-            #    supervising_mode, Lang, seq_length, num_ans, n_step)
+
+        for s_idx, (target_length, items, job) in enumerate(searches):
+            # a problem fixed at a shorter length is not searched at longer lengths
+            for t_idx, fix in job.as_completed():
+                if fix:
+                    idx = items[t_idx][0]
+                    for _, later_items, later_job in searches[s_idx + 1:]:
+                        later_job.cancel([l_idx for l_idx, item in enumerate(later_items) if item[0] == idx])
+            fixes = job.result()
+            buffer_batch_new = buffer_batch.copy()
+            buffer_batch_new_exp = buffer_batch_exp.copy()
+            for (idx, exp, num, generate_exp, all_list, probs), fix in zip(items, fixes):
+                if fix is None or fix_found[idx] == True:
+                    continue
+                fix_input_length, fix_target_list, \
+                fix_index, fix_target_length, \
+                fix_found, buffer_batch_new, buffer_batch_new_exp = strategy(idx, exp, num, generate_exp, target_length, num_ans, all_list,
+                                                        probs, num_start, n_step, fix_input_length,
+                                                        fix_target_list, fix_index, fix_target_length, fix_found,
+                                                        buffer_batch_new, buffer_batch_new_exp,
+                                                        seq_length, Lang, fix=fix)
         return fix_input_length, fix_target_list, fix_index, fix_target_length, buffer_batch_new, buffer_batch_new_exp
 
+    def weak_search_items(self, generate_exps, all_node_outputs_mask, nums_stack, target_length, num_start, generate_size, fix_found, Lang):
+        r"""predictions of problems not fixed yet, as (idx, exp, num, generate_exp, all_list, probs).
+        """
+        all_node_outputs_mask = all_node_outputs_mask.detach().cpu().numpy()
+        items = []
+        for idx, exp, num in zip(range(len(nums_stack)), generate_exps, nums_stack):
+            if fix_found[idx] == True:
+                continue
+            generate_exp = out_expression_list(exp, Lang, num)
+            all_list = Lang.dataset.out_idx2symbol[:num_start + generate_size] + num
+            probs = all_node_outputs_mask[idx][:target_length[idx], :num_start + generate_size + len(num)]
+            items.append((idx, exp, num, generate_exp, all_list, probs))
+        return items
+
     def generate_weak_tree_input(self, target, decoder_output, num_start):
         target_input = copy.deepcopy(target)
         for i in range(len(target)):
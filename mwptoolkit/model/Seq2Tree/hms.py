@@ -6,6 +6,7 @@ from mwptoolkit.module.Encoder.rnn_encoder import HWCPEncoder
 from mwptoolkit.module.Decoder.tree_decoder import HMSDecoder
 from mwptoolkit.loss.nll_loss import NLLLoss
 from mwptoolkit.utils.enum_type import SpecialTokens,NumMask
+from mwptoolkit.utils.mixed_precision import backward
 
 class HMS(nn.Module):
     def __init__(self,config,dataset):
@@ -121,7 +122,7 @@ class HMS(nn.Module):
         
         total_target_length = (target_variable != self.out_pad_token).sum().item()
         loss = loss / total_target_length
-        loss.backward()
+        backward(loss)
         return loss.item()
 
     def model_test(self,batch_data):
@@ -6,10 +6,10 @@ from torch import nn
 from mwptoolkit.module.Embedder.basic_embedder import BaiscEmbedder
 from mwptoolkit.module.Decoder.tree_decoder import LSTMBasedTreeDecoder
 from mwptoolkit.module.Layer.tree_layers import NodeEmbeddingLayer, TreeNode, TreeEmbedding
-from mwptoolkit.module.Strategy.beam_search import TreeBeam
+from mwptoolkit.module.Strategy.beam_search import TreeBeam, copy_stack, copy_stacks
 from mwptoolkit.loss.masked_cross_entropy_loss import MaskedCrossEntropyLoss
 from mwptoolkit.utils.enum_type import SpecialTokens,NumMask
-from mwptoolkit.utils.utils import copy_list
+from mwptoolkit.utils.utils import copy_list, sequence_mask, gather_number_outputs
 
 class TreeLSTM(nn.Module):
     def __init__(self, config,dataset):
@@ -65,20 +65,10 @@ class TreeLSTM(nn.Module):
                 num_start, target=None, target_length=None, max_length=30, beam_size=5, UNK_TOKEN=None):
         # sequence mask for attention
         beam_size = self.beam_size
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.embedding_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.embedding_size, device=self.device)
         seq_emb = self.embedder(seq)
         #print('seq_emb', seq_emb.size())
         pade_outputs, initial_hidden = self.encoder(seq_emb)
@@ -113,20 +103,10 @@ class TreeLSTM(nn.Module):
 
 
         # sequence mask for attention
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.embedding_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.embedding_size, device=self.device)
         seq_emb = self.embedder(seq)
         #print('seq_emb', seq_emb.size())
         pade_outputs, initial_hidden = self.encoder(seq_emb)
@@ -158,20 +138,10 @@ class TreeLSTM(nn.Module):
         # sequence mask for attention
         beam_size = self.beam_size
         max_length = self.max_out_len
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.embedding_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.embedding_size, device=self.device)
         seq_emb = self.embedder(seq)
         #print('seq_emb', seq_emb.size())
         pade_outputs, initial_hidden = self.encoder(seq_emb)
@@ -329,7 +299,7 @@ class TreeLSTM(nn.Module):
         tree_hidden = (initial_hidden[0][:self.num_layers].transpose(1, 0).contiguous().view(batch_size, -1), initial_hidden[1][:self.num_layers].transpose(1, 0).contiguous().view(batch_size, -1))
 
         beams = [
-            ([hidden[0]], [self.root], [self.root], nodes, nodes_hiddens, hidden, tree_hidden, TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, []))
+            ([hidden[0]], [self.root], [self.root], copy_stacks(nodes), copy_stacks(nodes_hiddens), hidden, tree_hidden, TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, []))
         ]
         for t in range(max_length):
             current_beams = []
@@ -356,12 +326,12 @@ class TreeLSTM(nn.Module):
 
                 for tv, ti in zip(topv.split(1, dim=1), topi.split(1, dim=1)):
                     left, parent, prev = [], [], []
-                    current_node_stack = self.copy_list(b.node_stack)
+                    current_node_stack = copy_stacks(b.node_stack)
                     current_left_childs = []
-                    current_embeddings_stacks = self.copy_list(b.embedding_stack)
-                    current_nodes = copy.deepcopy(nodes)
-                    current_nodes_hidden = self.copy_list(nodes_hiddens)
-                    current_out = copy.deepcopy(b.out)
+                    current_embeddings_stacks = copy_stacks(b.embedding_stack)
+                    current_nodes = copy_stacks(nodes)
+                    current_nodes_hidden = copy_stacks(nodes_hiddens)
+                    current_out = copy_stack(b.out)
 
                     out_token = int(ti)
                     current_out.append(out_token)
@@ -422,9 +392,9 @@ class TreeLSTM(nn.Module):
                     else:
                         left.append(current_nums_embeddings[0, current_nodes[0][-1] - num_start].unsqueeze(0))
                         prev.append(current_nums_embeddings[0, current_nodes[0][-1] - num_start].unsqueeze(0))
-                        for i in range(len(current_nodes[0])-1, -1, -1):
-                            if current_nodes[0][i] < num_start:
-                                parent.append(current_nodes_hidden[0][i]);
+                        for node, node_hidden in zip(reversed(current_nodes[0]), reversed(current_nodes_hidden[0])):
+                            if node < num_start:
+                                parent.append(node_hidden);
                                 parent_flag = False; break
                         if parent_flag: parent.append(hidden[0])
                         #parent = parent[:1]
@@ -446,34 +416,11 @@ class TreeLSTM(nn.Module):
                 break
         # print('beams[0][4].out', beams[0][4].out)
         # exit()
-        return beams[0][7].out
+        return list(beams[0][7].out)
 
     def get_all_number_encoder_outputs(self, encoder_outputs, num_pos, num_size, hidden_size):
-        indices = list()
-        sen_len = encoder_outputs.size(1)
-        batch_size = encoder_outputs.size(0)
-        masked_index = []
-        temp_1 = [1 for _ in range(hidden_size)]
-        temp_0 = [0 for _ in range(hidden_size)]
-        for b in range(batch_size):
-            for i in num_pos[b]:
-                if i == -1:
-                    indices.append(0)
-                    masked_index.append(temp_1)
-                    continue
-                indices.append(i + b * sen_len)
-                masked_index.append(temp_0)
-            indices += [0 for _ in range(len(num_pos[b]), num_size)]
-            masked_index += [temp_1 for _ in range(len(num_pos[b]), num_size)]
-        indices = torch.LongTensor(indices).to(self.device)
-        masked_index = torch.BoolTensor(masked_index).to(self.device)
-
-        masked_index = masked_index.view(batch_size, num_size, hidden_size)
-        all_outputs = encoder_outputs.contiguous()
-        all_embedding = all_outputs.view(-1, encoder_outputs.size(2))  # S x B x H -> (B x S) x H
-        all_num = all_embedding.index_select(0, indices)
-        all_num = all_num.view(batch_size, num_size, hidden_size)
-        return all_num.masked_fill_(masked_index, 0.0)
+        all_num, _ = gather_number_outputs(encoder_outputs, num_pos, num_size)
+        return all_num
 
     def generate_tree_input(self, target, decoder_output, nums_stack_batch, num_start, unk):
         target_input = copy.deepcopy(target)
@@ -6,10 +6,11 @@ from mwptoolkit.module.Encoder.rnn_encoder import BasicRNNEncoder
 from mwptoolkit.module.Embedder.basic_embedder import BaiscEmbedder
 from mwptoolkit.module.Decoder.tree_decoder import TreeDecoder
 from mwptoolkit.module.Layer.tree_layers import *
-from mwptoolkit.module.Strategy.beam_search import TreeBeam
+from mwptoolkit.module.Strategy.beam_search import TreeBeamSearch
 from mwptoolkit.loss.masked_cross_entropy_loss import MaskedCrossEntropyLoss,masked_cross_entropy
 from mwptoolkit.utils.enum_type import NumMask, SpecialTokens
-from mwptoolkit.utils.utils import copy_list
+from mwptoolkit.utils.utils import copy_list, sequence_mask, gather_number_outputs
+from mwptoolkit.utils.mixed_precision import backward
 
 class TSN(nn.Module):
     def __init__(self,config,dataset):
@@ -81,20 +82,10 @@ class TSN(nn.Module):
         num_start = self.num_start
         # sequence mask for attention
         beam_size = self.beam_size
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.t_embedder(seq)
         pade_outputs, _ = self.t_encoder(seq_emb, seq_length)
@@ -125,20 +116,10 @@ class TSN(nn.Module):
         num_start = self.num_start
         # sequence mask for attention
         beam_size = self.beam_size
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.s_embedder(seq)
         pade_outputs, _ = self.s_encoder(seq_emb, seq_length)
@@ -165,7 +146,7 @@ class TSN(nn.Module):
         loss4 = self.soft_target_loss(all_node_output2,soft_target,target_length)
         cos_loss = self.cosine_loss(all_node_output1,all_node_output2,target_length)
         loss = (1-self.alpha)*loss1 + self.alpha*loss2 + (1-self.alpha)*loss3 + self.alpha*loss4 + 0.1*cos_loss
-        loss.backward()
+        backward(loss)
         return loss.item()
 
     def teacher_test(self,batch_data):
@@ -183,20 +164,10 @@ class TSN(nn.Module):
         # sequence mask for attention
         beam_size = self.beam_size
         max_length = self.max_out_len
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.t_embedder(seq)
         pade_outputs, _ = self.t_encoder(seq_emb, seq_length)
@@ -206,8 +177,11 @@ class TSN(nn.Module):
         #print("problem_output", problem_output.size())
 
         all_node_outputs = self.teacher_test_forward(encoder_outputs, problem_output, padding_hidden, seq_mask, num_mask, num_pos, num_start, beam_size, max_length)
-        all_outputs = self.convert_idx2symbol(all_node_outputs, num_list[0], copy_list(nums_stack[0]))
-        targets = self.convert_idx2symbol(target[0], num_list[0], copy_list(nums_stack[0]))
+        all_outputs = []
+        targets = []
+        for b in range(batch_size):
+            all_outputs += self.convert_idx2symbol(all_node_outputs[b], num_list[b], copy_list(nums_stack[b]))
+            targets += self.convert_idx2symbol(target[b], num_list[b], copy_list(nums_stack[b]))
 
         return all_outputs, targets
     
@@ -224,20 +198,10 @@ class TSN(nn.Module):
         # sequence mask for attention
         beam_size = self.beam_size
         max_length = self.max_out_len
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.s_embedder(seq)
         pade_outputs, _ = self.s_encoder(seq_emb, seq_length)
@@ -246,9 +210,13 @@ class TSN(nn.Module):
 
         all_node_output1,score1 = self.student1_test_forward(encoder_outputs, problem_output, padding_hidden, seq_mask, num_mask, num_pos, num_start, beam_size, max_length)
         all_node_output2,score2 = self.student2_test_forward(encoder_outputs, problem_output, padding_hidden, seq_mask, num_mask, num_pos, num_start, beam_size, max_length)
-        all_output1 = self.convert_idx2symbol(all_node_output1, num_list[0], copy_list(nums_stack[0]))
-        all_output2 = self.convert_idx2symbol(all_node_output2, num_list[0], copy_list(nums_stack[0]))
-        targets = self.convert_idx2symbol(target[0], num_list[0], copy_list(nums_stack[0]))
+        all_output1 = []
+        all_output2 = []
+        targets = []
+        for b in range(batch_size):
+            all_output1 += self.convert_idx2symbol(all_node_output1[b], num_list[b], copy_list(nums_stack[b]))
+            all_output2 += self.convert_idx2symbol(all_node_output2[b], num_list[b], copy_list(nums_stack[b]))
+            targets += self.convert_idx2symbol(target[b], num_list[b], copy_list(nums_stack[b]))
 
         return all_output1,score1,all_output2,score2,targets
 
@@ -428,251 +396,34 @@ class TSN(nn.Module):
 
     def teacher_test_forward(self,encoder_outputs,problem_output,padding_hidden,seq_mask,num_mask,num_pos,\
                         num_start,beam_size,max_length):
-        batch_size = encoder_outputs.size(0)
-        # Prepare input and output variables
-        node_stacks = [[TreeNode(_)] for _ in problem_output.split(1, dim=0)]
-
-        num_size = len(num_pos[0])
+        num_size = max([len(_) for _ in num_pos])
         all_nums_encoder_outputs = self.get_all_number_encoder_outputs(encoder_outputs, num_pos, num_size, self.t_encoder.hidden_size)
 
-        embeddings_stacks = [[] for _ in range(batch_size)]
-        left_childs = [None for _ in range(batch_size)]
-        beams = [TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, [])]
-        for t in range(max_length):
-            current_beams = []
-            while len(beams) > 0:
-                b = beams.pop()
-                if len(b.node_stack[0]) == 0:
-                    current_beams.append(b)
-                    continue
-                # left_childs = torch.stack(b.left_childs)
-                left_childs = b.left_childs
-
-                num_score, op, current_embeddings, current_context, current_nums_embeddings = self.t_decoder(b.node_stack, left_childs, encoder_outputs, all_nums_encoder_outputs, padding_hidden,
-                                                                                                           seq_mask, num_mask)
-
-                out_score = nn.functional.log_softmax(torch.cat((op, num_score), dim=1), dim=1)
-
-                # out_score = p_leaf * out_score
-
-                topv, topi = out_score.topk(beam_size)
-
-                for tv, ti in zip(topv.split(1, dim=1), topi.split(1, dim=1)):
-                    current_node_stack = copy_list(b.node_stack)
-                    current_left_childs = []
-                    current_embeddings_stacks = copy_list(b.embedding_stack)
-                    current_out = copy.deepcopy(b.out)
-
-                    out_token = int(ti)
-                    current_out.append(out_token)
-
-                    node = current_node_stack[0].pop()
-
-                    if out_token < num_start:
-                        generate_input = torch.LongTensor([out_token]).to(self.device)
-
-                        left_child, right_child, node_label = self.t_node_generater(current_embeddings, generate_input, current_context)
-
-                        current_node_stack[0].append(TreeNode(right_child))
-                        current_node_stack[0].append(TreeNode(left_child, left_flag=True))
-
-                        current_embeddings_stacks[0].append(TreeEmbedding(node_label[0].unsqueeze(0), False))
-                    else:
-                        current_num = current_nums_embeddings[0, out_token - num_start].unsqueeze(0)
-
-                        while len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                            sub_stree = current_embeddings_stacks[0].pop()
-                            op = current_embeddings_stacks[0].pop()
-                            current_num = self.t_merge(op.embedding, sub_stree.embedding, current_num)
-                        current_embeddings_stacks[0].append(TreeEmbedding(current_num, True))
-                    if len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                        current_left_childs.append(current_embeddings_stacks[0][-1].embedding)
-                    else:
-                        current_left_childs.append(None)
-                    current_beams.append(TreeBeam(b.score + float(tv), current_node_stack, current_embeddings_stacks, current_left_childs, current_out))
-            beams = sorted(current_beams, key=lambda x: x.score, reverse=True)
-            beams = beams[:beam_size]
-            flag = True
-            for b in beams:
-                if len(b.node_stack[0]) != 0:
-                    flag = False
-            if flag:
-                break
-        return beams[0].out
-    
+        beam_search = TreeBeamSearch(self.t_decoder, self.t_node_generater, self.t_merge, num_start, beam_size, max_length)
+        all_node_outputs, scores = beam_search.search(encoder_outputs, problem_output, all_nums_encoder_outputs, padding_hidden, seq_mask, num_mask)
+        return all_node_outputs
+
     def student1_test_forward(self,encoder_outputs,problem_output,padding_hidden,seq_mask,num_mask,num_pos,\
                         num_start,beam_size,max_length):
-        batch_size = encoder_outputs.size(0)
-        # Prepare input and output variables
-        node_stacks = [[TreeNode(_)] for _ in problem_output.split(1, dim=0)]
-
-        num_size = len(num_pos[0])
+        num_size = max([len(_) for _ in num_pos])
         all_nums_encoder_outputs = self.get_all_number_encoder_outputs(encoder_outputs, num_pos, num_size, self.s_encoder.hidden_size)
 
-        embeddings_stacks = [[] for _ in range(batch_size)]
-        left_childs = [None for _ in range(batch_size)]
-        beams = [TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, [])]
-        for t in range(max_length):
-            current_beams = []
-            while len(beams) > 0:
-                b = beams.pop()
-                if len(b.node_stack[0]) == 0:
-                    current_beams.append(b)
-                    continue
-                # left_childs = torch.stack(b.left_childs)
-                left_childs = b.left_childs
-
-                num_score, op, current_embeddings, current_context, current_nums_embeddings = self.s_decoder_1(b.node_stack, left_childs, encoder_outputs, all_nums_encoder_outputs, padding_hidden,
-                                                                                                           seq_mask, num_mask)
-
-                out_score = nn.functional.log_softmax(torch.cat((op, num_score), dim=1), dim=1)
-
-                # out_score = p_leaf * out_score
-
-                topv, topi = out_score.topk(beam_size)
-
-                for tv, ti in zip(topv.split(1, dim=1), topi.split(1, dim=1)):
-                    current_node_stack = copy_list(b.node_stack)
-                    current_left_childs = []
-                    current_embeddings_stacks = copy_list(b.embedding_stack)
-                    current_out = copy.deepcopy(b.out)
-
-                    out_token = int(ti)
-                    current_out.append(out_token)
-
-                    node = current_node_stack[0].pop()
-
-                    if out_token < num_start:
-                        generate_input = torch.LongTensor([out_token]).to(self.device)
-
-                        left_child, right_child, node_label = self.s_node_generater_1(current_embeddings, generate_input, current_context)
-
-                        current_node_stack[0].append(TreeNode(right_child))
-                        current_node_stack[0].append(TreeNode(left_child, left_flag=True))
-
-                        current_embeddings_stacks[0].append(TreeEmbedding(node_label[0].unsqueeze(0), False))
-                    else:
-                        current_num = current_nums_embeddings[0, out_token - num_start].unsqueeze(0)
-
-                        while len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                            sub_stree = current_embeddings_stacks[0].pop()
-                            op = current_embeddings_stacks[0].pop()
-                            current_num = self.s_merge_1(op.embedding, sub_stree.embedding, current_num)
-                        current_embeddings_stacks[0].append(TreeEmbedding(current_num, True))
-                    if len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                        current_left_childs.append(current_embeddings_stacks[0][-1].embedding)
-                    else:
-                        current_left_childs.append(None)
-                    current_beams.append(TreeBeam(b.score + float(tv), current_node_stack, current_embeddings_stacks, current_left_childs, current_out))
-            beams = sorted(current_beams, key=lambda x: x.score, reverse=True)
-            beams = beams[:beam_size]
-            flag = True
-            for b in beams:
-                if len(b.node_stack[0]) != 0:
-                    flag = False
-            if flag:
-                break
-        return beams[0].out,beams[0].score
+        beam_search = TreeBeamSearch(self.s_decoder_1, self.s_node_generater_1, self.s_merge_1, num_start, beam_size, max_length)
+        all_node_outputs, scores = beam_search.search(encoder_outputs, problem_output, all_nums_encoder_outputs, padding_hidden, seq_mask, num_mask)
+        return all_node_outputs, scores
+
     def student2_test_forward(self,encoder_outputs,problem_output,padding_hidden,seq_mask,num_mask,num_pos,\
                         num_start,beam_size,max_length):
-        batch_size = encoder_outputs.size(0)
-        # Prepare input and output variables
-        node_stacks = [[TreeNode(_)] for _ in problem_output.split(1, dim=0)]
-
-        num_size = len(num_pos[0])
+        num_size = max([len(_) for _ in num_pos])
         all_nums_encoder_outputs = self.get_all_number_encoder_outputs(encoder_outputs, num_pos, num_size, self.s_encoder.hidden_size)
 
-        embeddings_stacks = [[] for _ in range(batch_size)]
-        left_childs = [None for _ in range(batch_size)]
-        beams = [TreeBeam(0.0, node_stacks, embeddings_stacks, left_childs, [])]
-        for t in range(max_length):
-            current_beams = []
-            while len(beams) > 0:
-                b = beams.pop()
-                if len(b.node_stack[0]) == 0:
-                    current_beams.append(b)
-                    continue
-                # left_childs = torch.stack(b.left_childs)
-                left_childs = b.left_childs
-
-                num_score, op, current_embeddings, current_context, current_nums_embeddings = self.s_decoder_2(b.node_stack, left_childs, encoder_outputs, all_nums_encoder_outputs, padding_hidden,
-                                                                                                           seq_mask, num_mask)
-
-                out_score = nn.functional.log_softmax(torch.cat((op, num_score), dim=1), dim=1)
-
-                # out_score = p_leaf * out_score
-
-                topv, topi = out_score.topk(beam_size)
-
-                for tv, ti in zip(topv.split(1, dim=1), topi.split(1, dim=1)):
-                    current_node_stack = copy_list(b.node_stack)
-                    current_left_childs = []
-                    current_embeddings_stacks = copy_list(b.embedding_stack)
-                    current_out = copy.deepcopy(b.out)
-
-                    out_token = int(ti)
-                    current_out.append(out_token)
-
-                    node = current_node_stack[0].pop()
-
-                    if out_token < num_start:
-                        generate_input = torch.LongTensor([out_token]).to(self.device)
-
-                        left_child, right_child, node_label = self.s_node_generater_2(current_embeddings, generate_input, current_context)
-
-                        current_node_stack[0].append(TreeNode(right_child))
-                        current_node_stack[0].append(TreeNode(left_child, left_flag=True))
-
-                        current_embeddings_stacks[0].append(TreeEmbedding(node_label[0].unsqueeze(0), False))
-                    else:
-                        current_num = current_nums_embeddings[0, out_token - num_start].unsqueeze(0)
-
-                        while len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                            sub_stree = current_embeddings_stacks[0].pop()
-                            op = current_embeddings_stacks[0].pop()
-                            current_num = self.s_merge_2(op.embedding, sub_stree.embedding, current_num)
-                        current_embeddings_stacks[0].append(TreeEmbedding(current_num, True))
-                    if len(current_embeddings_stacks[0]) > 0 and current_embeddings_stacks[0][-1].terminal:
-                        current_left_childs.append(current_embeddings_stacks[0][-1].embedding)
-                    else:
-                        current_left_childs.append(None)
-                    current_beams.append(TreeBeam(b.score + float(tv), current_node_stack, current_embeddings_stacks, current_left_childs, current_out))
-            beams = sorted(current_beams, key=lambda x: x.score, reverse=True)
-            beams = beams[:beam_size]
-            flag = True
-            for b in beams:
-                if len(b.node_stack[0]) != 0:
-                    flag = False
-            if flag:
-                break
-        return beams[0].out,beams[0].score
+        beam_search = TreeBeamSearch(self.s_decoder_2, self.s_node_generater_2, self.s_merge_2, num_start, beam_size, max_length)
+        all_node_outputs, scores = beam_search.search(encoder_outputs, problem_output, all_nums_encoder_outputs, padding_hidden, seq_mask, num_mask)
+        return all_node_outputs, scores
 
     def get_all_number_encoder_outputs(self, encoder_outputs, num_pos, num_size, hidden_size):
-        indices = list()
-        sen_len = encoder_outputs.size(1)
-        batch_size = encoder_outputs.size(0)
-        masked_index = []
-        temp_1 = [1 for _ in range(hidden_size)]
-        temp_0 = [0 for _ in range(hidden_size)]
-        for b in range(batch_size):
-            for i in num_pos[b]:
-                if i == -1:
-                    indices.append(0)
-                    masked_index.append(temp_1)
-                    continue
-                indices.append(i + b * sen_len)
-                masked_index.append(temp_0)
-            indices += [0 for _ in range(len(num_pos[b]), num_size)]
-            masked_index += [temp_1 for _ in range(len(num_pos[b]), num_size)]
-        indices = torch.LongTensor(indices).to(self.device)
-        masked_index = torch.BoolTensor(masked_index).to(self.device)
-
-        masked_index = masked_index.view(batch_size, num_size, hidden_size)
-        all_outputs = encoder_outputs.contiguous()
-        all_embedding = all_outputs.view(-1, encoder_outputs.size(2))  # S x B x H -> (B x S) x H
-        all_num = all_embedding.index_select(0, indices)
-        all_num = all_num.view(batch_size, num_size, hidden_size)
-        return all_num.masked_fill_(masked_index, 0.0)
+        all_num, _ = gather_number_outputs(encoder_outputs, num_pos, num_size)
+        return all_num
 
     def generate_tree_input_(self, target, decoder_output, nums_stack_batch, num_start, unk):
         target_input = copy.deepcopy(target)
@@ -702,20 +453,10 @@ class TSN(nn.Module):
         num_start = self.num_start
         # sequence mask for attention
         beam_size = self.beam_size
-        seq_mask = []
-        max_len = max(seq_length)
-        for i in seq_length:
-            seq_mask.append([0 for _ in range(i)] + [1 for _ in range(i, max_len)])
-        seq_mask = torch.BoolTensor(seq_mask).to(self.device)
-
-        num_mask = []
-        max_num_size = max(num_size) + len(generate_nums)
-        for i in num_size:
-            d = i + len(generate_nums)
-            num_mask.append([0] * d + [1] * (max_num_size - d))
-        num_mask = torch.BoolTensor(num_mask).to(self.device)
-
-        padding_hidden = torch.FloatTensor([0.0 for _ in range(self.hidden_size)]).unsqueeze(0).to(self.device)
+        seq_mask = sequence_mask(seq_length, device=self.device)
+        num_mask = sequence_mask(torch.as_tensor(num_size) + len(generate_nums), device=self.device)
+
+        padding_hidden = torch.zeros(1, self.hidden_size, device=self.device)
         batch_size = len(seq_length)
         seq_emb = self.t_embedder(seq)
         pade_outputs, _ = self.t_encoder(seq_emb, seq_length)
@@ -1,5 +1,4 @@
 import math
-import numpy as np
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -94,96 +93,54 @@ from mwptoolkit.utils.utils import clones
 #     return res
 
 def group_mask(batch,type="self",pad=0):
-    length = batch.shape[1]
-    lis = []
+    r"""pairwise group masks from clause ids, built by comparing ids of all token pairs at once.
+
+    Args:
+        batch (torch.Tensor|np.ndarray): clause id of every token, shape [batch_size, seq_length], see `split_to_mask`.
+        type (str): "self" attends to tokens of the same clause, "between" to tokens of the other condition clauses,
+            "question" from condition clauses to the question clause and from the question clause to the others.
+        pad (int): id of padding.
+
+    Returns:
+        torch.BoolTensor: mask, shape [batch_size, seq_length, seq_length].
+    """
+    batch = torch.as_tensor(batch)
+    row = batch.unsqueeze(2)
+    col = batch.unsqueeze(1)
+    valid = row.ne(pad)
     if type=="self":
-        for tok in batch:
-            mask = np.zeros(tok.shape)
-            mask = np.expand_dims(mask,-1)
-            for ele in tok:
-                if ele == pad:copy = np.zeros(length)
-                else:
-                    copy = tok.copy()
-                    if ele != 1000:copy[copy == 1000] = 0
-                    copy[copy != ele] = 0
-                    copy[copy == ele] = 1
-                    #print("self copy",copy)
-                '''
-                if ele == 1000:
-                    copy[copy != ele] = 1
-                    copy[copy == ele] = 0
-                '''
-                copy = np.expand_dims(copy,-1)
-                mask = np.concatenate((mask,copy),axis=1)
-            mask = mask[:,1:]
-            mask = mask.transpose()
-            mask = np.expand_dims(mask,0)
-            lis.append(mask)
-        res = np.concatenate(tuple(lis))
+        res = valid & col.eq(row)
     elif type=="between":
-        for tok in batch:
-            mask = np.zeros(tok.shape)
-            mask = np.expand_dims(mask,-1)
-            for ele in tok:
-                if ele == pad:copy = np.zeros(length)
-                else:
-                    copy = tok.copy()
-                    copy[copy==1000] = 0
-                    copy[copy ==ele] = 0
-                    copy[copy!= 0] = 1
-                    '''
-                    copy[copy != ele and copy != 1000] = 1
-                    copy[copy == ele or copy == 1000] = 0
-                    '''
-                copy = np.expand_dims(copy,-1)
-                mask = np.concatenate((mask,copy),axis=1)
-            mask = mask[:,1:]
-            mask = mask.transpose()
-            mask = np.expand_dims(mask,0)
-            lis.append(mask)
-        res = np.concatenate(tuple(lis))
+        res = valid & col.ne(0) & col.ne(1000) & col.ne(row)
     elif type == "question":
-        for tok in batch:
-            mask = np.zeros(tok.shape)
-            mask = np.expand_dims(mask,-1)
-            for ele in tok:
-                if ele == pad:copy = np.zeros(length)
-                else:
-                    copy = tok.copy()
-                    copy[copy != 1000] = 0
-                    copy[copy == 1000] = 1
-                if ele==1000:
-                	copy[copy==0] = -1
-                	copy[copy==1] = 0
-                	copy[copy==-1] = 1
-                copy = np.expand_dims(copy,-1)
-                mask = np.concatenate((mask,copy),axis=1)
-            mask = mask[:,1:]
-            mask = mask.transpose()
-            mask = np.expand_dims(mask,0)
-            lis.append(mask)
-        res = np.concatenate(tuple(lis))
+        res = valid & (col.eq(1000) ^ row.eq(1000))
     else:return "error"
     return res
 
+def split_to_mask(src, split_list):
+    r"""clause id of every token, clauses are split by tokens in split_list.
+
+    ids count from 1, the last clause (the question) gets 1000 if there are several clauses and padding (0) gets 0.
+
+    Args:
+        src (torch.Tensor): token ids, shape [batch_size, seq_length].
+        split_list (list): ids of split tokens.
+
+    Returns:
+        torch.LongTensor: clause ids, shape [batch_size, seq_length], on the device of src.
+    """
+    is_split = torch.zeros_like(src, dtype=torch.bool)
+    for idx in split_list:
+        is_split |= src.eq(idx)
+    is_split[:, -1] = False
+    is_split = is_split.long()
+    mask = 1 + torch.cumsum(is_split, dim=1) - is_split
+    token = 1 + is_split.sum(dim=1, keepdim=True)
+    mask = mask.masked_fill(mask.eq(token) & token.ne(1), 1000)
+    return mask.masked_fill(src.eq(0), 0)
+
 def src_to_mask(src, vocab_dict):
-    src = src.cpu().numpy()
-    batch_data_mask_tok = []
-    for encode_sen_idx in src:
-
-        token = 1
-        mask = [0] * len(encode_sen_idx)
-        for num in range(len(encode_sen_idx)):
-            mask[num] = token
-            if (encode_sen_idx[num] == vocab_dict["．"] or encode_sen_idx[num] == vocab_dict["，"]) \
-                    and num != len(encode_sen_idx) - 1:
-                token += 1
-            if encode_sen_idx[num]==0: mask[num] = 0
-        for num in range(len(encode_sen_idx)):
-            if mask[num] == token and token != 1:
-                mask[num] = 1000
-        batch_data_mask_tok.append(mask)
-    return np.array(batch_data_mask_tok)
+    return split_to_mask(src, [vocab_dict["．"], vocab_dict["，"]])
 
 def attention(query, key, value, mask=None, dropout=None):
     "Compute 'Scaled Dot Product Attention'"
@@ -212,15 +169,14 @@ class GroupAttention(nn.Module):
         #self.split_list=split_list
 
     def get_mask(self, src, split_list, pad=0):
-        device = src.device
         mask = self.src_to_mask(src, split_list)
-        self.src_mask_self = torch.from_numpy(group_mask(mask,"self",pad).astype('uint8')).unsqueeze(1)
-        self.src_mask_between = torch.from_numpy(group_mask(mask,"between",pad).astype('uint8')).unsqueeze(1)
-        self.src_mask_question = torch.from_numpy(group_mask(mask, "question", pad).astype('uint8')).unsqueeze(1)
+        self.src_mask_self = group_mask(mask,"self",pad).unsqueeze(1)
+        self.src_mask_between = group_mask(mask,"between",pad).unsqueeze(1)
+        self.src_mask_question = group_mask(mask, "question", pad).unsqueeze(1)
         self.src_mask_global = (src != pad).unsqueeze(-2).unsqueeze(1)
         self.src_mask_global = self.src_mask_global.expand(self.src_mask_self.shape)
-        self.final = torch.cat((self.src_mask_between.to(device).bool(),self.src_mask_self.to(device).bool(),self.src_mask_global.to(device),self.src_mask_question.to(device).bool()),1)
-        return self.final.to(device)
+        self.final = torch.cat((self.src_mask_between,self.src_mask_self,self.src_mask_global,self.src_mask_question),1)
+        return self.final
 
     def forward(self, query, key, value, mask=None):
         #print("query",query,"\nkey",key,"\nvalue",value)
@@ -251,22 +207,7 @@ class GroupAttention(nn.Module):
         return self.linears[-1](x)
     
     def src_to_mask(self, src, split_list):
-        src = src.cpu().numpy()
-        batch_data_mask_tok = []
-        for encode_sen_idx in src:
-
-            token = 1
-            mask = [0] * len(encode_sen_idx)
-            for num in range(len(encode_sen_idx)):
-                mask[num] = token
-                if encode_sen_idx[num] in split_list and num != len(encode_sen_idx) - 1:
-                    token += 1
-                if encode_sen_idx[num]==0: mask[num] = 0
-            for num in range(len(encode_sen_idx)):
-                if mask[num] == token and token != 1:
-                    mask[num] = 1000
-            batch_data_mask_tok.append(mask)
-        return np.array(batch_data_mask_tok)
+        return split_to_mask(src, split_list)
 
 
 
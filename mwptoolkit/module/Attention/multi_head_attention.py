@@ -46,7 +46,7 @@ class MultiHeadAttention(nn.Module):
     #     nn.init.constant_(self.value_proj.bias, 0.)
     #     nn.init.constant_(self.out_proj.bias, 0.)
 
-    def forward(self, query, key, value, key_padding_mask=None, attn_mask=None):
+    def forward(self, query, key, value, key_padding_mask=None, attn_mask=None, cache=None, static_kv=False):
         r"""
         Multi-head attention
 
@@ -55,6 +55,10 @@ class MultiHeadAttention(nn.Module):
             key and value: shape: [batch_size, src_len, embedding_size]
             key_padding_mask: shape: [batch_size, src_len]
             attn_mask: shape: [batch_size, tgt_len, src_len]
+            cache (dict|None): projected key and value of former decoding steps, updated in place.
+            static_kv (bool): key and value are the same at every step (e.g. encoder outputs),
+                they are projected only once and reused from cache if True,
+                otherwise projections of new key and value are appended to cache.
 
         Return:
             tuple:
@@ -63,12 +67,20 @@ class MultiHeadAttention(nn.Module):
         """
         device=query.device
         batch_size, tgt_len, embedding_size = query.size()
-        src_len = key.size(1)
         assert key.size() == value.size()
 
         q = self.linear_query(query) * self.scaling
-        k = self.linear_key(key)
-        v = self.linear_value(value)
+        if cache is not None and static_kv and "key" in cache:
+            k, v = cache["key"], cache["value"]
+        else:
+            k = self.linear_key(key)
+            v = self.linear_value(value)
+            if cache is not None and not static_kv and "key" in cache:
+                k = torch.cat([cache["key"], k], dim=1)
+                v = torch.cat([cache["value"], v], dim=1)
+        if cache is not None:
+            cache["key"], cache["value"] = k, v
+        src_len = k.size(1)
 
         q = q.view(batch_size, tgt_len, self.num_heads, self.head_size).permute(0, 2, 1, 3)
         k = k.view(batch_size, src_len, self.num_heads, self.head_size).permute(0, 2, 3, 1)
@@ -25,9 +25,17 @@ class TransformerDecoder(nn.Module):
                 TransformerLayer(embedding_size, ffn_size, num_heads, attn_dropout_ratio, attn_weight_dropout_ratio,
                                  ffn_dropout_ratio, with_external))
 
+    def init_cache(self):
+        r"""empty key/value cache of every layer for incremental decoding.
+
+        Returns:
+            list: one dict per layer, filled and updated by forward.
+        """
+        return [{} for _ in self.transformer_layers]
+
     def forward(self, x, kv=None,
                 self_padding_mask=None, self_attn_mask=None,
-                external_states=None, external_padding_mask=None):
+                external_states=None, external_padding_mask=None, cache=None):
         r""" Implement the decoding process step by step.
 
         Args:
@@ -37,10 +45,12 @@ class TransformerDecoder(nn.Module):
             self_attn_mask (Torch.Tensor): diagonal attention mask matrix of target sequence, shape: [batch_size, sequence_length, sequence_length], default: None.
             external_states (Torch.Tensor): output features of encoder, shape: [batch_size, sequence_length, feature_size], default: None.
             external_padding_mask (Torch.Tensor): padding mask of source sequence, shape: [batch_size, sequence_length], default: None.
+            cache (list|None): key/value cache from init_cache, x is only the new tokens of the current step if given, default: None.
 
         Returns:
             Torch.Tensor: output features, shape: [batch_size, sequence_length, ffn_size].
         """
         for idx, layer in enumerate(self.transformer_layers):
-            x, _, _ = layer(x, kv, self_padding_mask, self_attn_mask, external_states, external_padding_mask)
+            layer_cache = cache[idx] if cache is not None else None
+            x, _, _ = layer(x, kv, self_padding_mask, self_attn_mask, external_states, external_padding_mask, layer_cache)
         return x
\ No newline at end of file
@@ -497,7 +497,7 @@ class HMSDecoder(nn.Module):
             if all_finished:
                 break
         output = beams[0]
-        return output.decoder_outputs_list, output.nodes_hidden, output.sequence_symbols_list
+        return list(output.decoder_outputs_list), output.nodes_hidden, list(output.sequence_symbols_list)
 
     def forward(self, targets=None, encoder_hidden=None, encoder_outputs=None, input_lengths=None, span_length=None, num_pos=None, max_length=None, beam_width=None):
         masks = self.get_pad_masks(encoder_outputs, input_lengths, span_length)
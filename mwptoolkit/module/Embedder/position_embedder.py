@@ -21,15 +21,16 @@ class PositionEmbedder_x(nn.Module):
         pe = pe.unsqueeze(0).transpose(0, 1)
         self.register_buffer('pe', pe)
         
-    def forward(self, input_embedding):
+    def forward(self, input_embedding, offset=0):
         '''
         Args:
             input_embedding: torch.Tensor, [batch_size, seq_length, embedding_size].
+            offset: int, position of the first token, used in incremental decoding.
         '''
         # 词经过嵌入层后，再加上位置信息
         seq_len=input_embedding.size(1)
         #outputs=input_embedding+self.weight[:batch_size,:]
-        outputs=input_embedding+self.pe.squeeze()[:seq_len]
+        outputs=input_embedding+self.pe.squeeze(1)[offset:offset+seq_len]
         #outputs=self.dropout(outputs)
         return outputs
 
@@ -5,7 +5,7 @@ from torch.nn import functional as F
 
 from transformers.modeling_bert import gelu_new as gelu_bert
 
-from mwptoolkit.module.Attention.multi_head_attention import EPTMultiHeadAttention
+from mwptoolkit.module.Attention.multi_head_attention import MultiHeadAttention, EPTMultiHeadAttention
 from mwptoolkit.module.Attention.group_attention import GroupAttention
 from mwptoolkit.utils.utils import clones
 
@@ -21,13 +21,14 @@ class TransformerLayer(nn.Module):
         self_attn_mask (torch.bool): the attention mask for the multi head attention sublayer.
         external_states (torch.Tensor): the external context for decoder, e.g., hidden states from encoder.
         external_padding_mask (torch.bool): the padding mask for the external states.
+        layer_cache (dict|None): cached keys and values of self-attention and external attention for incremental decoding.
 
     Returns:
         feedforward_output (torch.Tensor): the output of the point-wise feed-forward sublayer, is the output of the transformer layer
     """
     def __init__(self, embedding_size, ffn_size, num_heads, attn_dropout_ratio=0.0, attn_weight_dropout_ratio=0.0, ffn_dropout_ratio=0.0, with_external=False):
         super(TransformerLayer, self).__init__()
-        self.multi_head_attention = EPTMultiHeadAttention(embedding_size, num_heads, attn_weight_dropout_ratio)
+        self.multi_head_attention = MultiHeadAttention(embedding_size, num_heads, attn_weight_dropout_ratio)
         self.feed_forward_1 = nn.Linear(embedding_size, ffn_size)
         self.feed_forward_2 = nn.Linear(ffn_size, embedding_size)
 
@@ -40,7 +41,7 @@ class TransformerLayer(nn.Module):
         self.with_external = with_external
 
         if self.with_external:
-            self.external_multi_head_attention = EPTMultiHeadAttention(embedding_size, num_heads, attn_weight_dropout_ratio)
+            self.external_multi_head_attention = MultiHeadAttention(embedding_size, num_heads, attn_weight_dropout_ratio)
             self.external_layer_norm = nn.LayerNorm(embedding_size)
 
         self.reset_parameters()
@@ -54,18 +55,24 @@ class TransformerLayer(nn.Module):
     def gelu(self, x):
         return x * 0.5 * (1.0 + torch.erf(x / math.sqrt(2.0)))
 
-    def forward(self, x, kv=None, self_padding_mask=None, self_attn_mask=None, external_states=None, external_padding_mask=None):
+    def forward(self, x, kv=None, self_padding_mask=None, self_attn_mask=None, external_states=None, external_padding_mask=None, layer_cache=None):
+        if layer_cache is not None:
+            self_cache = layer_cache.setdefault("self", {})
+            external_cache = layer_cache.setdefault("external", {})
+        else:
+            self_cache = None
+            external_cache = None
         residual = x
         if kv is None:
-            x, self_attn_weights = self.multi_head_attention(query=x, key=x, value=x, key_padding_mask=self_padding_mask, attn_mask=self_attn_mask)
+            x, self_attn_weights = self.multi_head_attention(query=x, key=x, value=x, key_padding_mask=self_padding_mask, attn_mask=self_attn_mask, cache=self_cache)
         else:
-            x, self_attn_weights = self.multi_head_attention(query=x, key=kv, value=kv, key_padding_mask=self_padding_mask, attn_mask=self_attn_mask)
+            x, self_attn_weights = self.multi_head_attention(query=x, key=kv, value=kv, key_padding_mask=self_padding_mask, attn_mask=self_attn_mask, cache=self_cache)
         x = self.attn_dropout(x)
         x = self.attn_layer_norm(residual + x)
 
         if self.with_external:
             residual = x
-            x, external_attn_weights = self.external_multi_head_attention(query=x, key=external_states, value=external_states, key_padding_mask=external_padding_mask)
+            x, external_attn_weights = self.external_multi_head_attention(query=x, key=external_states, value=external_states, key_padding_mask=external_padding_mask, cache=external_cache, static_kv=True)
             x = self.attn_dropout(x)
             x = self.external_layer_norm(residual + x)
         else:
@@ -1,6 +1,8 @@
 import copy
 import torch
 from torch.nn import functional as F
+from mwptoolkit.module.Layer.tree_layers import TreeNode
+from mwptoolkit.utils.data_structure import PersistentStack
 from mwptoolkit.utils.utils import copy_list
 
 class Beam:  # the class save the beam node
@@ -11,33 +13,228 @@ class Beam:  # the class save the beam node
         self.all_output = all_output
         
 class TreeBeam:  # the class save the beam node
+    r"""beam of tree decoding, stacks and output are persistent stacks, so a beam forks in O(1).
+
+    the beam owns stacks passed in, callers fork stacks of the parent beam before modifying them.
+    """
     def __init__(self, score, node_stack, embedding_stack, left_childs, out):
         self.score = score
-        self.embedding_stack = copy_list(embedding_stack)
-        self.node_stack = copy_list(node_stack)
+        self.embedding_stack = own_stacks(embedding_stack)
+        self.node_stack = own_stacks(node_stack)
         self.left_childs = copy_list(left_childs)
-        self.out = copy.deepcopy(out)
+        self.out = own_stack(out)
+
+
 class BeamNode:
     def __init__(self, score, nodes_hidden, node_stacks, tree_stacks, decoder_outputs_list, sequence_symbols_list):
         self.score = score
         self.nodes_hidden = nodes_hidden
-        self.node_stacks = node_stacks
-        self.tree_stacks = tree_stacks
-        self.decoder_outputs_list = decoder_outputs_list
-        self.sequence_symbols_list = sequence_symbols_list
+        self.node_stacks = copy_stacks(node_stacks)
+        self.tree_stacks = copy_stacks(tree_stacks)
+        self.decoder_outputs_list = copy_stack(decoder_outputs_list)
+        self.sequence_symbols_list = copy_stack(sequence_symbols_list)
         return
     
     def copy(self):
         node = BeamNode(
             self.score,
             self.nodes_hidden,
-            copy_list(self.node_stacks),
-            copy_list(self.tree_stacks),
-            copy_list(self.decoder_outputs_list),
-            copy_list(self.sequence_symbols_list)
+            self.node_stacks,
+            self.tree_stacks,
+            self.decoder_outputs_list,
+            self.sequence_symbols_list
         )
         return node
 
+
+def copy_stack(stack):
+    r"""O(1) copy of a stack, a list is converted to persistent stack first.
+    """
+    if isinstance(stack, PersistentStack):
+        return stack.copy()
+    return PersistentStack(stack)
+
+
+def copy_stacks(stacks):
+    r"""O(1) copy of every stack in a batch of stacks.
+    """
+    return [copy_stack(stack) for stack in stacks]
+
+
+def own_stack(stack):
+    r"""the stack itself if it is a persistent stack, a list is converted to persistent stack.
+    """
+    if isinstance(stack, PersistentStack):
+        return stack
+    return PersistentStack(stack)
+
+
+def own_stacks(stacks):
+    return [own_stack(stack) for stack in stacks]
+
+class TreeBeamSearch(object):
+    r"""batched beam search of GTS-family tree decoders.
+
+    All beams of all problems in a batch are decoded together as rows of one batch. Node stacks and
+    subtree embedding stacks are tensors with a stack pointer per row, at every step they are reordered
+    by the index of parent beam instead of being copied beam by beam. Output tokens are saved as
+    (token, parent beam) of every step and traced back at the end.
+
+    Args:
+        decoder (torch.nn.Module): tree decoder, e.g. TreeDecoder.
+        node_generater (torch.nn.Module): generate left child, right child and label of an operator node.
+        merge (torch.nn.Module): merge an operator and two subtrees into a subtree.
+        num_start (int): index of the first number symbol in output vocabulary.
+        beam_size (int): beam size.
+        max_length (int): max length of output.
+    """
+    def __init__(self, decoder, node_generater, merge, num_start, beam_size, max_length):
+        super().__init__()
+        self.decoder = decoder
+        self.node_generater = node_generater
+        self.merge = merge
+        self.num_start = num_start
+        self.beam_size = beam_size
+        self.max_length = max_length
+
+    @torch.no_grad()
+    def search(self, encoder_outputs, problem_output, all_nums_encoder_outputs, padding_hidden, seq_mask, num_mask):
+        r"""decode a batch of problems.
+
+        Args:
+            encoder_outputs (torch.Tensor): shape [batch_size, sequence_length, hidden_size].
+            problem_output (torch.Tensor): shape [batch_size, hidden_size].
+            all_nums_encoder_outputs (torch.Tensor): shape [batch_size, num_size, hidden_size].
+            padding_hidden (torch.Tensor): shape [1, hidden_size].
+            seq_mask (torch.Tensor): bool, shape [batch_size, sequence_length].
+            num_mask (torch.Tensor): bool, shape [batch_size, generate_size + num_size].
+
+        Returns:
+            tuple(list, list): token list and score of the best beam of every problem.
+        """
+        batch_size = encoder_outputs.size(0)
+        beam_size = self.beam_size
+        num_rows = batch_size * beam_size
+        max_depth = self.max_length + 1
+        device = encoder_outputs.device
+
+        encoder_outputs = encoder_outputs.repeat_interleave(beam_size, dim=0)
+        all_nums_encoder_outputs = all_nums_encoder_outputs.repeat_interleave(beam_size, dim=0)
+        seq_mask = seq_mask.repeat_interleave(beam_size, dim=0)
+        num_mask = num_mask.repeat_interleave(beam_size, dim=0)
+
+        rows = torch.arange(num_rows, device=device)
+        first_rows = rows[::beam_size]
+        beam_offset = first_rows.unsqueeze(1)
+
+        # node stack, only the first beam of every problem is alive at the beginning
+        node_stack = problem_output.new_zeros(num_rows, max_depth, problem_output.size(-1))
+        node_stack[first_rows, 0] = problem_output
+        node_sp = torch.zeros(num_rows, dtype=torch.long, device=device)
+        node_sp[first_rows] = 1
+        # embedding stack, operator labels and terminal subtrees share the positions
+        tree_stack = problem_output.new_zeros(num_rows, max_depth, problem_output.size(-1))
+        label_stack = None
+        terminal = torch.zeros(num_rows, max_depth, dtype=torch.bool, device=device)
+        tree_sp = torch.zeros(num_rows, dtype=torch.long, device=device)
+
+        scores = problem_output.new_full((num_rows, ), -float("inf"))
+        scores[first_rows] = 0.
+        all_tokens = []
+        all_parents = []
+        for t in range(self.max_length):
+            active = node_sp > 0
+            if not active.any():
+                break
+            active_idx = active.nonzero().squeeze(1)
+            active_pos = torch.full((num_rows, ), -1, dtype=torch.long, device=device)
+            active_pos[active_idx] = torch.arange(active_idx.size(0), device=device)
+
+            top_sp = node_sp[active_idx] - 1
+            top_tree_sp = (tree_sp[active_idx] - 1).clamp(min=0)
+            has_left = (tree_sp[active_idx] > 0) & terminal[active_idx, top_tree_sp]
+            node_stacks = [[TreeNode(node)] for node in node_stack[active_idx, top_sp].split(1, dim=0)]
+            left_childs = [l if flag else None for l, flag in zip(tree_stack[active_idx, top_tree_sp].split(1, dim=0), has_left.tolist())]
+
+            num_score, op, current_embeddings, current_context, current_nums_embeddings = \
+                self.decoder(node_stacks, left_childs, encoder_outputs[active_idx], all_nums_encoder_outputs[active_idx],
+                             padding_hidden, seq_mask[active_idx], num_mask[active_idx])
+            out_score = F.log_softmax(torch.cat((op, num_score), dim=1), dim=1)
+            # padding numbers of the batch are never generated
+            op_mask = torch.zeros(op.size(), dtype=torch.bool, device=device)
+            out_score = out_score.masked_fill(torch.cat((op_mask, num_mask[active_idx]), dim=1), -float("inf"))
+            vocab_size = out_score.size(1)
+
+            # candidates of finished beams are themselves, kept in column 0
+            candidates = scores.new_full((num_rows, vocab_size), -float("inf"))
+            candidates[:, 0] = scores
+            candidates[active_idx] = scores[active_idx].unsqueeze(1) + out_score
+            topv, topi = candidates.view(batch_size, beam_size * vocab_size).topk(beam_size, dim=1)
+            parents = (topi // vocab_size + beam_offset).view(-1)
+            tokens = (topi % vocab_size).view(-1)
+            scores = topv.view(-1)
+            expand = active[parents] & torch.isfinite(scores)
+            tokens = tokens.masked_fill(~expand, -1)
+
+            node_stack = node_stack[parents]
+            node_sp = node_sp[parents]
+            tree_stack = tree_stack[parents]
+            if label_stack is not None:
+                label_stack = label_stack[parents]
+            terminal = terminal[parents]
+            tree_sp = tree_sp[parents]
+            pos = active_pos[parents]
+            node_sp = node_sp.masked_fill(active[parents] & ~expand, 0)
+            node_sp[expand] -= 1
+
+            op_idx = rows[expand & (tokens < self.num_start)]
+            if op_idx.size(0) > 0:
+                left_child, right_child, node_label = self.node_generater(current_embeddings[pos[op_idx]], tokens[op_idx], current_context[pos[op_idx]])
+                if label_stack is None:
+                    label_stack = node_label.new_zeros(num_rows, max_depth, node_label.size(-1))
+                sp = node_sp[op_idx]
+                node_stack[op_idx, sp] = right_child
+                node_stack[op_idx, sp + 1] = left_child
+                node_sp[op_idx] += 2
+                sp = tree_sp[op_idx]
+                label_stack[op_idx, sp] = node_label
+                terminal[op_idx, sp] = False
+                tree_sp[op_idx] += 1
+
+            num_idx = rows[expand & (tokens >= self.num_start)]
+            if num_idx.size(0) > 0:
+                current_num = current_nums_embeddings[pos[num_idx], tokens[num_idx] - self.num_start]
+                while True:
+                    sp = tree_sp[num_idx]
+                    need_merge = (sp > 0) & terminal[num_idx, (sp - 1).clamp(min=0)]
+                    if not need_merge.any():
+                        break
+                    merge_idx = num_idx[need_merge]
+                    sp = tree_sp[merge_idx]
+                    current_num[need_merge] = self.merge(label_stack[merge_idx, sp - 2], tree_stack[merge_idx, sp - 1], current_num[need_merge])
+                    tree_sp[merge_idx] -= 2
+                sp = tree_sp[num_idx]
+                tree_stack[num_idx, sp] = current_num
+                terminal[num_idx, sp] = True
+                tree_sp[num_idx] += 1
+
+            all_tokens.append(tokens)
+            all_parents.append(parents)
+
+        # trace back the best beam of every problem, beams are sorted by topk
+        all_tokens = torch.stack(all_tokens).tolist() if all_tokens else []
+        all_parents = torch.stack(all_parents).tolist() if all_parents else []
+        outputs = []
+        for row in first_rows.tolist():
+            out = []
+            for tokens, parents in zip(reversed(all_tokens), reversed(all_parents)):
+                if tokens[row] >= 0:
+                    out.append(tokens[row])
+                row = parents[row]
+            outputs.append(out[::-1])
+        return outputs, scores[first_rows].tolist()
+
+
 class Beam_Search_Hypothesis(object):
     r""" Class designed for beam search.
     """
@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+import torch
+
+_dtype = np.int16
+
+
+def sequence_log_prob(probs, ids):
+    r"""log likelihood of candidate ids under decoder scores probs ([length, symbols], before softmax).
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    length = min(len(ids), len(probs))
+    if length == 0:
+        return 0.
+    scores = probs[:length]
+    top = scores.max(axis=1, keepdims=True)
+    log_probs = scores - top - np.log(np.exp(scores - top).sum(axis=1, keepdims=True))
+    return float(log_probs[np.arange(length), np.asarray(ids[:length])].sum())
+
+
+class CandidateBuffer(object):
+    r"""deduplicated candidates of one problem, kept as int16 byte strings.
+
+    A candidate is hashed on its symbol ids, adding a stored candidate only refreshes its priority.
+    If the buffer is full, the candidate of lowest priority is evicted for a new one of higher priority.
+
+    Args:
+        capacity (int|None): max number of candidates, unlimited if None.
+    """
+    __slots__ = ("capacity", "_items")
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self._items = {}
+
+    @staticmethod
+    def key(ids):
+        return np.asarray(ids, dtype=_dtype).tobytes()
+
+    def add(self, ids, value=None, priority=0.):
+        r"""add candidate ids with its value and priority.
+
+        Returns:
+            bool: True if candidate was not in buffer and is kept.
+        """
+        key = self.key(ids)
+        if key in self._items:
+            self._items[key] = (self._items[key][0], priority)
+            return False
+        if self.capacity and len(self._items) >= self.capacity:
+            lowest = min(self._items, key=lambda k: self._items[k][1])
+            if self._items[lowest][1] >= priority:
+                return False
+            del self._items[lowest]
+        self._items[key] = (value, priority)
+        return True
+
+    def trim(self):
+        r"""evict candidates of lowest priority until buffer fits in capacity.
+        """
+        while self.capacity and len(self._items) > self.capacity:
+            del self._items[min(self._items, key=lambda k: self._items[k][1])]
+
+    def values(self):
+        return [value for value, _ in self._items.values()]
+
+    def priorities(self):
+        return [priority for _, priority in self._items.values()]
+
+    def __contains__(self, ids):
+        return self.key(ids) in self._items
+
+    def __iter__(self):
+        for key in self._items:
+            yield np.frombuffer(key, dtype=_dtype).tolist()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class CandidateBufferStore(object):
+    r"""candidate buffers of training problems, keyed on problem id.
+
+    Only problems with candidates are kept. The store is saved as flat tensors, i.e. concatenated
+    symbol ids with candidate lengths, values and priorities, so it can be saved with checkpoints.
+
+    Args:
+        capacity (int|None): max number of candidates per problem, unlimited if None.
+    """
+    def __init__(self, capacity=None):
+        super().__init__()
+        self.capacity = capacity
+        self._buffers = {}
+
+    def batch(self, problem_ids):
+        r"""buffers of a batch, problems without candidates get new empty buffers.
+        """
+        return [self._buffers.get(problem_id, None) or CandidateBuffer(self.capacity) for problem_id in problem_ids]
+
+    def update(self, problem_ids, buffers):
+        r"""store buffers of a batch returned by training.
+        """
+        for problem_id, buffer in zip(problem_ids, buffers):
+            if not isinstance(buffer, CandidateBuffer):
+                candidates = buffer
+                buffer = CandidateBuffer(self.capacity)
+                for ids in candidates:
+                    buffer.add(ids)
+            if len(buffer):
+                self._buffers[problem_id] = buffer
+            else:
+                self._buffers.pop(problem_id, None)
+
+    def __getitem__(self, problem_id):
+        return self._buffers.get(problem_id, CandidateBuffer(self.capacity))
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def state_dict(self):
+        problem_ids, counts, lengths, tokens, values, priorities = [], [], [], [], [], []
+        for problem_id, buffer in self._buffers.items():
+            problem_ids.append(problem_id)
+            counts.append(len(buffer))
+            for key, (value, priority) in buffer._items.items():
+                ids = np.frombuffer(key, dtype=_dtype)
+                lengths.append(len(ids))
+                tokens.append(ids)
+                values.append(float('nan') if value is None else value)
+                priorities.append(priority)
+        tokens = np.concatenate(tokens) if tokens else np.zeros(0, dtype=_dtype)
+        return {
+            "capacity": self.capacity,
+            "problem_ids": problem_ids,
+            "counts": torch.tensor(counts, dtype=torch.long),
+            "lengths": torch.tensor(lengths, dtype=torch.long),
+            "tokens": torch.from_numpy(tokens.astype(_dtype)),
+            "values": torch.tensor(values, dtype=torch.float64),
+            "priorities": torch.tensor(priorities, dtype=torch.float64)
+        }
+
+    def load_state_dict(self, state_dict):
+        self._buffers = {}
+        tokens = state_dict["tokens"].numpy()
+        lengths = state_dict["lengths"].tolist()
+        values = state_dict["values"].tolist()
+        priorities = state_dict["priorities"].tolist()
+        c_idx = 0
+        start = 0
+        for problem_id, count in zip(state_dict["problem_ids"], state_dict["counts"].tolist()):
+            buffer = CandidateBuffer(self.capacity)
+            for _ in range(count):
+                value = None if np.isnan(values[c_idx]) else values[c_idx]
+                buffer._items[tokens[start:start + lengths[c_idx]].tobytes()] = (value, priorities[c_idx])
+                start += lengths[c_idx]
+                c_idx += 1
+            buffer.trim()
+            self._buffers[problem_id] = buffer
+
+    def save(self, path):
+        path_dir = os.path.dirname(path)
+        if path_dir:
+            os.makedirs(path_dir, exist_ok=True)
+        temp_path = path + '.tmp'
+        torch.save(self.state_dict(), temp_path)
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        r"""load buffers saved at path, False if there is no such file.
+        """
+        if not os.path.exists(path):
+            return False
+        self.load_state_dict(torch.load(path))
+        return True
@@ -0,0 +1,193 @@
+import re
+
+import numpy as np
+
+ANSWER_TOLERANCE = 1e-5
+
+NUMBER, PLUS, MINUS, TIMES, DIVIDE, POWER = 0, 1, 2, 3, 4, 5
+INVALID = -1
+# operations the fix search substitutes for an operator, it never produced powers by substitution
+SUBSTITUTE_OPS = (PLUS, MINUS, TIMES, DIVIDE)
+OP_CODES = {'+': PLUS, '-': MINUS, '*': TIMES, '/': DIVIDE, '^': POWER, '**': POWER}
+
+_mixed_number = re.compile(r"^(\d+(?:\.\d+)?)\((\d+(?:\.\d+)?)/(\d+(?:\.\d+)?)\)$")
+
+
+def number_value(symbol):
+    r"""value of a number symbol, e.g. "2.5", "50%", "3/4" or "1(1/2)", nan if symbol is not a number.
+    """
+    if not isinstance(symbol, str):
+        try:
+            return float(symbol)
+        except (TypeError, ValueError):
+            return float('nan')
+    s = symbol.strip()
+    try:
+        if s.endswith('%'):
+            return number_value(s[:-1]) / 100
+        mixed = _mixed_number.match(s)
+        if mixed:
+            return float(mixed.group(1)) + float(mixed.group(2)) / float(mixed.group(3))
+        if s.startswith('(') and s.endswith(')'):
+            s = s[1:-1]
+        if '/' in s:
+            numerator, denominator = s.split('/', 1)
+            return number_value(numerator) / number_value(denominator)
+        return float(s)
+    except (ValueError, ZeroDivisionError):
+        return float('nan')
+
+
+class SymbolTable(object):
+    r"""symbols of a problem compiled to arrays, expressions over it are arrays of symbol ids.
+
+    Args:
+        sym_list (list): symbols, operators are strings, numbers are strings or floats.
+        num_start (int|None): symbols before num_start are operators or special tokens, after are numbers.
+            Decided by the symbol itself if None.
+    """
+    def __init__(self, sym_list, num_start=None):
+        super().__init__()
+        self.op_codes = np.full(len(sym_list), INVALID, dtype=np.int64)
+        self.values = np.full(len(sym_list), np.nan)
+        for i, sym in enumerate(sym_list):
+            if isinstance(sym, str) and sym in OP_CODES:
+                self.op_codes[i] = OP_CODES[sym]
+                continue
+            if num_start is not None and i < num_start:
+                continue
+            value = number_value(sym)
+            if not np.isnan(value):
+                self.op_codes[i] = NUMBER
+                self.values[i] = value
+
+    def operator_ids(self, codes=None):
+        r"""ids of operator symbols, one for every operation in codes, all operations if codes is None.
+        """
+        ids = {}
+        for i, code in enumerate(self.op_codes.tolist()):
+            if code > NUMBER and code not in ids and (codes is None or code in codes):
+                ids[code] = i
+        return list(ids.values())
+
+    def evaluate(self, candidates, guarded=False):
+        r"""evaluate prefix expressions, see `evaluate_prefix`.
+        """
+        return evaluate_prefix(candidates, self.op_codes, self.values, guarded)
+
+    def match(self, candidates, answer, guarded=False, tolerance=ANSWER_TOLERANCE):
+        r"""whether every prefix expression reaches answer.
+        """
+        return answer_match(self.evaluate(candidates, guarded), answer, tolerance)
+
+
+def pad_candidates(candidates):
+    r"""stack expressions of symbol ids into a [C, L] array padded with -1.
+    """
+    candidates = [list(c) for c in candidates]
+    max_len = max([len(c) for c in candidates] + [1])
+    array = np.full((len(candidates), max_len), -1, dtype=np.int64)
+    for i, c in enumerate(candidates):
+        array[i, :len(c)] = c
+    return array
+
+
+def _operate(code, a, b, guarded):
+    if code.min() == code.max():
+        op = int(code[0])
+        if op == PLUS:
+            res = a + b
+        elif op == MINUS:
+            res = a - b
+        elif op == TIMES:
+            res = a * b
+        elif op == DIVIDE:
+            res = a / b
+        else:
+            res = np.power(a, b)
+    else:
+        res = np.select([code == PLUS, code == MINUS, code == TIMES, code == DIVIDE, code == POWER],
+                        [a + b, a - b, a * b, a / b, np.power(a, b)], np.nan)
+    if guarded:
+        res = np.where((code == DIVIDE) & ((b == 0) | (b == 1)), np.nan, res)
+        res = np.where((code == POWER) & ((np.abs(a) >= 1000) | (np.abs(b) >= 10) | (a == 1) | (b == 1)), np.nan, res)
+        res = np.where(np.abs(res) >= 1e8, np.nan, res)
+    return res
+
+
+def evaluate_prefix(candidates, op_codes, values, guarded=False):
+    r"""evaluate many prefix expressions of symbol ids in one pass.
+
+    All candidates are run as one stack machine from right to left, numbers are pushed and operators
+    reduce the two topmost values, the left operand is on top. Candidates sharing the positions of
+    numbers and operators, e.g. substitutions of symbols in one expression, share a single stack.
+
+    Args:
+        candidates (np.ndarray|list): [C, L] symbol ids, padded with -1.
+        op_codes (np.ndarray): [V] operation of every symbol, NUMBER for numbers, INVALID for others.
+        values (np.ndarray): [V] value of every number symbol.
+        guarded (bool): apply restrictions of the fix search, i.e. no division by 1, bounded powers and results.
+
+    Returns:
+        np.ndarray: [C] value of every candidate, nan if the candidate is not a valid expression.
+    """
+    if not isinstance(candidates, np.ndarray) or candidates.dtype == object:
+        candidates = pad_candidates(candidates)
+    candidates = np.asarray(candidates, dtype=np.int64)
+    if candidates.ndim == 1:
+        candidates = candidates[None, :]
+    num_candidates, length = candidates.shape
+    present = candidates >= 0
+    safe_ids = np.where(present, candidates, 0)
+    codes = np.where(present, op_codes[safe_ids], NUMBER)
+    numbers = values[safe_ids]
+    valid = ~(present & (codes == INVALID)).any(axis=1)
+    is_op = codes > NUMBER
+    with np.errstate(all='ignore'):
+        if (present == present[0]).all() and (is_op == is_op[0]).all():
+            stack = []
+            for t in range(length - 1, -1, -1):
+                if not present[0, t]:
+                    continue
+                if not is_op[0, t]:
+                    stack.append(numbers[:, t])
+                    continue
+                if len(stack) < 2:
+                    return np.full(num_candidates, np.nan)
+                a = stack.pop()
+                b = stack.pop()
+                res = _operate(codes[:, t], a, b, guarded)
+                valid &= np.isfinite(res)
+                stack.append(res)
+            if len(stack) != 1:
+                return np.full(num_candidates, np.nan)
+            return np.where(valid, stack[0], np.nan)
+
+        stack = np.zeros((num_candidates, length + 1))
+        depth = np.zeros(num_candidates, dtype=np.int64)
+        rows = np.arange(num_candidates)
+        for t in range(length - 1, -1, -1):
+            push = present[:, t] & ~is_op[:, t]
+            stack[rows[push], depth[push]] = numbers[push, t]
+            depth[push] += 1
+
+            reduce = is_op[:, t]
+            valid &= ~(reduce & (depth < 2))
+            reduce &= depth >= 2
+            if not reduce.any():
+                continue
+            r = rows[reduce]
+            res = _operate(codes[reduce, t], stack[r, depth[reduce] - 1], stack[r, depth[reduce] - 2], guarded)
+            valid[r[~np.isfinite(res)]] = False
+            stack[r, depth[reduce] - 2] = res
+            depth[reduce] -= 1
+    valid &= depth == 1
+    return np.where(valid, stack[:, 0], np.nan)
+
+
+def answer_match(results, answer, tolerance=ANSWER_TOLERANCE):
+    r"""whether values in results equal answer within tolerance, answer is a number or number string.
+    """
+    answer = number_value(answer)
+    with np.errstate(invalid='ignore'):
+        return np.abs(np.asarray(results) - answer) <= tolerance
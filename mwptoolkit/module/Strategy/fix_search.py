@@ -0,0 +1,263 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+import numpy as np
+
+
+def _fix_worker(conn):
+    r"""worker loop, receive (pred, gt, probs, sym_list, num_start, n_step, seed, budget) and send back the fix.
+    """
+    from mwptoolkit.module.Strategy.weakly_supervising import search_fix
+    conn.send(True)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        pred, gt, probs, sym_list, num_start, n_step, seed, budget = task
+        np.random.seed(seed)
+        deadline = time.time() + budget if budget else None
+        fix = search_fix(pred, gt, probs, sym_list, num_start, n_step, deadline)
+        try:
+            conn.send(fix)
+        except:
+            conn.send([])
+
+
+class FixSearchJob(object):
+    r"""fix searches of a batch submitted to FixSearchPool.
+    """
+    def __init__(self, tasks):
+        super().__init__()
+        self.tasks = tasks
+        self._done = queue.Queue()
+        self._results = {}
+        self._cancelled = set()
+
+    def _put(self, t_idx, fix):
+        self._done.put((t_idx, fix))
+
+    def cancel(self, t_indices):
+        r"""skip tasks not dispatched yet, their fixes are None. tasks already searching are not stopped.
+        """
+        self._cancelled.update(t_indices)
+
+    def as_completed(self):
+        r"""yield (index of task, fix) in the order searches finish.
+        """
+        while len(self._results) < len(self.tasks):
+            t_idx, fix = self._done.get()
+            self._results[t_idx] = fix
+            yield t_idx, fix
+
+    def result(self):
+        r"""wait for all searches, fixes in the order of tasks.
+        """
+        for _ in self.as_completed():
+            pass
+        return [self._results[t_idx] for t_idx in range(len(self.tasks))]
+
+
+class FixSearchPool(object):
+    r"""weak supervision fix search run by a persistent process pool.
+
+    Searches of a batch are submitted at once and dispatched by a background thread, so the caller keeps
+    running forward passes while workers search. Every search stops resampling after `timeout` seconds,
+    a worker still busy after twice that is terminated and replaced, its search returns no fix. Workers
+    get tasks once they are started, the time budget does not count start up.
+
+    Args:
+        num_workers (int|None): number of worker processes, default the number of cpu cores.
+        timeout (float|None): time budget of searching one fix, in seconds, no limit if None.
+    """
+    def __init__(self, num_workers=None, timeout=None):
+        super().__init__()
+        self.num_workers = num_workers if num_workers else (os.cpu_count() or 1)
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._conns = []
+        self._ready = []
+        self._jobs = queue.Queue()
+        self._thread = None
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_fix_worker, args=(child_conn, ), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _restart_worker(self, w_idx):
+        process = self._workers[w_idx]
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self._conns[w_idx].close()
+        self._workers[w_idx], self._conns[w_idx] = self._start_worker()
+        self._ready[w_idx] = False
+
+    def _ensure_workers(self):
+        while len(self._workers) < self.num_workers:
+            process, conn = self._start_worker()
+            self._workers.append(process)
+            self._conns.append(conn)
+            self._ready.append(False)
+
+    def submit(self, tasks):
+        r"""start searching fixes of a batch.
+
+        Args:
+            tasks (list): list of (pred, gt, probs, sym_list, num_start, n_step, seed), arguments of `find_fix`
+                and the numpy seed of resampling.
+
+        Returns:
+            FixSearchJob: searches of tasks, jobs are run in the order of submission.
+        """
+        job = FixSearchJob(tasks)
+        if len(tasks) == 0:
+            return job
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._dispatch, daemon=True)
+            self._thread.start()
+        self._jobs.put(job)
+        return job
+
+    def search_batch(self, tasks):
+        r"""search fixes of a batch, wait for all of them.
+        """
+        return self.submit(tasks).result()
+
+    def _dispatch(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            try:
+                self._run(job)
+            except:
+                for t_idx in range(len(job.tasks)):
+                    if t_idx not in job._results:
+                        job._put(t_idx, [])
+
+    def _run(self, job):
+        self._ensure_workers()
+        budget = self.timeout
+        hard_limit = 2 * budget if budget else None
+        pending = deque(range(len(job.tasks)))
+        idle = [w_idx for w_idx in range(self.num_workers) if self._ready[w_idx]]
+        starting = set(w_idx for w_idx in range(self.num_workers) if not self._ready[w_idx])
+        busy = {}
+        start_failures = 0
+        while pending or busy:
+            while pending and idle:
+                t_idx = pending.popleft()
+                if t_idx in job._cancelled:
+                    job._put(t_idx, None)
+                    continue
+                w_idx = idle.pop()
+                try:
+                    self._conns[w_idx].send(tuple(job.tasks[t_idx]) + (budget, ))
+                except (BrokenPipeError, EOFError, OSError):
+                    self._restart_worker(w_idx)
+                    starting.add(w_idx)
+                    pending.appendleft(t_idx)
+                    continue
+                except:
+                    # task can not be pickled
+                    idle.append(w_idx)
+                    job._put(t_idx, [])
+                    continue
+                busy[w_idx] = (t_idx, time.time() + hard_limit if hard_limit else None)
+            if not pending and not busy:
+                # the last tasks were cancelled
+                break
+
+            conn2worker = {self._conns[w_idx]: w_idx for w_idx in list(busy) + list(starting)}
+            deadlines = [deadline for _, deadline in busy.values() if deadline is not None]
+            timeout = max(0., min(deadlines) - time.time()) if deadlines else None
+            ready = wait(list(conn2worker.keys()), timeout=timeout)
+            for conn in ready:
+                w_idx = conn2worker[conn]
+                if w_idx in starting:
+                    try:
+                        self._ready[w_idx] = conn.recv()
+                    except:
+                        start_failures += 1
+                        if start_failures > self.num_workers:
+                            raise RuntimeError("fix search workers can not be started")
+                        self._restart_worker(w_idx)
+                        continue
+                    starting.remove(w_idx)
+                    idle.append(w_idx)
+                    continue
+                t_idx, _ = busy.pop(w_idx)
+                try:
+                    fix = conn.recv()
+                except:
+                    fix = []
+                    self._restart_worker(w_idx)
+                    starting.add(w_idx)
+                job._put(t_idx, fix)
+                if w_idx not in starting:
+                    idle.append(w_idx)
+
+            now = time.time()
+            for w_idx, (t_idx, deadline) in list(busy.items()):
+                if deadline is not None and deadline <= now:
+                    busy.pop(w_idx)
+                    self._restart_worker(w_idx)
+                    starting.add(w_idx)
+                    job._put(t_idx, [])
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._jobs.put(None)
+            self._thread.join()
+        self._thread = None
+        for process, conn in zip(self._workers, self._conns):
+            try:
+                conn.send(None)
+            except:
+                pass
+        for process, conn in zip(self._workers, self._conns):
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            conn.close()
+        self._workers = []
+        self._conns = []
+        self._ready = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_fix_search_pools = {}
+
+
+def get_fix_search_pool(num_workers=None, timeout=None):
+    r"""get the process-wide fix search pool, worker processes are started at the first search.
+    """
+    key = (num_workers, timeout)
+    if key not in _fix_search_pools:
+        _fix_search_pools[key] = FixSearchPool(num_workers, timeout)
+    return _fix_search_pools[key]
+
+
+@atexit.register
+def _close_fix_search_pools():
+    for pool in _fix_search_pools.values():
+        pool.close()
@@ -8,6 +8,8 @@ import math
 import time
 import signal
 import re
+from mwptoolkit.module.Strategy.expression import SUBSTITUTE_OPS, SymbolTable, number_value, answer_match
+from mwptoolkit.module.Strategy.candidate_buffer import CandidateBuffer, sequence_log_prob
 
 # sym2priority = {'+': 0, '-': 0, '*': 1, '/': 1}
 # sym2priority.update({str(x):2 for x in digit_list})
@@ -157,6 +159,7 @@ class ExprTree:
         self.root = None
         self.sym_list = sym_list
         self.num_start = num_start
+        self.table = SymbolTable(sym_list, num_start)
 
     def handeler(self, signo, frame):
         print("runtime error")
@@ -278,52 +281,6 @@ class ExprTree:
     #             # prev_op = ch
     #     return stack[-1]
 
-    def compute_prefix_expression(self, pre_fix):
-        st = list()
-        operators = ["+", "-", "**", "*", "/"]
-        pre_fix.reverse()
-        try:
-            for p in pre_fix:
-                if p not in operators:
-                    pos = re.search("\d+\(", p)
-                    if pos:
-                        st.append(eval(p[pos.start(): pos.end() - 1] + "+" + p[pos.end() - 1:]))
-                    elif p[-1] == "%":
-                        st.append(float(p[:-1]) / 100)
-                    else:
-                        st.append(eval(p))
-                elif p == "+" and len(st) > 1:
-                    a = st.pop()
-                    b = st.pop()
-                    st.append(a + b)
-                elif p == "*" and len(st) > 1:
-                    a = st.pop()
-                    b = st.pop()
-                    st.append(a * b)
-                elif p == "/" and len(st) > 1:
-                    a = st.pop()
-                    b = st.pop()
-                    if b == 0 or b == 1:
-                        return None
-                    st.append(a / b)
-                elif p == "-" and len(st) > 1:
-                    a = st.pop()
-                    b = st.pop()
-                    st.append(a - b)
-                elif p == "**" and len(st) > 1:
-                    a = st.pop()
-                    b = st.pop()
-                    if float(b) != 2.0 or float(b) != 3.0:
-                        return None
-                    st.append(a ** b)
-                else:
-                    return None
-        except:
-            return None
-        if len(st) == 1:
-            return st.pop()
-        return None
-
     def fix_1step(self, gt):
         # queue = Q.PriorityQueue()
         # change = PrioritizedItem(0., (self.root, gt))
@@ -380,6 +337,7 @@ class ExprTree:
         #     new_str[token_id] = target
         #     return (new_str, self.root.res()[1] - prob)
         olds = [tok.symbol for tok in self.tokens]
+        old_ids = np.array([tok.symbol_id for tok in self.tokens])
 
         queue = Q.PriorityQueue()
         change = PrioritizedItem(0., (self.root, gt))
@@ -443,60 +401,30 @@ class ExprTree:
 
                 queue.put(change)
 
-            # change op
-            ori_op = op.symbol
+            # change op, all substitutions are scored in one pass
             token_idx = self.tokens.index(op)
-            sub_target = None
-
-            for new_op in symbol2semantic.keys():
-                if new_op == ori_op:
-                    continue
-
-                new_exp = [tok.symbol for tok in self.tokens]
-                new_exp[token_idx] = "**" if new_op == "^" else new_op
-                for j in range(len(new_exp)):
-                    if not isinstance(new_exp[j], str):
-                        new_exp[j] = str(new_exp[j])
-
-                # new_str = self.prefix_to_infix(new_exp)
-
-                # start = time.time()
-                # future = time.time() + 3e-5
-                # try:
-                # signal.signal(signal.SIGALRM, self.handler)
-                # signal.alarm(0.1)
-
-                # new_res = eval(''.join(new_str))
-                # for idx in range(new_exp):
-                #     if not isinstance (new_exp[idx], str):
-                #         new_exp
-
-                new_res = self.compute_prefix_expression(new_exp)
-                # print (new_res)
-                if not new_res:
-                    continue
-                if abs(new_res - gt) < 1e-5:
-                    sub_target = new_op
-                    change = PrioritizedItem(op.prob - op.all_prob[self.sym_list.index(sub_target)],
-                                             (op, sub_target, sub_target))
-
-                    # if DEBUG and len(change.item) >= 3:
-                    #     changed_token_ids = old_ids.copy()
-                    #     changed_token_ids[token_idx] = change.item[2]
-                    #     print(f"    try change op: {self.token_id_list_to_str(changed_token_ids)}")
-
+            new_ops = [i for i in self.table.operator_ids(SUBSTITUTE_OPS) if self.table.op_codes[i] != self.table.op_codes[op.symbol_id]]
+            if len(new_ops) == 0:
+                continue
+            candidates = np.repeat(old_ids[None, :], len(new_ops), axis=0)
+            candidates[:, token_idx] = new_ops
+            new_res = self.table.evaluate(candidates, guarded=True)
+            for new_op, res in zip(new_ops, new_res):
+                if res != 0 and abs(res - gt) < 1e-5:
+                    sub_target = self.sym_list[new_op]
+                    change = PrioritizedItem(op.prob - op.all_prob[new_op], (op, sub_target, sub_target))
                     queue.put(change)
-                # except:
-                #     pass
 
         return None
 
-    def fix(self, gt, n_step=1):
+    def fix(self, gt, n_step=1, deadline=None):
         entropy_list = np.array([x.entropy() for x in self.tokens])
         entropy_list = entropy_list / entropy_list.sum()
         res_list = []
 
         for i in range(n_step):
+            if deadline is not None and time.time() > deadline:
+                break
             if i > 0:
                 self.parse()
                 # results = [tok.symbol for tok in self.tokens]
@@ -578,6 +506,28 @@ def out_expression_list(test, output_lang, num_list):
 
 
 
+def expression_ids(test, output_lang, num_list, num_start):
+    r"""symbol ids of a generated expression in out_idx2symbol[:num_start + 2] + num_list, compact form of out_expression_list.
+    """
+    res = []
+    for i in test:
+        i = int(i)
+        idx = output_lang.dataset.out_idx2symbol[i]
+
+        if "NUM_" in idx:
+            if int(idx[4:]) >= len(num_list):
+                continue
+            res.append(num_start + 2 + int(idx[4:]))
+        elif "UNK" in idx or "PAD" in idx or 'SOS' in idx:
+            continue
+        elif "EOS" in idx:
+            break
+        elif i < num_start + 2:
+            res.append(i)
+
+    return res
+
+
 def prefix_to_infix(formula, length=None):
     if length is not None:
         formula = formula[:length]
@@ -600,77 +550,62 @@ def prefix_to_infix(formula, length=None):
 
 
 
+def add_candidate(buffer_batch, buffer_batch_exp, idx, candidate, value, priority=0.):
+    r"""add a verified candidate to the buffer of problem idx, a CandidateBuffer or a plain list.
+    """
+    if isinstance(buffer_batch[idx], CandidateBuffer):
+        return buffer_batch[idx].add(candidate, value, priority)
+    if candidate in buffer_batch[idx]:
+        return False
+    buffer_batch[idx].append(candidate)
+    buffer_batch_exp[idx].append(value)
+    return True
+
+
+def search_fix(pred, gt, all_prob, sym_list, num_start, n_step, deadline=None):
+    r"""fix of a predicted prefix expression to reach answer gt, empty list if not found.
+    """
+    try:
+        return find_fix(pred, gt, all_prob, sym_list, num_start, n_step, deadline)
+    except:
+        return []
+
+
 def fixStrategy(idx, exp, num, generate_exp, target_length, num_ans, all_list, probs,num_start, n_step, fix_input_length,
                 fix_target_list, fix_index, fix_target_length, fix_found, buffer_batch_new, buffer_batch_new_exp,
-                input_length, Lang):
+                input_length, Lang, fix=None):
     #print("generate_exp[:target_length[idx]]", generate_exp[:target_length[idx]])
     #print("num_ans[idx]", num_ans[idx])
     #print("probs", probs.size())
     #print("all_list", all_list)
     #print("num_start", num_start)
     #print("n_step", n_step)
-    try:
-        fix = find_fix(
-            generate_exp[:target_length[idx]],
-            num_ans[idx],
-            probs,
-            all_list,
-            num_start,
-            n_step)
-    except:
-        fix = []
+    if fix is None:
+        fix = search_fix(generate_exp[:target_length[idx]], num_ans[idx], probs, all_list, num_start, n_step)
     #print("fix", fix)
     #print("num_ans", num_ans[idx])
     #print("*"*100)
     if len(fix):
         fix_found[idx] = True
-        fix_exp = out_expression_list(fix, Lang, num)
-        #print("fix_exp", fix_exp)
-        fix_infix = prefix_to_infix(fix_exp, target_length[idx])
-        try:
-            y = eval(fix_infix)
-            if y == eval(num_ans[idx]):
-                #print("fix_infix", fix_infix)
-                #print("fix", fix)
-                #print("num", num)
-                #print("y", y)
-                #print("gold_ans",eval(num_ans[idx]))
-                fix_target_list.append(fix)
-                fix_index.append(idx)
-                fix_target_length.append(len(fix))
-                fix_input_length.append(input_length[idx])
-
-        except:
-            pass
+        if SymbolTable(all_list, num_start).match([fix[:target_length[idx]]], num_ans[idx])[0]:
+            fix_target_list.append(fix)
+            fix_index.append(idx)
+            fix_target_length.append(len(fix))
+            fix_input_length.append(input_length[idx])
     return fix_input_length, fix_target_list,fix_index, fix_target_length,\
         fix_found,buffer_batch_new, buffer_batch_new_exp
 
 def mafixStrategy(idx, exp, num,generate_exp, target_length, num_ans, all_list, probs,num_start, n_step, fix_input_length,
                 fix_target_list, fix_index, fix_target_length, fix_found, buffer_batch_new, buffer_batch_new_exp,
-                  input_length, Lang):
-    try:
-        fix = find_fix(
-            generate_exp[:target_length[idx]],
-            num_ans[idx],
-            probs,
-            all_list,
-            num_start,
-            n_step)
-    except:
-        fix = []
+                  input_length, Lang, fix=None):
+    if fix is None:
+        fix = search_fix(generate_exp[:target_length[idx]], num_ans[idx], probs, all_list, num_start, n_step)
 
     if len(fix):
         fix_found[idx] = True
-        fix_exp = out_expression_list(fix, Lang, num)
-        fix_infix = prefix_to_infix(fix_exp, target_length[idx])
-        try:
-            y = eval(fix_infix)
-            if y == eval(num_ans[idx]):
-                if not fix in buffer_batch_new[idx]:
-                    buffer_batch_new[idx].append(fix)
-                    buffer_batch_new_exp[idx].append(fix_infix)
-        except:
-            pass
+        y = SymbolTable(all_list, num_start).evaluate([fix[:target_length[idx]]])[0]
+        if answer_match(y, num_ans[idx]):
+            add_candidate(buffer_batch_new, buffer_batch_new_exp, idx, fix, float(y), sequence_log_prob(probs, fix))
     for buffer_fix in buffer_batch_new[idx]:
         fix_target_list.append(buffer_fix)
         fix_index.append(idx)
@@ -684,17 +619,12 @@ def mafixStrategy(idx, exp, num,generate_exp, target_length, num_ans, all_list,
 def reinforceStrategy(idx, exp, num,generate_exp, target_length, num_ans, all_list, probs,num_start, n_step, fix_input_length,
                 fix_target_list, fix_index, fix_target_length, fix_found, buffer_batch_new, buffer_batch_new_exp,
                       input_length, Lang):
-    try:
-        generate_infix = prefix_to_infix(generate_exp, target_length[idx])
-
-        if eval(generate_infix) == eval(num_ans[idx]):
-            fix_target_list.append(exp.item()[:target_length[idx]])
-            fix_index.append(idx)
-            fix_target_length.append(len(exp))
-            fix_input_length.append(input_length[idx])
-
-    except:
-        pass
+    generate_ids = expression_ids(exp, Lang, num, num_start)[:target_length[idx]]
+    if SymbolTable(all_list, num_start).match([generate_ids], num_ans[idx])[0]:
+        fix_target_list.append(generate_ids)
+        fix_index.append(idx)
+        fix_target_length.append(len(generate_ids))
+        fix_input_length.append(input_length[idx])
     return fix_input_length, fix_target_list,fix_index, fix_target_length,\
         fix_found,buffer_batch_new, buffer_batch_new_exp
 
@@ -702,17 +632,10 @@ def reinforceStrategy(idx, exp, num,generate_exp, target_length, num_ans, all_li
 def mapoStrategy(idx,exp, num,generate_exp, target_length, num_ans, all_list, probs,num_start, n_step, fix_input_length,
                 fix_target_list, fix_index, fix_target_length, fix_found, buffer_batch_new, buffer_batch_new_exp,
                  input_length, Lang):
-    try:
-        generate_infix = prefix_to_infix(generate_exp, target_length[idx])
-
-        if eval(generate_infix) == eval(num_ans[idx]):
-
-            if not exp in buffer_batch_new[idx]:
-                buffer_batch_new[idx].append(exp.item()[:target_length[idx]])
-                buffer_batch_new_exp[idx].append(generate_infix)
-    except:
-        pass
-
+    generate_ids = expression_ids(exp, Lang, num, num_start)[:target_length[idx]]
+    y = SymbolTable(all_list, num_start).evaluate([generate_ids])[0]
+    if answer_match(y, num_ans[idx]):
+        add_candidate(buffer_batch_new, buffer_batch_new_exp, idx, generate_ids, float(y), sequence_log_prob(probs, generate_ids))
 
     for buffer_fix in buffer_batch_new[idx]:
         fix_target_list.append(buffer_fix)
@@ -724,29 +647,25 @@ def mapoStrategy(idx,exp, num,generate_exp, target_length, num_ans, all_list, pr
 
 
 
-def find_fix(pred, gt, all_prob, sym_list, num_start, n_step):
+def find_fix(pred, gt, all_prob, sym_list, num_start, n_step, deadline=None):
     """
     preds: batch_size * expr len                 int - predicted ids
     res: batch_size                              float - labeled correct result
     probs: batch_size * expr len * classes       float - predicted all probabilities
     num_list: batch_size * list
+    deadline: time.time() after which resampling stops, no limit if None
     """
-    try:
-        gt = eval(gt)
-
-        for i in range(len(pred)):
-            if any(char.isdigit() for char in pred[i]):
-                pred[i] = eval(pred[i].replace("%", "/100"))
-            if pred[i] == "^":
-                pred[i] = "**"
-
-        for i in range(len(sym_list)):
-            if any(char.isdigit() for char in sym_list[i]):
-                sym_list[i] = eval(sym_list[i].replace("%", "/100"))
-            if sym_list[i] == "^":
-                sym_list[i] = "**"
-    except:
+    gt = number_value(gt)
+    if np.isnan(gt):
         return []
+    for symbols in [pred, sym_list]:
+        for i in range(len(symbols)):
+            if isinstance(symbols[i], str) and any(char.isdigit() for char in symbols[i]):
+                symbols[i] = number_value(symbols[i])
+                if np.isnan(symbols[i]):
+                    return []
+            if symbols[i] == "^":
+                symbols[i] = "**"
 
     tokens = list(zip(pred, all_prob))
     etree = ExprTree(sym_list, num_start)
@@ -756,12 +675,12 @@ def find_fix(pred, gt, all_prob, sym_list, num_start, n_step):
         if abs(etree.res()[0] - gt) <= 1e-5:
             fix = [sym_list.index(i) for i in pred]
     except TypeError:
-        output = etree.fix(gt, n_step=n_step)
+        output = etree.fix(gt, n_step=n_step, deadline=deadline)
         if output:
             fix = [sym_list.index(i) for i in output[0]]
         # print("No fix needed")
     else:
-        output = etree.fix(gt, n_step=n_step)
+        output = etree.fix(gt, n_step=n_step, deadline=deadline)
         if output:
             fix = [sym_list.index(i) for i in output[0]]
 
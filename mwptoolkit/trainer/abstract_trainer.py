@@ -1,7 +1,54 @@
+import copy
+import os
+import threading
+from contextlib import contextmanager
 from logging import getLogger
 
 import torch
 
+from mwptoolkit.utils.enum_type import TaskType, DatasetType
+from mwptoolkit.utils.mixed_precision import MixedPrecision
+
+
+class EvaluationThread(threading.Thread):
+    r"""run an evaluation in background, on a side cuda stream if cuda is used.
+
+    Args:
+        evaluate (callable): function without arguments returning evaluation result.
+        device (torch.device|None): device of evaluated model.
+        ready_event (torch.cuda.Event|None): event recorded after the evaluated model is copied,
+            the side stream waits for it before evaluating.
+    """
+    def __init__(self, evaluate, device=None, ready_event=None):
+        super().__init__(daemon=True)
+        self.evaluate = evaluate
+        self.device = device
+        self.ready_event = ready_event
+        self._result = None
+        self._error = None
+
+    def run(self):
+        try:
+            if self.device is not None and self.device.type == 'cuda' and torch.cuda.is_available():
+                stream = torch.cuda.Stream(device=self.device)
+                if self.ready_event is not None:
+                    stream.wait_event(self.ready_event)
+                with torch.cuda.stream(stream):
+                    self._result = self.evaluate()
+                stream.synchronize()
+            else:
+                self._result = self.evaluate()
+        except BaseException as e:
+            self._error = e
+
+    def result(self):
+        r"""wait for evaluation and return its result, errors of evaluation are raised here.
+        """
+        self.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
 class AbstractTrainer(object):
     def __init__(self, config, model, dataloader, evaluator):
         super().__init__()
@@ -12,6 +59,15 @@ class AbstractTrainer(object):
         self.logger = getLogger()
         self.best_folds_accuracy=config["best_folds_accuracy"]
         self.test_step=config["test_step"]
+        self.checkpoint_batches = config["checkpoint_batches"]
+        self.test_on_improvement = config["test_on_improvement"]
+        self.async_evaluation = config["async_evaluation"]
+        self._evaluation = None
+        self.mixed_precision = MixedPrecision(config["device"], config["precision"], config["accumulation_steps"])
+        self.search_report_steps = config["search_report_steps"]
+        self._searching = False
+        self.search_step = 0
+        self.search_reports = 0
 
         self.best_valid_equ_accuracy = 0.
         self.best_valid_value_accuracy = 0.
@@ -26,6 +82,139 @@ class AbstractTrainer(object):
     def _load_checkpoint(self):
         raise NotImplementedError
 
+    def _load_dataloader_state(self, check_pnt):
+        r"""restore cursor of dataloader, an epoch unfinished in checkpoint is resumed from the next batch.
+        """
+        if "dataloader" not in check_pnt:
+            return
+        self.dataloader.load_state_dict(check_pnt["dataloader"])
+        if self.dataloader.batch_cursor > 0:
+            # checkpoint of an unfinished epoch is saved with start_epoch of the next one.
+            self.start_epoch -= 1
+
+    def _load_mixed_precision_state(self, check_pnt):
+        r"""restore loss scale and micro-batches counted towards the next optimizer step.
+        """
+        if "mixed_precision" in check_pnt:
+            self.mixed_precision.load_state_dict(check_pnt["mixed_precision"])
+
+    def _save_batch_checkpoint(self):
+        r"""save checkpoint every `checkpoint_batches` training batches.
+        """
+        if self.checkpoint_batches and self.dataloader.batch_cursor % self.checkpoint_batches == 0:
+            self._save_checkpoint()
+
+    def _evaluate_epoch(self, epo, epoch_nums):
+        r"""evaluate at every `test_step` epochs and each of the last 5 epochs.
+
+        with `test_on_improvement`, test set is evaluated only if valid value accuracy is not worse than the best one.
+        with `async_evaluation`, a snapshot of the model is evaluated in a background thread while training goes on,
+        its result is applied when the next evaluation starts, a checkpoint is saved or training finishes.
+        """
+        if not (epo % self.test_step == 0 or epo > epoch_nums - 5):
+            return
+        self._finish_evaluation()
+        if not self.async_evaluation:
+            self._apply_evaluation(self._run_evaluation())
+            return
+        try:
+            snapshot = copy.copy(self)
+            snapshot.model = self._snapshot_model()
+        except Exception as e:
+            self.logger.warning("can not snapshot model for asynchronous evaluation ({}), evaluate synchronously.".format(e))
+            self._apply_evaluation(self._run_evaluation())
+            return
+        device = next(snapshot.model.parameters()).device if len(list(snapshot.model.parameters())) > 0 else None
+        ready_event = None
+        if device is not None and device.type == 'cuda' and torch.cuda.is_available():
+            # weights are copied on the current stream, evaluation must not start before copying is done.
+            ready_event = torch.cuda.Event()
+            ready_event.record(torch.cuda.current_stream(device))
+        self._evaluation = EvaluationThread(snapshot._run_evaluation, device, ready_event)
+        self._evaluation.start()
+
+    def _finish_evaluation(self):
+        r"""wait for the running asynchronous evaluation and apply its result.
+        """
+        if self._evaluation is None:
+            return
+        evaluation = self._evaluation
+        self._evaluation = None
+        self._apply_evaluation(evaluation.result())
+
+    def _snapshot_model(self):
+        r"""copy of model weights, config, dataloader and evaluator referred by model are shared instead of copied.
+        """
+        memo = {}
+        for shared in (self.config, self.dataloader, getattr(self.dataloader, "dataset", None), self.evaluator):
+            if shared is not None:
+                memo[id(shared)] = shared
+        model = copy.deepcopy(self.model, memo)
+        model.eval()
+        return model
+
+    def _run_evaluation(self):
+        r"""evaluate valid and test set, save model if it is the best one.
+
+        Returns:
+            dict: epoch and result (equation accuracy, value accuracy, total, time cost) of evaluated sets.
+        """
+        result = {"epoch": self.epoch_i, "valid": None, "test": None, "improved": False}
+        if self.config["k_fold"]:
+            result["test"] = self.evaluate(DatasetType.Test)
+            result["improved"] = result["test"][1] >= self.best_test_value_accuracy
+        else:
+            result["valid"] = self.evaluate(DatasetType.Valid)
+            result["improved"] = result["valid"][1] >= self.best_valid_value_accuracy
+            if result["improved"] or not self.test_on_improvement:
+                result["test"] = self.evaluate(DatasetType.Test)
+        if result["improved"]:
+            self._save_model()
+        return result
+
+    def _apply_evaluation(self, result):
+        r"""log evaluation result and update best accuracy.
+        """
+        if self.async_evaluation:
+            self.logger.info("---------- evaluation of epoch [%3d]" % (result["epoch"]))
+        if result["valid"] is not None:
+            valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = result["valid"]
+            self.logger.info("---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s"\
+                                %(valid_total,valid_equ_ac,valid_val_ac,valid_time_cost))
+        if result["test"] is not None:
+            test_equ_ac, test_val_ac, test_total, test_time_cost = result["test"]
+            self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
+                                %(test_total,test_equ_ac,test_val_ac,test_time_cost))
+        if not result["improved"]:
+            return
+        if result["valid"] is not None:
+            self.best_valid_equ_accuracy = result["valid"][0]
+            self.best_valid_value_accuracy = result["valid"][1]
+        self.best_test_equ_accuracy = result["test"][0]
+        self.best_test_value_accuracy = result["test"][1]
+
+    def _optimizers(self):
+        r"""optimizers stepped together after every training step.
+        """
+        return [self.optimizer]
+
+    def _train_step(self, batch):
+        r"""train one micro-batch, its forward runs under autocast and its backward outside, optimizers are stepped
+        every `accumulation_steps` micro-batches.
+        """
+        self.mixed_precision.begin(self.model)
+        with self.mixed_precision.autocast():
+            batch_loss = self._train_batch(batch)
+        if self.mixed_precision.end(self._optimizers()):
+            self._save_batch_checkpoint()
+            self._report_search_step()
+        return batch_loss
+
+    def _finish_train_epoch(self):
+        r"""step optimizers with gradients of micro-batches left at the end of epoch.
+        """
+        self.mixed_precision.flush(self._optimizers())
+
     def _save_model(self):
         state_dict = {"model": self.model.state_dict()}
         if self.config["k_fold"]:
@@ -43,6 +232,103 @@ class AbstractTrainer(object):
         #self.model = nn.DataParallel(self.model)
         self.model.load_state_dict(state_dict["model"],False)
 
+    def _scheduler_step(self):
+        r"""step learning rate schedulers at the end of an epoch, trainers without schedulers do nothing.
+        """
+        pass
+
+    @contextmanager
+    def _checkpoint_in(self, checkpoint_dir):
+        r"""redirect `_save_checkpoint` and `_load_checkpoint` to a checkpoint in checkpoint_dir.
+        """
+        checkpoint_path = self.config["checkpoint_path"]
+        self.config["checkpoint_path"] = os.path.join(checkpoint_dir, "checkpoint.pth")
+        try:
+            yield
+        finally:
+            self.config["checkpoint_path"] = checkpoint_path
+
+    def _save_search_checkpoint(self, checkpoint_dir):
+        with self._checkpoint_in(checkpoint_dir):
+            self._save_checkpoint()
+        torch.save({"search_step": self.search_step, "search_reports": self.search_reports},
+                   os.path.join(checkpoint_dir, "search_state.pth"))
+
+    def _load_search_checkpoint(self, checkpoint_dir):
+        with self._checkpoint_in(checkpoint_dir):
+            self._load_checkpoint()
+        search_state = torch.load(os.path.join(checkpoint_dir, "search_state.pth"))
+        self.search_step = search_state["search_step"]
+        self.search_reports = search_state["search_reports"]
+
+    def _report_search_step(self):
+        r"""count a training step of hyper parameter search, report every `search_report_steps` steps.
+        """
+        if not self._searching:
+            return
+        self.search_step += 1
+        if self.search_report_steps and self.search_step % self.search_report_steps == 0:
+            self._search_report()
+
+    def _search_report(self):
+        r"""evaluate valid set, save a tuner checkpoint and report valid value accuracy to the tuner.
+
+        a trial stopped by the scheduler of tuner ends inside `tune.report`.
+        """
+        tune = self._search_reporter
+        valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
+        self.model.train()
+        self.logger.info("---------- step [%d] | valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s"\
+                            %(self.search_step,valid_total,valid_equ_ac,valid_val_ac,valid_time_cost))
+        if valid_val_ac >= self.best_valid_value_accuracy:
+            self.best_valid_equ_accuracy = valid_equ_ac
+            self.best_valid_value_accuracy = valid_val_ac
+        self.search_reports += 1
+        self._reported_step = self.search_step
+        with tune.checkpoint_dir(step=self.search_reports) as checkpoint_dir:
+            self._save_search_checkpoint(checkpoint_dir)
+        tune.report(accuracy=valid_val_ac, equation_accuracy=valid_equ_ac, epoch=self.epoch_i, step=self.search_step)
+
+    def param_search(self, checkpoint_dir=None, reporter=None, stop_epoch=None):
+        r"""training loop of a hyper parameter search trial run by ray tune.
+
+        valid value accuracy is reported to the tuner as "accuracy" every `search_report_steps` training steps,
+        or at the end of every epoch if it is not set or the trainer does not train through `_train_step`.
+        every report saves a tuner checkpoint, so schedulers can prune, pause and resume trials. the trainer
+        does not save models or checkpoints of its own, their paths are shared by all trials.
+
+        Args:
+            checkpoint_dir (str|None): tuner checkpoint to restore the trial from.
+            reporter (object|None): tuner with `checkpoint_dir(step)` and `report(**metrics)` like `ray.tune`,
+                `ray.tune` if None.
+            stop_epoch (int|None): pause the trial after this epoch, trial is trained for `epoch_nums` if None.
+        """
+        if reporter is None:
+            from ray import tune as reporter
+        self._search_reporter = reporter
+        epoch_nums = self.config["epoch_nums"]
+        if stop_epoch is not None:
+            epoch_nums = min(epoch_nums, stop_epoch)
+        if checkpoint_dir:
+            self._load_search_checkpoint(checkpoint_dir)
+        self.checkpoint_batches = None
+        self._searching = True
+        self._reported_step = self.search_step
+        self.logger.info("start hyper parameter search trial...")
+        try:
+            for epo in range(self.start_epoch, epoch_nums):
+                self.epoch_i = epo + 1
+                self.model.train()
+                epoch_start_step = self.search_step
+                self._train_epoch()
+                self._scheduler_step()
+                if not self.search_report_steps or self.search_step == epoch_start_step:
+                    self._search_report()
+            if self._reported_step != self.search_step:
+                self._search_report()
+        finally:
+            self._searching = False
+
     def _build_optimizer(self):
         raise NotImplementedError
 
@@ -52,9 +338,36 @@ class AbstractTrainer(object):
     def _eval_batch(self):
         raise NotImplementedError
 
+    def _test_outputs(self, batch):
+        r"""outputs of model on a batch, e.g. (test_out, target), used by `_eval_batch` and by `_eval_results`
+        of multiple equations. Override it to change how a trainer tests its model.
+        """
+        return self.model.model_test(batch)
+
     def _train_epoch(self):
         raise NotImplementedError
 
+    def _eval_results(self, eval_set):
+        r"""yield value accuracy and equation accuracy of eval set.
+
+        multiple equations of the whole eval set are verified in one call of evaluator,
+        so that equation systems can be solved by the solver pool in parallel.
+        """
+        if self.config["task_type"] != TaskType.MultiEquation:
+            for batch in self.dataloader.load_data(eval_set):
+                yield self._eval_batch(batch)
+            return
+        test_outs = []
+        targets = []
+        for batch in self.dataloader.load_data(eval_set):
+            test_out, target = self._test_outputs(batch)
+            test_outs += test_out
+            targets += target
+        results = self.evaluator.result_multi_batch(test_outs, targets)
+        val_acc = [result[0] for result in results]
+        equ_acc = [result[1] for result in results]
+        yield val_acc, equ_acc
+
     def fit(self):
         raise NotImplementedError
 
@@ -6,6 +6,7 @@ from mwptoolkit.trainer.abstract_trainer import AbstractTrainer
 from mwptoolkit.trainer.template_trainer import TemplateTrainer
 from mwptoolkit.utils.enum_type import TaskType, DatasetType, SpecialTokens
 from mwptoolkit.utils.utils import time_since
+from mwptoolkit.utils.mixed_precision import adam_options, refuse_mixed_precision
 
 
 class SupervisedTrainer(AbstractTrainer):
@@ -17,13 +18,16 @@ class SupervisedTrainer(AbstractTrainer):
         #self._build_loss(config["symbol_size"], self.dataloader.dataset.out_symbol2idx[SpecialTokens.PAD_TOKEN])
 
     def _build_optimizer(self):
-        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.config["learning_rate"])
+        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.config["learning_rate"], **adam_options(self.config["device"]))
 
     def _save_checkpoint(self):
+        self._finish_evaluation()
         check_pnt = {
             "model": self.model.state_dict(),
             "optimizer": self.optimizer.state_dict(),
             "start_epoch": self.epoch_i,
+            "dataloader": self.dataloader.state_dict(),
+            "mixed_precision": self.mixed_precision.state_dict(),
             "best_valid_value_accuracy": self.best_valid_value_accuracy,
             "best_valid_equ_accuracy": self.best_valid_equ_accuracy,
             "best_test_value_accuracy": self.best_test_value_accuracy,
@@ -42,6 +46,8 @@ class SupervisedTrainer(AbstractTrainer):
         self.optimizer.load_state_dict(check_pnt["optimizer"])
         # other parameter
         self.start_epoch = check_pnt["start_epoch"]
+        self._load_dataloader_state(check_pnt)
+        self._load_mixed_precision_state(check_pnt)
         self.best_valid_value_accuracy = check_pnt["best_valid_value_accuracy"]
         self.best_valid_equ_accuracy = check_pnt["best_valid_equ_accuracy"]
         self.best_test_value_accuracy = check_pnt["best_test_value_accuracy"]
@@ -66,19 +72,15 @@ class SupervisedTrainer(AbstractTrainer):
         return batch_loss
     
     def _eval_batch(self, batch):
-        test_out, target = self.model.model_test(batch)
-        batch_size = len(test_out)
-        val_acc = []
-        equ_acc = []
-        for idx in range(batch_size):
-            if self.config["task_type"] == TaskType.SingleEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result(test_out[idx], target[idx])
-            elif self.config["task_type"] == TaskType.MultiEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result_multi(test_out[idx], target[idx])
-            else:
-                raise NotImplementedError
-            val_acc.append(val_ac)
-            equ_acc.append(equ_ac)
+        test_out, target = self._test_outputs(batch)
+        if self.config["task_type"] == TaskType.SingleEquation:
+            val_acc, equ_acc = self.evaluator.result_batch(test_out, target)
+        elif self.config["task_type"] == TaskType.MultiEquation:
+            results = self.evaluator.result_multi_batch(test_out, target)
+            val_acc = [result[0] for result in results]
+            equ_acc = [result[1] for result in results]
+        else:
+            raise NotImplementedError
         return val_acc, equ_acc
 
     def _train_epoch(self):
@@ -87,10 +89,9 @@ class SupervisedTrainer(AbstractTrainer):
         self.model.train()
         for batch_idx, batch in enumerate(self.dataloader.load_data(DatasetType.Train)):
             self.batch_idx = batch_idx + 1
-            self.model.zero_grad()
-            batch_loss = self._train_batch(batch)
+            batch_loss = self._train_step(batch)
             loss_total += batch_loss
-            self.optimizer.step()
+        self._finish_train_epoch()
         epoch_time_cost = time_since(time.time() - epoch_start_time)
         return loss_total, epoch_time_cost
 
@@ -108,35 +109,10 @@ class SupervisedTrainer(AbstractTrainer):
             self.logger.info("epoch [%3d] avr loss [%2.8f] | train time %s"\
                                 %(self.epoch_i,loss_total/self.train_batch_nums,train_time_cost))
 
-            if epo % self.test_step == 0 or epo > epoch_nums - 5:
-                if self.config["k_fold"]:
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if test_val_ac >= self.best_test_value_accuracy:
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
-                else:
-                    valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
-
-                    self.logger.info("---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s"\
-                                    %(valid_total,valid_equ_ac,valid_val_ac,valid_time_cost))
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if valid_val_ac >= self.best_valid_value_accuracy:
-                        self.best_valid_value_accuracy = valid_val_ac
-                        self.best_valid_equ_accuracy = valid_equ_ac
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
+            self._evaluate_epoch(epo, epoch_nums)
             if epo % 5 == 0:
                 self._save_checkpoint()
+        self._finish_evaluation()
         self.logger.info('''training finished.
                             best valid result: equation accuracy [%2.3f] | value accuracy [%2.3f]
                             best test result : equation accuracy [%2.3f] | value accuracy [%2.3f]'''\
@@ -150,8 +126,7 @@ class SupervisedTrainer(AbstractTrainer):
         eval_total = 0
         test_start_time = time.time()
 
-        for batch in self.dataloader.load_data(eval_set):
-            batch_val_ac, batch_equ_ac = self._eval_batch(batch)
+        for batch_val_ac, batch_equ_ac in self._eval_results(eval_set):
             value_ac += batch_val_ac.count(True)
             equation_ac += batch_equ_ac.count(True)
             eval_total += len(batch_val_ac)
@@ -167,8 +142,7 @@ class SupervisedTrainer(AbstractTrainer):
         eval_total = 0
         test_start_time = time.time()
 
-        for batch in self.dataloader.load_data(DatasetType.Test):
-            batch_val_ac, batch_equ_ac = self._eval_batch(batch)
+        for batch_val_ac, batch_equ_ac in self._eval_results(DatasetType.Test):
             value_ac += batch_val_ac.count(True)
             equation_ac += batch_equ_ac.count(True)
             eval_total += len(batch_val_ac)
@@ -181,14 +155,16 @@ class GTSTrainer(AbstractTrainer):
     def __init__(self, config, model, dataloader, evaluator):
         super().__init__(config, model, dataloader, evaluator)
         self._build_optimizer()
+        if config["resume"]:
+            self._load_checkpoint()
 
     def _build_optimizer(self):
         # optimizer
-        self.embedder_optimizer = torch.optim.Adam(self.model.embedder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.encoder_optimizer = torch.optim.Adam(self.model.encoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.decoder_optimizer = torch.optim.Adam(self.model.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.node_generater_optimizer = torch.optim.Adam(self.model.node_generater.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.merge_optimizer = torch.optim.Adam(self.model.merge.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
+        self.embedder_optimizer = torch.optim.Adam(self.model.embedder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.encoder_optimizer = torch.optim.Adam(self.model.encoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.decoder_optimizer = torch.optim.Adam(self.model.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.node_generater_optimizer = torch.optim.Adam(self.model.node_generater.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.merge_optimizer = torch.optim.Adam(self.model.merge.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
         # scheduler
         self.embedder_scheduler = torch.optim.lr_scheduler.StepLR(self.embedder_optimizer, step_size=self.config["step_size"], gamma=0.5)
         self.encoder_scheduler = torch.optim.lr_scheduler.StepLR(self.encoder_optimizer, step_size=self.config["step_size"], gamma=0.5)
@@ -197,6 +173,7 @@ class GTSTrainer(AbstractTrainer):
         self.merge_scheduler = torch.optim.lr_scheduler.StepLR(self.merge_optimizer, step_size=self.config["step_size"], gamma=0.5)
 
     def _save_checkpoint(self):
+        self._finish_evaluation()
         check_pnt = {
             "model": self.model.state_dict(),
             "embedder_optimizer": self.embedder_optimizer.state_dict(),
@@ -210,6 +187,8 @@ class GTSTrainer(AbstractTrainer):
             "generate_scheduler": self.node_generater_scheduler.state_dict(),
             "merge_scheduler": self.merge_scheduler.state_dict(),
             "start_epoch": self.epoch_i,
+            "dataloader": self.dataloader.state_dict(),
+            "mixed_precision": self.mixed_precision.state_dict(),
             "best_valid_value_accuracy": self.best_valid_value_accuracy,
             "best_valid_equ_accuracy": self.best_valid_equ_accuracy,
             "best_test_value_accuracy": self.best_test_value_accuracy,
@@ -237,6 +216,8 @@ class GTSTrainer(AbstractTrainer):
         self.merge_scheduler.load_state_dict(check_pnt["merge_scheduler"])
         # other parameter
         self.start_epoch = check_pnt["start_epoch"]
+        self._load_dataloader_state(check_pnt)
+        self._load_mixed_precision_state(check_pnt)
         self.best_valid_value_accuracy = check_pnt["best_valid_value_accuracy"]
         self.best_valid_equ_accuracy = check_pnt["best_valid_equ_accuracy"]
         self.best_test_value_accuracy = check_pnt["best_test_value_accuracy"]
@@ -250,32 +231,24 @@ class GTSTrainer(AbstractTrainer):
         self.node_generater_scheduler.step()
         self.merge_scheduler.step()
 
-    def _optimizer_step(self):
-        self.embedder_optimizer.step()
-        self.encoder_optimizer.step()
-        self.decoder_optimizer.step()
-        self.node_generater_optimizer.step()
-        self.merge_optimizer.step()
+    def _optimizers(self):
+        return [self.embedder_optimizer, self.encoder_optimizer, self.decoder_optimizer, self.node_generater_optimizer, self.merge_optimizer]
 
     def _train_batch(self, batch):
         batch_loss = self.model.calculate_loss(batch)
         return batch_loss
 
     def _eval_batch(self, batch):
-        test_out, target = self.model.model_test(batch)
-
-        batch_size = len(test_out)
-        val_acc = []
-        equ_acc = []
-        for idx in range(batch_size):
-            if self.config["task_type"] == TaskType.SingleEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result(test_out[idx], target[idx])
-            elif self.config["task_type"] == TaskType.MultiEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result_multi(test_out[idx], target[idx])
-            else:
-                raise NotImplementedError
-            val_acc.append(val_ac)
-            equ_acc.append(equ_ac)
+        test_out, target = self._test_outputs(batch)
+
+        if self.config["task_type"] == TaskType.SingleEquation:
+            val_acc, equ_acc = self.evaluator.result_batch(test_out, target)
+        elif self.config["task_type"] == TaskType.MultiEquation:
+            results = self.evaluator.result_multi_batch(test_out, target)
+            val_acc = [result[0] for result in results]
+            equ_acc = [result[1] for result in results]
+        else:
+            raise NotImplementedError
         return val_acc, equ_acc
 
     def _train_epoch(self):
@@ -284,10 +257,9 @@ class GTSTrainer(AbstractTrainer):
         self.model.train()
         for batch_idx, batch in enumerate(self.dataloader.load_data(DatasetType.Train)):
             self.batch_idx = batch_idx + 1
-            self.model.zero_grad()
-            batch_loss = self._train_batch(batch)
+            batch_loss = self._train_step(batch)
             loss_total += batch_loss
-            self._optimizer_step()
+        self._finish_train_epoch()
         epoch_time_cost = time_since(time.time() - epoch_start_time)
         return loss_total, epoch_time_cost
 
@@ -306,35 +278,10 @@ class GTSTrainer(AbstractTrainer):
             self.logger.info("epoch [%3d] avr loss [%2.8f] | train time %s"\
                                 %(self.epoch_i,loss_total/self.train_batch_nums,train_time_cost))
 
-            if epo % self.test_step == 0 or epo > epoch_nums - 5:
-                if self.config["k_fold"]:
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if test_val_ac >= self.best_test_value_accuracy:
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
-                else:
-                    valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
-
-                    self.logger.info("---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s"\
-                                    %(valid_total,valid_equ_ac,valid_val_ac,valid_time_cost))
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if valid_val_ac >= self.best_valid_value_accuracy:
-                        self.best_valid_value_accuracy = valid_val_ac
-                        self.best_valid_equ_accuracy = valid_equ_ac
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
+            self._evaluate_epoch(epo, epoch_nums)
             if epo % 5 == 0:
                 self._save_checkpoint()
+        self._finish_evaluation()
         self.logger.info('''training finished.
                             best valid result: equation accuracy [%2.3f] | value accuracy [%2.3f]
                             best test result : equation accuracy [%2.3f] | value accuracy [%2.3f]'''\
@@ -347,8 +294,7 @@ class GTSTrainer(AbstractTrainer):
         equation_ac = 0
         eval_total = 0
         test_start_time = time.time()
-        for batch in self.dataloader.load_data(eval_set):
-            batch_val_ac, batch_equ_ac = self._eval_batch(batch)
+        for batch_val_ac, batch_equ_ac in self._eval_results(eval_set):
             value_ac += batch_val_ac.count(True)
             equation_ac += batch_equ_ac.count(True)
             eval_total += len(batch_val_ac)
@@ -365,8 +311,7 @@ class GTSTrainer(AbstractTrainer):
         eval_total = 0
         test_start_time = time.time()
 
-        for batch in self.dataloader.load_data(DatasetType.Test):
-            batch_val_ac, batch_equ_ac = self._eval_batch(batch)
+        for batch_val_ac, batch_equ_ac in self._eval_results(DatasetType.Test):
             value_ac += batch_val_ac.count(True)
             equation_ac += batch_equ_ac.count(True)
             eval_total += len(batch_val_ac)
@@ -382,9 +327,9 @@ class MultiEncDecTrainer(GTSTrainer):
     def _build_optimizer(self):
         # optimizer
         # self.embedder_optimizer = torch.optim.Adam(self.model.embedder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.encoder_optimizer = torch.optim.Adam(self.model.encoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.numencoder_optimizer = torch.optim.Adam(self.model.numencoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.predict_optimizer = torch.optim.Adam(self.model.predict.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
+        self.encoder_optimizer = torch.optim.Adam(self.model.encoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.numencoder_optimizer = torch.optim.Adam(self.model.numencoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.predict_optimizer = torch.optim.Adam(self.model.predict.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
         self.decoder_optimizer = torch.optim.Adam(
             [
                 {'params': self.model.decoder.parameters()}, \
@@ -392,10 +337,11 @@ class MultiEncDecTrainer(GTSTrainer):
                 {'params': self.model.out_embedder.parameters()}\
             ],
             self.config["learning_rate"], \
-            weight_decay=self.config["weight_decay"]
+            weight_decay=self.config["weight_decay"], \
+            **adam_options(self.config["device"])
         )
-        self.generate_optimizer = torch.optim.Adam(self.model.generate.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.merge_optimizer = torch.optim.Adam(self.model.merge.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
+        self.generate_optimizer = torch.optim.Adam(self.model.generate.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.merge_optimizer = torch.optim.Adam(self.model.merge.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
         #self.optimizer = torch.optim.Adam(self.model.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
         # scheduler
         #self.scheduler = torch.optim.lr_scheduler.StepLR(self.optimizer, step_size=self.config["step_size"], gamma=0.5)
@@ -424,10 +370,12 @@ class MultiEncDecTrainer(GTSTrainer):
         self.numencoder_scheduler.load_state_dict(check_pnt["numencoder_scheduler"])
         self.predict_scheduler.load_state_dict(check_pnt['predict_scheduler'])
         self.decoder_scheduler.load_state_dict(check_pnt["decoder_scheduler"])
-        self.node_generater_scheduler.load_state_dict(check_pnt["generate_scheduler"])
+        self.generate_scheduler.load_state_dict(check_pnt["generate_scheduler"])
         self.merge_scheduler.load_state_dict(check_pnt["merge_scheduler"])
         # other parameter
         self.start_epoch = check_pnt["start_epoch"]
+        self._load_dataloader_state(check_pnt)
+        self._load_mixed_precision_state(check_pnt)
         self.best_valid_value_accuracy = check_pnt["best_valid_value_accuracy"]
         self.best_valid_equ_accuracy = check_pnt["best_valid_equ_accuracy"]
         self.best_test_value_accuracy = check_pnt["best_test_value_accuracy"]
@@ -435,6 +383,7 @@ class MultiEncDecTrainer(GTSTrainer):
         self.best_folds_accuracy = check_pnt["best_folds_accuracy"]
 
     def _save_checkpoint(self):
+        self._finish_evaluation()
         check_pnt = {
             "model": self.model.state_dict(),
             "encoder_optimizer": self.encoder_optimizer.state_dict(),
@@ -450,6 +399,8 @@ class MultiEncDecTrainer(GTSTrainer):
             "generate_scheduler": self.generate_scheduler.state_dict(),
             "merge_scheduler": self.merge_scheduler.state_dict(),
             "start_epoch": self.epoch_i,
+            "dataloader": self.dataloader.state_dict(),
+            "mixed_precision": self.mixed_precision.state_dict(),
             "best_valid_value_accuracy": self.best_valid_value_accuracy,
             "best_valid_equ_accuracy": self.best_valid_equ_accuracy,
             "best_test_value_accuracy": self.best_test_value_accuracy,
@@ -468,40 +419,51 @@ class MultiEncDecTrainer(GTSTrainer):
         self.generate_scheduler.step()
         self.merge_scheduler.step()
 
-    def _optimizer_step(self):
+    def _optimizers(self):
         #self.optimizer.step()
-        self.encoder_optimizer.step()
-        self.numencoder_optimizer.step()
-        self.predict_optimizer.step()
-        self.decoder_optimizer.step()
-        self.generate_optimizer.step()
-        self.merge_optimizer.step()
+        return [self.encoder_optimizer, self.numencoder_optimizer, self.predict_optimizer, self.decoder_optimizer, self.generate_optimizer, self.merge_optimizer]
 
     def _train_batch(self, batch):
         batch_loss = self.model.calculate_loss(batch)
         return batch_loss
 
     def _eval_batch(self, batch):
-        out_type, test_out, target = self.model.model_test(batch)
-
-        batch_size = len(test_out)
-        val_acc = []
-        equ_acc = []
-        for idx in range(batch_size):
-            if self.config["task_type"] == TaskType.SingleEquation and out_type == 'tree':
-                val_ac, equ_ac, _, _ = self.evaluator.prefix_result(test_out[idx], target[idx])
-            elif self.config["task_type"] == TaskType.SingleEquation and out_type == 'attn':
-                val_ac, equ_ac, _, _ = self.evaluator.postfix_result(test_out[idx], target[idx])
-            elif self.config["task_type"] == TaskType.MultiEquation and out_type == 'tree':
-                val_ac, equ_ac, _, _ = self.evaluator.prefix_result_multi(test_out[idx], target[idx])
-            elif self.config["task_type"] == TaskType.MultiEquation and out_type == 'attn':
-                val_ac, equ_ac, _, _ = self.evaluator.postfix_result_multi(test_out[idx], target[idx])
-            else:
-                raise NotImplementedError
-            val_acc.append(val_ac)
-            equ_acc.append(equ_ac)
+        out_type, test_out, target = self._test_outputs(batch)
+
+        if self.config["task_type"] == TaskType.SingleEquation and out_type == 'tree':
+            val_acc, equ_acc = self.evaluator.prefix_result_batch(test_out, target)
+        elif self.config["task_type"] == TaskType.SingleEquation and out_type == 'attn':
+            val_acc, equ_acc = self.evaluator.postfix_result_batch(test_out, target)
+        elif self.config["task_type"] == TaskType.MultiEquation and out_type == 'tree':
+            results = self.evaluator.prefix_result_multi_batch(test_out, target)
+            val_acc = [result[0] for result in results]
+            equ_acc = [result[1] for result in results]
+        elif self.config["task_type"] == TaskType.MultiEquation and out_type == 'attn':
+            results = self.evaluator.postfix_result_multi_batch(test_out, target)
+            val_acc = [result[0] for result in results]
+            equ_acc = [result[1] for result in results]
+        else:
+            raise NotImplementedError
         return val_acc, equ_acc
 
+    def _eval_results(self, eval_set):
+        if self.config["task_type"] != TaskType.MultiEquation:
+            for batch in self.dataloader.load_data(eval_set):
+                yield self._eval_batch(batch)
+            return
+        outputs = {'tree': ([], []), 'attn': ([], [])}
+        for batch in self.dataloader.load_data(eval_set):
+            out_type, test_out, target = self._test_outputs(batch)
+            if out_type not in outputs:
+                raise NotImplementedError
+            outputs[out_type][0].extend(test_out)
+            outputs[out_type][1].extend(target)
+        results = self.evaluator.prefix_result_multi_batch(*outputs['tree'])
+        results += self.evaluator.postfix_result_multi_batch(*outputs['attn'])
+        val_acc = [result[0] for result in results]
+        equ_acc = [result[1] for result in results]
+        yield val_acc, equ_acc
+
 
 class Graph2TreeTrainer(GTSTrainer):
     def __init__(self, config, model, dataloader, evaluator):
@@ -512,13 +474,15 @@ class TreeLSTMTrainer(AbstractTrainer):
     def __init__(self, config, model, dataloader, evaluator):
         super().__init__(config, model, dataloader, evaluator)
         self._build_optimizer()
+        if config["resume"]:
+            self._load_checkpoint()
 
     def _build_optimizer(self):
         # optimizer
-        self.embedder_optimizer = torch.optim.Adam(self.model.embedder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.encoder_optimizer = torch.optim.Adam(self.model.encoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.decoder_optimizer = torch.optim.Adam(self.model.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
-        self.node_generater_optimizer = torch.optim.Adam(self.model.node_generater.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"])
+        self.embedder_optimizer = torch.optim.Adam(self.model.embedder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.encoder_optimizer = torch.optim.Adam(self.model.encoder.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.decoder_optimizer = torch.optim.Adam(self.model.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
+        self.node_generater_optimizer = torch.optim.Adam(self.model.node_generater.parameters(), self.config["learning_rate"], weight_decay=self.config["weight_decay"], **adam_options(self.config["device"]))
         # scheduler
         self.embedder_scheduler = torch.optim.lr_scheduler.StepLR(self.embedder_optimizer, step_size=self.config["step_size"], gamma=0.5)
         self.encoder_scheduler = torch.optim.lr_scheduler.StepLR(self.encoder_optimizer, step_size=self.config["step_size"], gamma=0.5)
@@ -526,6 +490,7 @@ class TreeLSTMTrainer(AbstractTrainer):
         self.node_generater_scheduler = torch.optim.lr_scheduler.StepLR(self.node_generater_optimizer, step_size=self.config["step_size"], gamma=0.5)
 
     def _save_checkpoint(self):
+        self._finish_evaluation()
         check_pnt = {
             "model": self.model.state_dict(),
             "embedder_optimizer": self.embedder_optimizer.state_dict(),
@@ -537,6 +502,8 @@ class TreeLSTMTrainer(AbstractTrainer):
             "decoder_scheduler": self.decoder_scheduler.state_dict(),
             "generate_scheduler": self.node_generater_scheduler.state_dict(),
             "start_epoch": self.epoch_i,
+            "dataloader": self.dataloader.state_dict(),
+            "mixed_precision": self.mixed_precision.state_dict(),
             "best_valid_value_accuracy": self.best_valid_value_accuracy,
             "best_valid_equ_accuracy": self.best_valid_equ_accuracy,
             "best_test_value_accuracy": self.best_test_value_accuracy,
@@ -562,6 +529,8 @@ class TreeLSTMTrainer(AbstractTrainer):
         self.node_generater_scheduler.load_state_dict(check_pnt["generate_scheduler"])
         # other parameter
         self.start_epoch = check_pnt["start_epoch"]
+        self._load_dataloader_state(check_pnt)
+        self._load_mixed_precision_state(check_pnt)
         self.best_valid_value_accuracy = check_pnt["best_valid_value_accuracy"]
         self.best_valid_equ_accuracy = check_pnt["best_valid_equ_accuracy"]
         self.best_test_value_accuracy = check_pnt["best_test_value_accuracy"]
@@ -574,31 +543,24 @@ class TreeLSTMTrainer(AbstractTrainer):
         self.decoder_scheduler.step()
         self.node_generater_scheduler.step()
 
-    def _optimizer_step(self):
-        self.embedder_optimizer.step()
-        self.encoder_optimizer.step()
-        self.decoder_optimizer.step()
-        self.node_generater_optimizer.step()
+    def _optimizers(self):
+        return [self.embedder_optimizer, self.encoder_optimizer, self.decoder_optimizer, self.node_generater_optimizer]
 
     def _train_batch(self, batch):
         batch_loss = self.model.calculate_loss(batch)
         return batch_loss
 
     def _eval_batch(self, batch):
-        test_out, target = self.model.model_test(batch)
-
-        batch_size = len(test_out)
-        val_acc = []
-        equ_acc = []
-        for idx in range(batch_size):
-            if self.config["task_type"] == TaskType.SingleEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result(test_out[idx], target[idx])
-            elif self.config["task_type"] == TaskType.MultiEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result_multi(test_out[idx], target[idx])
-            else:
-                raise NotImplementedError
-            val_acc.append(val_ac)
-            equ_acc.append(equ_ac)
+        test_out, target = self._test_outputs(batch)
+
+        if self.config["task_type"] == TaskType.SingleEquation:
+            val_acc, equ_acc = self.evaluator.result_batch(test_out, target)
+        elif self.config["task_type"] == TaskType.MultiEquation:
+            results = self.evaluator.result_multi_batch(test_out, target)
+            val_acc = [result[0] for result in results]
+            equ_acc = [result[1] for result in results]
+        else:
+            raise NotImplementedError
         return val_acc, equ_acc
 
     def _train_epoch(self):
@@ -607,10 +569,9 @@ class TreeLSTMTrainer(AbstractTrainer):
         self.model.train()
         for batch_idx, batch in enumerate(self.dataloader.load_data(DatasetType.Train)):
             self.batch_idx = batch_idx + 1
-            self.model.zero_grad()
-            batch_loss = self._train_batch(batch)
+            batch_loss = self._train_step(batch)
             loss_total += batch_loss
-            self._optimizer_step()
+        self._finish_train_epoch()
         epoch_time_cost = time_since(time.time() - epoch_start_time)
         return loss_total, epoch_time_cost
 
@@ -629,35 +590,10 @@ class TreeLSTMTrainer(AbstractTrainer):
             self.logger.info("epoch [%3d] avr loss [%2.8f] | train time %s"\
                                 %(self.epoch_i,loss_total/self.train_batch_nums,train_time_cost))
 
-            if epo % self.test_step == 0 or epo > epoch_nums - 5:
-                if self.config["k_fold"]:
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if test_val_ac >= self.best_test_value_accuracy:
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
-                else:
-                    valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
-
-                    self.logger.info("---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s"\
-                                    %(valid_total,valid_equ_ac,valid_val_ac,valid_time_cost))
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if valid_val_ac >= self.best_valid_value_accuracy:
-                        self.best_valid_value_accuracy = valid_val_ac
-                        self.best_valid_equ_accuracy = valid_equ_ac
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
+            self._evaluate_epoch(epo, epoch_nums)
             if epo % 5 == 0:
                 self._save_checkpoint()
+        self._finish_evaluation()
         self.logger.info('''training finished.
                             best valid result: equation accuracy [%2.3f] | value accuracy [%2.3f]
                             best test result : equation accuracy [%2.3f] | value accuracy [%2.3f]'''\
@@ -670,8 +606,7 @@ class TreeLSTMTrainer(AbstractTrainer):
         equation_ac = 0
         eval_total = 0
         test_start_time = time.time()
-        for batch in self.dataloader.load_data(eval_set):
-            batch_val_ac, batch_equ_ac = self._eval_batch(batch)
+        for batch_val_ac, batch_equ_ac in self._eval_results(eval_set):
             value_ac += batch_val_ac.count(True)
             equation_ac += batch_equ_ac.count(True)
             eval_total += len(batch_val_ac)
@@ -687,8 +622,7 @@ class TreeLSTMTrainer(AbstractTrainer):
         eval_total = 0
         test_start_time = time.time()
 
-        for batch in self.dataloader.load_data(DatasetType.Test):
-            batch_val_ac, batch_equ_ac = self._eval_batch(batch)
+        for batch_val_ac, batch_equ_ac in self._eval_results(DatasetType.Test):
             value_ac += batch_val_ac.count(True)
             equation_ac += batch_equ_ac.count(True)
             eval_total += len(batch_val_ac)
@@ -710,35 +644,33 @@ class SAUSolverTrainer(GTSTrainer):
 
     def _eval_batch(self, batch):
         try:
-            test_out, target = self.model.model_test(batch)
+            test_out, target = self._test_outputs(batch)
         except:
             print(batch['id'])
 
-        batch_size = len(test_out)
-        val_acc = []
-        equ_acc = []
-        for idx in range(batch_size):
-            if self.config["task_type"] == TaskType.SingleEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result(test_out[idx], target[idx])
-            elif self.config["task_type"] == TaskType.MultiEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result_multi(test_out[idx], target[idx])
-            else:
-                raise NotImplementedError
-            val_acc.append(val_ac)
-            equ_acc.append(equ_ac)
+        if self.config["task_type"] == TaskType.SingleEquation:
+            val_acc, equ_acc = self.evaluator.result_batch(test_out, target)
+        elif self.config["task_type"] == TaskType.MultiEquation:
+            results = self.evaluator.result_multi_batch(test_out, target)
+            val_acc = [result[0] for result in results]
+            equ_acc = [result[1] for result in results]
+        else:
+            raise NotImplementedError
         return val_acc, equ_acc
 
 
 class TRNNTrainer(SupervisedTrainer):
     def __init__(self, config, model, dataloader, evaluator):
         super().__init__(config, model, dataloader, evaluator)
+        # both stages step the same optimizer every batch, gradients of a stage can not be accumulated
+        refuse_mixed_precision(type(self).__name__, accumulation_steps=config["accumulation_steps"])
 
         self._build_optimizer()
         if config["resume"]:
             self._load_checkpoint()
 
     def _build_optimizer(self):
-        self.optimizer = torch.optim.Adam(self.model.parameters(),self.config["learning_rate"])
+        self.optimizer = torch.optim.Adam(self.model.parameters(),self.config["learning_rate"], **adam_options(self.config["device"]))
         # self.seq2seq_optimizer = torch.optim.Adam(
         #     [
         #         {'params': self.model.seq2seq_in_embedder.parameters()}, \
@@ -812,9 +744,10 @@ class TRNNTrainer(SupervisedTrainer):
             self.model.answer_in_embedder.eval()
             self.model.answer_encoder.eval()
             self.model.answer_rnn.eval()
-            self.model.zero_grad()
-            batch_seq2seq_loss = self._train_seq2seq_batch(batch)
-            self.optimizer.step()
+            self.mixed_precision.begin(self.model)
+            with self.mixed_precision.autocast():
+                batch_seq2seq_loss = self._train_seq2seq_batch(batch)
+            self.mixed_precision.end(self._optimizers())
             # second stage
             self.model.seq2seq_in_embedder.eval()
             self.model.seq2seq_out_embedder.eval()
@@ -824,13 +757,14 @@ class TRNNTrainer(SupervisedTrainer):
             self.model.answer_in_embedder.train()
             self.model.answer_encoder.train()
             self.model.answer_rnn.train()
-            self.model.zero_grad()
-            batch_ans_module_loss = self._train_ans_batch(batch)
+            self.mixed_precision.begin(self.model)
+            with self.mixed_precision.autocast():
+                batch_ans_module_loss = self._train_ans_batch(batch)
             loss_total_seq2seq += batch_seq2seq_loss
             loss_total_ans_module += batch_ans_module_loss
             #self.seq2seq_optimizer.step()
             #self.answer_module_optimizer.step()
-            self.optimizer.step()
+            self.mixed_precision.end(self._optimizers())
         epoch_time_cost = time_since(time.time() - epoch_start_time)
         return loss_total_seq2seq, loss_total_ans_module, epoch_time_cost
 
@@ -849,35 +783,10 @@ class TRNNTrainer(SupervisedTrainer):
                                 %(self.epoch_i,loss_total_seq2seq/self.train_batch_nums,loss_total_ans_module/self.train_batch_nums,train_time_cost))
             self.logger.info("target wrong: {} target total: {}".format(self.model.wrong, self.dataloader.trainset_nums))
             self.model.wrong=0
-            if epo % self.test_step == 0 or epo > epoch_nums - 5:
-                if self.config["k_fold"]:
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if test_val_ac >= self.best_test_value_accuracy:
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
-                else:
-                    valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
-
-                    self.logger.info("---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s"\
-                                    %(valid_total,valid_equ_ac,valid_val_ac,valid_time_cost))
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info("---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s"\
-                                    %(test_total,test_equ_ac,test_val_ac,test_time_cost))
-
-                    if valid_val_ac >= self.best_valid_value_accuracy:
-                        self.best_valid_value_accuracy = valid_val_ac
-                        self.best_valid_equ_accuracy = valid_equ_ac
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
+            self._evaluate_epoch(epo, epoch_nums)
             if epo % 5 == 0:
                 self._save_checkpoint()
+        self._finish_evaluation()
         self.logger.info('''training finished.
                             best valid result: equation accuracy [%2.3f] | value accuracy [%2.3f]
                             best test result : equation accuracy [%2.3f] | value accuracy [%2.3f]'''\
@@ -893,10 +802,13 @@ class EPTTrainer(AbstractTrainer):
             self._load_checkpoint()
 
     def _save_checkpoint(self):
+        self._finish_evaluation()
         check_pnt = {
             "model": self.model.state_dict(),
             "optimizer": self.optimizer.state_dict(),
             "start_epoch": self.epoch_i,
+            "dataloader": self.dataloader.state_dict(),
+            "mixed_precision": self.mixed_precision.state_dict(),
             "best_valid_value_accuracy": self.best_valid_value_accuracy,
             "best_valid_equ_accuracy": self.best_valid_equ_accuracy,
             "best_test_value_accuracy": self.best_test_value_accuracy,
@@ -906,26 +818,38 @@ class EPTTrainer(AbstractTrainer):
         }
         torch.save(check_pnt, self.config["checkpoint_path"])
 
+    def _load_checkpoint(self):
+        check_pnt = torch.load(self.config["checkpoint_path"], map_location=self.config["map_location"])
+        # load parameter of model
+        self.model.load_state_dict(check_pnt["model"])
+        # load parameter of optimizer
+        self.optimizer.load_state_dict(check_pnt["optimizer"])
+        # other parameter
+        self.start_epoch = check_pnt["start_epoch"]
+        self._load_dataloader_state(check_pnt)
+        self._load_mixed_precision_state(check_pnt)
+        self.best_valid_value_accuracy = check_pnt["best_valid_value_accuracy"]
+        self.best_valid_equ_accuracy = check_pnt["best_valid_equ_accuracy"]
+        self.best_test_value_accuracy = check_pnt["best_test_value_accuracy"]
+        self.best_test_equ_accuracy = check_pnt["best_test_equ_accuracy"]
+        self.best_folds_accuracy = check_pnt["best_folds_accuracy"]
+
     def _train_batch(self, batch):
         batch_loss = self.model.calculate_loss(batch)
         return batch_loss
 
     def _eval_batch(self, batch):
         '''seq, seq_length, group_nums, target'''
-        test_out, target_out = self.model.model_test(batch)
+        test_out, target_out = self._test_outputs(batch)
         
-        batch_size = len(test_out)
-        val_acc = []
-        equ_acc = []
-        for idx in range(batch_size):
-            if self.config["task_type"] == TaskType.SingleEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result(test_out[idx], target_out[idx])
-            elif self.config["task_type"] == TaskType.MultiEquation:
-                val_ac, equ_ac, _, _ = self.evaluator.result_multi(test_out[idx], target_out[idx])
-            else:
-                raise NotImplementedError
-            val_acc.append(val_ac)
-            equ_acc.append(equ_ac)
+        if self.config["task_type"] == TaskType.SingleEquation:
+            val_acc, equ_acc = self.evaluator.result_batch(test_out, target_out)
+        elif self.config["task_type"] == TaskType.MultiEquation:
+            results = self.evaluator.result_multi_batch(test_out, target_out)
+            val_acc = [result[0] for result in results]
+            equ_acc = [result[1] for result in results]
+        else:
+            raise NotImplementedError
         return val_acc, equ_acc
 
     def _train_epoch(self):
@@ -934,11 +858,9 @@ class EPTTrainer(AbstractTrainer):
         self.model.train()
         for batch_idx, batch in enumerate(self.dataloader.load_data(DatasetType.Train)):
             self.batch_idx = batch_idx + 1
-            self.model.zero_grad()
-            batch_loss = self._train_batch(batch)
+            batch_loss = self._train_step(batch)
             loss_total += batch_loss
-            self.optimizer.step()
-            
+        self._finish_train_epoch()
         epoch_time_cost = time_since(time.time() - epoch_start_time)
         return loss_total, epoch_time_cost
 
@@ -956,38 +878,10 @@ class EPTTrainer(AbstractTrainer):
             self.logger.info("epoch [%3d] avr loss [%2.8f] | train time %s" \
                              % (self.epoch_i, loss_total / self.train_batch_nums, train_time_cost))
 
-            if epo % self.test_step == 0 or epo > epoch_nums - 5:
-                if self.config["k_fold"]:
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info(
-                        "---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s" \
-                        % (test_total, test_equ_ac, test_val_ac, test_time_cost))
-
-                    if test_val_ac >= self.best_test_value_accuracy:
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
-                else:
-                    valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
-
-                    self.logger.info(
-                        "---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s" \
-                        % (valid_total, valid_equ_ac, valid_val_ac, valid_time_cost))
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info(
-                        "---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s" \
-                        % (test_total, test_equ_ac, test_val_ac, test_time_cost))
-
-                    if valid_val_ac >= self.best_valid_value_accuracy:
-                        self.best_valid_value_accuracy = valid_val_ac
-                        self.best_valid_equ_accuracy = valid_equ_ac
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
+            self._evaluate_epoch(epo, epoch_nums)
             if epo % 5 == 0:
                 self._save_checkpoint()
+        self._finish_evaluation()
         self.logger.info('''training finished.
                             best valid result: equation accuracy [%2.3f] | value accuracy [%2.3f]
                             best test result : equation accuracy [%2.3f] | value accuracy [%2.3f]''' \
@@ -1001,8 +895,7 @@ class EPTTrainer(AbstractTrainer):
         eval_total = 0
         test_start_time = time.time()
 
-        for batch in self.dataloader.load_data(eval_set):
-            batch_val_ac, batch_equ_ac = self._eval_batch(batch)
+        for batch_val_ac, batch_equ_ac in self._eval_results(eval_set):
             value_ac += batch_val_ac.count(True)
             equation_ac += batch_equ_ac.count(True)
             eval_total += len(batch_val_ac)
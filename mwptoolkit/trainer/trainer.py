@@ -4,6 +4,7 @@ from logging import getLogger
 from torch import nn
 import numpy as np
 from mwptoolkit.utils.utils import time_since
+from mwptoolkit.utils.mixed_precision import refuse_mixed_precision
 from mwptoolkit.utils.enum_type import PAD_TOKEN, DatasetType,TaskType,SpecialTokens
 from mwptoolkit.loss.masked_cross_entropy_loss import MaskedCrossEntropyLoss
 from mwptoolkit.loss.nll_loss import NLLLoss
@@ -22,6 +23,7 @@ class AbstractTrainer(object):
         self.logger = getLogger()
         self.best_folds_accuracy=config["best_folds_accuracy"]
         self.test_step=config["test_step"]
+        refuse_mixed_precision(type(self).__name__, config["precision"], config["accumulation_steps"])
 
         self.best_valid_equ_accuracy = 0.
         self.best_valid_value_accuracy = 0.
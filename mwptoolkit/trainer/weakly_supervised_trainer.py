@@ -1,12 +1,16 @@
+import os
 from logging import getLogger
 
+import numpy as np
 import torch
 import time
 
 from mwptoolkit.trainer.abstract_trainer import AbstractTrainer
 from mwptoolkit.trainer.supervised_trainer import GTSTrainer, SupervisedTrainer
 from mwptoolkit.utils.enum_type import TaskType, DatasetType, SpecialTokens
-from mwptoolkit.utils.utils import time_since
+from mwptoolkit.utils.utils import time_since, copy_list, sequence_mask
+from mwptoolkit.utils.mixed_precision import refuse_mixed_precision
+from mwptoolkit.module.Strategy.candidate_buffer import CandidateBufferStore
 
 
 class GTSWeakTrainer(GTSTrainer):
@@ -17,52 +21,110 @@ class GTSWeakTrainer(GTSTrainer):
  
 
     def _build_buffer_batch(self):
-        self._buffer_batches = [[] for i in range(self.dataloader.trainset_nums)]
-        self._buffer_batches_exp = [[] for i in range(self.dataloader.trainset_nums)]
+        self._buffer_store = CandidateBufferStore(self.config["buffer_capacity"])
+
+    def _buffer_checkpoint_path(self):
+        return os.path.splitext(self.config["checkpoint_path"])[0] + "-buffer.pth"
+
+    def _save_checkpoint(self):
+        super()._save_checkpoint()
+        self._buffer_store.save(self._buffer_checkpoint_path())
+
+    def _load_checkpoint(self):
+        super()._load_checkpoint()
+        self._build_buffer_batch()
+        self._buffer_store.load(self._buffer_checkpoint_path())
    
     def _train_epoch(self):
         epoch_start_time = time.time() #
         loss_total = 0.  #
       
         self.mask_flag = False #
-        self._pos = 0 #
         self.epo_iteration = 0
         for batch_idx, batch in enumerate(self.dataloader.load_data(DatasetType.Train)):
             self.batch_idx = batch_idx + 1
             self.model.train()
-            self.model.zero_grad()
             if self.epoch_i == 1 and self.batch_idx <= 2: #
                 self.mask_flag = True
-            buffer_batches_train = self._buffer_batches[self._pos: self._pos + len(batch["ques len"])]
-            buffer_batches_train_exp = self._buffer_batches_exp[self._pos: self._pos + len(batch["ques len"])]
+            buffer_batches_train = self._buffer_store.batch(batch["id"])
+            buffer_batches_train_exp = [buffer.values() for buffer in buffer_batches_train]
             iterations, buffer_batch_new, buffer_batch_exp, batch_loss = self._train_batch(batch, buffer_batches_train, buffer_batches_train_exp)
             loss_total += batch_loss
             self.epo_iteration += iterations
-            self._buffer_batches[self._pos: self._pos + len(batch["ques len"])] = buffer_batch_new
-            self._buffer_batches_exp[self._pos: self._pos + len(batch["ques len"])] = buffer_batch_exp
-            self._pos += len(batch["ques len"])
+            self._buffer_store.update(batch["id"], buffer_batch_new)
+        self._finish_train_epoch()
         epoch_time_cost = time_since(time.time() - epoch_start_time)
         return loss_total, epoch_time_cost
 
     def _train_batch(self, batch, buffer_batches_train, buffer_batches_train_exp):
-        optimizer = {
-            "embedder_optimizer": self.embedder_optimizer,
-            "encoder_optimizer": self.encoder_optimizer,
-            "decoder_optimizer": self.decoder_optimizer,
-            "node_generater_optimizer": self.node_generater_optimizer,
-            "merge_optimizer": self.merge_optimizer
-        }
-        num_iteration, buffer_batch_new, buffer_batch_exp, batch_loss = self.model.weakly_train(batch, buffer_batches_train, buffer_batches_train_exp, self.dataloader, self.epoch_i - 1, 
-        self.mask_flag, self.supervising_mode, optimizer)
+        r"""search fixes of a batch and train on them in mini batches of `mapo_batch_size` fixes.
+        """
+        unk = self.dataloader.out_unk_token
+        num_start = self.dataloader.dataset.num_start
+        generate_nums = [self.dataloader.dataset.out_symbol2idx[symbol] for symbol in self.dataloader.dataset.generate_list]
+        fix_input_length, fix_target_list, \
+        fix_index, fix_target_length, \
+        buffer_batch_new, buffer_batch_exp = self.model.weakly_train(batch["question"], batch["ques len"], batch['ans'],
+                                                                     batch["num list"], batch["num size"],
+                                                                     generate_nums, batch["num pos"], num_start,
+                                                                     batch["equation"], batch["equ len"],
+                                                                     self.epoch_i - 1, self.mask_flag, unk,
+                                                                     self.supervising_mode,
+                                                                     buffer_batches_train, buffer_batches_train_exp,
+                                                                     Lang=self.dataloader, n_step=50)
+        # fixes are sorted by length of question, longest first
+        inds = np.argsort(-np.array(fix_input_length, dtype=np.int64), kind="stable")
+        fix_target_list = [fix_target_list[i] for i in inds]
+        fix_index = [fix_index[i] for i in inds]
+        fix_target_length = [fix_target_length[i] for i in inds]
+
+        mapo_batch_size = 64
+        num_iteration = (len(fix_target_list) + mapo_batch_size - 1) // mapo_batch_size
+        batch_loss = 0.
+        for j in range(num_iteration):
+            idx_list = fix_index[j * mapo_batch_size:(j + 1) * mapo_batch_size]
+            target_list = fix_target_list[j * mapo_batch_size:(j + 1) * mapo_batch_size]
+            target_length_mapo = fix_target_length[j * mapo_batch_size:(j + 1) * mapo_batch_size]
+            input_length_mapo = [int(batch["ques len"][idx]) for idx in idx_list]
+            num_pos_mapo = [batch["num pos"][idx] for idx in idx_list]
+            num_size_mapo = [batch["num size"][idx] for idx in idx_list]
+            num_stack_mapo = [copy_list(batch["num stack"][idx]) for idx in idx_list]
+            input_var_mapo = batch["question"][idx_list][:, :max(input_length_mapo)]
+            target = torch.zeros((len(idx_list), max(target_length_mapo)), dtype=torch.long)
+            for k, fix in enumerate(target_list):
+                target[k][:target_length_mapo[k]] = torch.LongTensor(fix)
+            target = target.to(self.config["device"])
+
+            # every mini batch of fixes is a micro-batch of mixed precision training
+            self.model.train()
+            self.mixed_precision.begin(self.model)
+            with self.mixed_precision.autocast():
+                output, target = self.model(input_var_mapo, input_length_mapo, num_stack_mapo, num_size_mapo,
+                                            generate_nums, num_pos_mapo, num_start, target=target,
+                                            target_length=target_length_mapo, UNK_TOKEN=unk)
+                # sequence_mask marks padding, the loss is masked by valid positions
+                target_mask_mapo = ~sequence_mask(target_length_mapo, device=self.config["device"])
+                self.model.loss.reset()
+                self.model.loss.eval_batch(output, target, target_mask_mapo)
+                self.model.loss.backward()
+            self.mixed_precision.end(self._optimizers())
+            batch_loss += self.model.loss.get_loss()
+        batch_loss = batch_loss if num_iteration == 0 else batch_loss / num_iteration
         return num_iteration, buffer_batch_new, buffer_batch_exp, batch_loss
-    
+
+    def param_search(self, checkpoint_dir=None, reporter=None, stop_epoch=None):
+        if getattr(self, "_buffer_store", None) is None:
+            self._build_buffer_batch()
+        super().param_search(checkpoint_dir, reporter, stop_epoch)
+
     def fit(self):
         train_batch_size = self.config["train_batch_size"]
         epoch_nums = self.config["epoch_nums"]
         self.train_batch_nums = int(self.dataloader.trainset_nums / train_batch_size) + 1
 
         self.logger.info("start training...")
-        self._build_buffer_batch()
+        if getattr(self, "_buffer_store", None) is None:
+            self._build_buffer_batch()
         for epo in range(self.start_epoch, epoch_nums): #
             self.epoch_i = epo + 1
             self.model.train()
@@ -72,38 +134,10 @@ class GTSWeakTrainer(GTSTrainer):
             self.logger.info("epoch [%3d] avr loss [%2.8f] | train time %s" \
                             % (self.epoch_i, loss_total / self.train_batch_nums, train_time_cost))
 
-            if epo % self.test_step == 0 or epo > epoch_nums - 5:
-                if self.config["k_fold"]:
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info(
-                        "---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s" \
-                        % (test_total, test_equ_ac, test_val_ac, test_time_cost))
-
-                    if test_val_ac >= self.best_test_value_accuracy:
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
-                else:
-                    valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
-
-                    self.logger.info(
-                        "---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s" \
-                        % (valid_total, valid_equ_ac, valid_val_ac, valid_time_cost))
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info(
-                        "---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s" \
-                        % (test_total, test_equ_ac, test_val_ac, test_time_cost))
-
-                    if valid_val_ac >= self.best_valid_value_accuracy:
-                        self.best_valid_value_accuracy = valid_val_ac
-                        self.best_valid_equ_accuracy = valid_equ_ac
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
+            self._evaluate_epoch(epo, epoch_nums)
             if epo % 5 == 0:
                 self._save_checkpoint()
+        self._finish_evaluation()
         self.logger.info('''training finished.
                             best valid result: equation accuracy [%2.3f] | value accuracy [%2.3f]
                             best test result : equation accuracy [%2.3f] | value accuracy [%2.3f]''' \
@@ -114,20 +148,32 @@ class GTSWeakTrainer(GTSTrainer):
 class WeaklySupervisedTrainer(SupervisedTrainer):
     def __init__(self, config, model, dataloader, evaluator):
         super().__init__(config, model, dataloader, evaluator)
+        # the model steps the optimizer inside weakly_train
+        refuse_mixed_precision(type(self).__name__, config["precision"], config["accumulation_steps"])
         self.supervising_mode = config["supervising_mode"]
         self._build_optimizer()
  
 
     def _build_buffer_batch(self):
-        self._buffer_batches = [[] for i in range(self.dataloader.trainset_nums)]
-        self._buffer_batches_exp = [[] for i in range(self.dataloader.trainset_nums)]
+        self._buffer_store = CandidateBufferStore(self.config["buffer_capacity"])
+
+    def _buffer_checkpoint_path(self):
+        return os.path.splitext(self.config["checkpoint_path"])[0] + "-buffer.pth"
+
+    def _save_checkpoint(self):
+        super()._save_checkpoint()
+        self._buffer_store.save(self._buffer_checkpoint_path())
+
+    def _load_checkpoint(self):
+        super()._load_checkpoint()
+        self._build_buffer_batch()
+        self._buffer_store.load(self._buffer_checkpoint_path())
    
     def _train_epoch(self):
         epoch_start_time = time.time() #
         loss_total = 0.  #
       
         self.mask_flag = False #
-        self._pos = 0 #
         self.epo_iteration = 0
         for batch_idx, batch in enumerate(self.dataloader.load_data(DatasetType.Train)):
             self.batch_idx = batch_idx + 1
@@ -135,14 +181,12 @@ class WeaklySupervisedTrainer(SupervisedTrainer):
             self.model.zero_grad()
             if self.epoch_i == 1 and self.batch_idx <= 2: #
                 self.mask_flag = True
-            buffer_batches_train = self._buffer_batches[self._pos: self._pos + len(batch["ques len"])]
-            buffer_batches_train_exp = self._buffer_batches_exp[self._pos: self._pos + len(batch["ques len"])]
+            buffer_batches_train = self._buffer_store.batch(batch["id"])
+            buffer_batches_train_exp = [buffer.values() for buffer in buffer_batches_train]
             iterations, buffer_batch_new, buffer_batch_exp, batch_loss = self._train_batch(batch, buffer_batches_train, buffer_batches_train_exp)
             loss_total += batch_loss
             self.epo_iteration += iterations
-            self._buffer_batches[self._pos: self._pos + len(batch["ques len"])] = buffer_batch_new
-            self._buffer_batches_exp[self._pos: self._pos + len(batch["ques len"])] = buffer_batch_exp
-            self._pos += len(batch["ques len"])
+            self._buffer_store.update(batch["id"], buffer_batch_new)
         epoch_time_cost = time_since(time.time() - epoch_start_time)
         return loss_total, epoch_time_cost
 
@@ -152,13 +196,19 @@ class WeaklySupervisedTrainer(SupervisedTrainer):
         self.mask_flag, self.supervising_mode, optimizer)
         return num_iteration, buffer_batch_new, buffer_batch_exp, batch_loss
     
+    def param_search(self, checkpoint_dir=None, reporter=None, stop_epoch=None):
+        if getattr(self, "_buffer_store", None) is None:
+            self._build_buffer_batch()
+        super().param_search(checkpoint_dir, reporter, stop_epoch)
+
     def fit(self):
         train_batch_size = self.config["train_batch_size"]
         epoch_nums = self.config["epoch_nums"]
         self.train_batch_nums = int(self.dataloader.trainset_nums / train_batch_size) + 1
 
         self.logger.info("start training...")
-        self._build_buffer_batch()
+        if getattr(self, "_buffer_store", None) is None:
+            self._build_buffer_batch()
         for epo in range(self.start_epoch, epoch_nums): #
             self.epoch_i = epo + 1
             self.model.train()
@@ -167,38 +217,10 @@ class WeaklySupervisedTrainer(SupervisedTrainer):
             self.logger.info("epoch [%3d] avr loss [%2.8f] | train time %s" \
                             % (self.epoch_i, loss_total / self.train_batch_nums, train_time_cost))
 
-            if epo % self.test_step == 0 or epo > epoch_nums - 5:
-                if self.config["k_fold"]:
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info(
-                        "---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s" \
-                        % (test_total, test_equ_ac, test_val_ac, test_time_cost))
-
-                    if test_val_ac >= self.best_test_value_accuracy:
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
-                else:
-                    valid_equ_ac, valid_val_ac, valid_total, valid_time_cost = self.evaluate(DatasetType.Valid)
-
-                    self.logger.info(
-                        "---------- valid total [%d] | valid equ acc [%2.3f] | valid value acc [%2.3f] | valid time %s" \
-                        % (valid_total, valid_equ_ac, valid_val_ac, valid_time_cost))
-                    test_equ_ac, test_val_ac, test_total, test_time_cost = self.evaluate(DatasetType.Test)
-
-                    self.logger.info(
-                        "---------- test total [%d] | test equ acc [%2.3f] | test value acc [%2.3f] | test time %s" \
-                        % (test_total, test_equ_ac, test_val_ac, test_time_cost))
-
-                    if valid_val_ac >= self.best_valid_value_accuracy:
-                        self.best_valid_value_accuracy = valid_val_ac
-                        self.best_valid_equ_accuracy = valid_equ_ac
-                        self.best_test_value_accuracy = test_val_ac
-                        self.best_test_equ_accuracy = test_equ_ac
-                        self._save_model()
+            self._evaluate_epoch(epo, epoch_nums)
             if epo % 5 == 0:
                 self._save_checkpoint()
+        self._finish_evaluation()
         self.logger.info('''training finished.
                             best valid result: equation accuracy [%2.3f] | value accuracy [%2.3f]
                             best test result : equation accuracy [%2.3f] | value accuracy [%2.3f]''' \
@@ -1,6 +1,231 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
 from mwptoolkit.utils.enum_type import SpecialTokens, NumMask
 
 
+class StackNode():
+    __slots__ = ('value', 'next')
+
+    def __init__(self, value, next=None):
+        self.value = value
+        self.next = next
+
+
+class PersistentStack():
+    r"""list-like stack on immutable linked nodes.
+
+    append and pop only move the head of this stack, nodes are never modified, so a copy
+    shares all nodes with the stack and costs O(1), pushing or popping one never changes the other.
+    """
+    __slots__ = ('head', 'size')
+
+    def __init__(self, items=None):
+        self.head = None
+        self.size = 0
+        if items is not None:
+            for item in items:
+                self.append(item)
+
+    def append(self, value):
+        self.head = StackNode(value, self.head)
+        self.size += 1
+
+    def pop(self):
+        if self.head is None:
+            raise IndexError("pop from empty stack")
+        value = self.head.value
+        self.head = self.head.next
+        self.size -= 1
+        return value
+
+    def copy(self):
+        stack = PersistentStack()
+        stack.head = self.head
+        stack.size = self.size
+        return stack
+
+    def _node(self, index):
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError("stack index out of range")
+        node = self.head
+        for _ in range(self.size - 1 - index):
+            node = node.next
+        return node
+
+    def __getitem__(self, index):
+        return self._node(index).value
+
+    def __setitem__(self, index, value):
+        # only the top can be replaced without touching shared nodes
+        if index != -1 and index != self.size - 1:
+            raise IndexError("only the top of stack can be assigned")
+        self._node(index)
+        self.head = StackNode(value, self.head.next)
+
+    def __len__(self):
+        return self.size
+
+    def __reversed__(self):
+        node = self.head
+        while node is not None:
+            yield node.value
+            node = node.next
+
+    def __iter__(self):
+        return iter(list(reversed(self))[::-1])
+
+    def __repr__(self):
+        return "PersistentStack({})".format(list(self))
+
+
+class RaggedArray():
+    r"""variable-length sequences stored in one flat numpy array with offsets.
+
+    Args:
+        sequences (list): sequences of items, an item is a scalar or a list of `width` scalars.
+        width (int|None): length of items if items are lists.
+        dtype: numpy data type of items.
+    """
+    def __init__(self, sequences, width=None, dtype=np.int64):
+        lengths = [len(seq) for seq in sequences]
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        item_shape = () if width is None else (width,)
+        flat = [item for seq in sequences for item in seq]
+        self.data = np.array(flat, dtype=dtype).reshape((len(flat),) + item_shape)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def length(self, index):
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def pad(self, indices, pad_value, max_length=None):
+        r"""pad sequences of indices into one array.
+
+        Returns:
+            numpy.ndarray: shape [len(indices), max_length] + item shape.
+        """
+        if max_length is None:
+            max_length = max([self.length(i) for i in indices] + [0])
+        padded = np.full((len(indices), max_length) + self.data.shape[1:], pad_value, dtype=self.data.dtype)
+        for b, i in enumerate(indices):
+            seq = self[i][:max_length]
+            padded[b, :len(seq)] = seq
+        return padded
+
+
+class RecordArray():
+    r"""read-only sequence of dataset records (dicts) stored column-wise in numpy arrays, a record is decoded on access.
+
+    fields which are lists of strings in every record are stored as ids of a string table, the other fields
+    of a record are pickled together. saved arrays are loaded memory-mapped by `load`.
+
+    Args:
+        records (list): list of dicts.
+    """
+    def __init__(self, records=None):
+        self.path = None
+        if records is None:
+            return
+        columns = []
+        if len(records) > 0:
+            for key in records[0]:
+                if all(type(r.get(key)) == list and all(type(v) == str for v in r[key]) for r in records):
+                    columns.append(key)
+        string_ids = {}
+        self.columns = columns
+        self._column_data = []
+        for key in columns:
+            sequences = [[string_ids.setdefault(v, len(string_ids)) for v in r[key]] for r in records]
+            ragged = RaggedArray(sequences, dtype=np.int32)
+            self._column_data.append((ragged.data, ragged.offsets))
+        self._strings = list(string_ids)
+        blobs = [pickle.dumps({k: v for k, v in r.items() if k not in columns}, protocol=pickle.HIGHEST_PROTOCOL) for r in records]
+        self._rest_offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in blobs], out=self._rest_offsets[1:])
+        self._rest_data = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._rest_offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("record index out of range")
+        start, end = self._rest_offsets[index], self._rest_offsets[index + 1]
+        record = pickle.loads(self._rest_data[start:end].tobytes())
+        for key, (data, offsets) in zip(self.columns, self._column_data):
+            ids = data[offsets[index]:offsets[index + 1]].tolist()
+            record[key] = [self._strings[i] for i in ids]
+        return record
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def save(self, path):
+        r"""write arrays as .npy files into directory `path`.
+        """
+        os.makedirs(path, exist_ok=True)
+        strings = [s.encode('utf-8') for s in self._strings]
+        string_offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in strings], out=string_offsets[1:])
+        np.save(os.path.join(path, 'strings_data.npy'), np.frombuffer(b''.join(strings), dtype=np.uint8))
+        np.save(os.path.join(path, 'strings_offsets.npy'), string_offsets)
+        np.save(os.path.join(path, 'rest_data.npy'), self._rest_data)
+        np.save(os.path.join(path, 'rest_offsets.npy'), self._rest_offsets)
+        for idx, (data, offsets) in enumerate(self._column_data):
+            np.save(os.path.join(path, 'column{}_data.npy'.format(idx)), data)
+            np.save(os.path.join(path, 'column{}_offsets.npy'.format(idx)), offsets)
+        with open(os.path.join(path, 'columns.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.columns, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        r"""load records saved by `save`, arrays are memory-mapped read-only.
+        """
+        array = cls()
+        array.path = path
+        with open(os.path.join(path, 'columns.json'), 'r', encoding='utf-8') as f:
+            array.columns = json.load(f)
+        strings_data = np.load(os.path.join(path, 'strings_data.npy'), mmap_mode='r')
+        string_offsets = np.load(os.path.join(path, 'strings_offsets.npy')).tolist()
+        strings_bytes = strings_data.tobytes()
+        array._strings = [strings_bytes[string_offsets[i]:string_offsets[i + 1]].decode('utf-8') for i in range(len(string_offsets) - 1)]
+        array._rest_data = np.load(os.path.join(path, 'rest_data.npy'), mmap_mode='r')
+        array._rest_offsets = np.load(os.path.join(path, 'rest_offsets.npy'), mmap_mode='r')
+        array._column_data = []
+        for idx in range(len(array.columns)):
+            data = np.load(os.path.join(path, 'column{}_data.npy'.format(idx)), mmap_mode='r')
+            offsets = np.load(os.path.join(path, 'column{}_offsets.npy'.format(idx)), mmap_mode='r')
+            array._column_data.append((data, offsets))
+        return array
+
+    def __getstate__(self):
+        if self.path is not None:
+            return {'path': self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if set(state) == {'path'}:
+            self.__dict__.update(RecordArray.load(state['path']).__dict__)
+        else:
+            self.__dict__.update(state)
+
+
 class Node():
     def __init__(self, node_value, isleaf=True):
         self.node_value = node_value
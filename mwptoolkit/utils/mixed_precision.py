@@ -0,0 +1,152 @@
+import inspect
+from contextlib import contextmanager
+
+import torch
+
+
+def _grad_scaler(enabled):
+    if hasattr(torch, "amp") and hasattr(torch.amp, "GradScaler"):
+        return torch.amp.GradScaler("cuda", enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+_fused_adam_devices = {}
+
+
+def _fused_adam_supported(device_type):
+    if device_type not in _fused_adam_devices:
+        try:
+            torch.optim.Adam([torch.zeros(1, device=device_type, requires_grad=True)], fused=True)
+            _fused_adam_devices[device_type] = True
+        except:
+            _fused_adam_devices[device_type] = False
+    return _fused_adam_devices[device_type]
+
+
+def adam_options(device):
+    r"""keyword arguments of torch.optim.Adam stepped by MixedPrecision, fused kernels if torch has them for device.
+
+    a fused optimizer is stepped in one kernel instead of a loop over parameters, and GradScaler steps it
+    without synchronizing on its inf check, so stepping the optimizers of every module stays cheap.
+    """
+    device_type = torch.device(device).type if device is not None else "cpu"
+    if "fused" in inspect.signature(torch.optim.Adam.__init__).parameters and _fused_adam_supported(device_type):
+        return {"fused": True}
+    if device_type == "cuda":
+        return {"foreach": True}
+    return {}
+
+
+def refuse_mixed_precision(trainer_name, precision=None, accumulation_steps=None):
+    r"""raise ValueError for a trainer whose training loop does not run `precision` or `accumulation_steps`.
+    """
+    if precision not in (None, "fp32", "float32"):
+        raise ValueError("{} does not support precision {}, train it in fp32.".format(trainer_name, precision))
+    if accumulation_steps is not None and int(accumulation_steps) > 1:
+        raise ValueError("{} does not support accumulation_steps > 1.".format(trainer_name))
+
+
+class MixedPrecision(object):
+    r"""autocast, loss scaling and gradient accumulation of a training loop.
+
+    a training step is run as micro-batches, gradients of `accumulation_steps` micro-batches are summed
+    before all optimizers are stepped together. losses are divided by `accumulation_steps` and, for fp16
+    on cuda, scaled by a shared GradScaler when they are back propagated with `backward`.
+
+    Args:
+        device (torch.device|str): device of model.
+        precision (str|None): "bf16" or "fp16" to run forward under autocast of that dtype, float32 if None.
+        accumulation_steps (int|None): number of micro-batches per optimizer step.
+    """
+    _active = None
+
+    def __init__(self, device, precision=None, accumulation_steps=1):
+        super().__init__()
+        self.device_type = torch.device(device).type if device is not None else "cpu"
+        if precision in (None, "fp32", "float32"):
+            self.dtype = None
+        elif precision in ("bf16", "bfloat16"):
+            self.dtype = torch.bfloat16
+        elif precision in ("fp16", "float16"):
+            self.dtype = torch.float16
+        else:
+            raise ValueError("precision should be one of 'fp32', 'bf16' and 'fp16', not {}".format(precision))
+        self.scaler = _grad_scaler(self.dtype == torch.float16 and self.device_type == "cuda")
+        self.accumulation_steps = max(1, int(accumulation_steps or 1))
+        self.micro_batches = 0
+
+    @contextmanager
+    def autocast(self):
+        r"""run forward of a micro-batch under autocast, losses back propagated inside by `backward` are scaled
+        by this loop and back propagated with autocast disabled.
+        """
+        MixedPrecision._active = self
+        try:
+            with torch.autocast(self.device_type, dtype=self.dtype, enabled=self.dtype is not None):
+                yield
+        finally:
+            MixedPrecision._active = None
+
+    def scale_loss(self, loss):
+        if self.accumulation_steps > 1:
+            loss = loss / self.accumulation_steps
+        return self.scaler.scale(loss)
+
+    def begin(self, model):
+        r"""clear gradients of model at the first micro-batch of a step.
+        """
+        if self.micro_batches == 0:
+            model.zero_grad()
+
+    def end(self, optimizers):
+        r"""count a finished micro-batch, step optimizers if `accumulation_steps` micro-batches are done.
+
+        Returns:
+            bool: True if optimizers were stepped.
+        """
+        self.micro_batches += 1
+        if self.micro_batches < self.accumulation_steps:
+            return False
+        self.step(optimizers)
+        return True
+
+    def flush(self, optimizers):
+        r"""step optimizers with gradients of micro-batches left, e.g. at the end of an epoch.
+        """
+        if self.micro_batches == 0:
+            return False
+        self.step(optimizers)
+        return True
+
+    def state_dict(self):
+        return {"scaler": self.scaler.state_dict(), "micro_batches": self.micro_batches}
+
+    def load_state_dict(self, state_dict):
+        # a disabled scaler has an empty state
+        if state_dict["scaler"] and self.scaler.is_enabled():
+            self.scaler.load_state_dict(state_dict["scaler"])
+        self.micro_batches = state_dict["micro_batches"]
+
+    def step(self, optimizers):
+        r"""step optimizers with unscaled gradients and update the loss scale once, optimizers built with
+        `adam_options` are stepped without synchronizing.
+        """
+        for optimizer in optimizers:
+            self.scaler.step(optimizer)
+        self.scaler.update()
+        self.micro_batches = 0
+
+
+def backward(loss):
+    r"""back propagate loss, scaled by the training loop running it if any.
+
+    models call it inside their loss computation, which runs under autocast of the training loop,
+    autocast is disabled here so that only the forward is autocast.
+    """
+    mixed_precision = MixedPrecision._active
+    if mixed_precision is None:
+        loss.backward()
+        return
+    loss = mixed_precision.scale_loss(loss)
+    with torch.autocast(mixed_precision.device_type, enabled=False):
+        loss.backward()
@@ -0,0 +1,113 @@
+import atexit
+import hashlib
+import os
+import pickle
+
+import stanza
+
+_pipelines = {}
+_parsers = {}
+
+
+def get_pipeline(language, use_gpu=True):
+    r"""get the process-wide stanza dependency parsing pipeline of language.
+    """
+    key = (language, use_gpu)
+    if key not in _pipelines:
+        _pipelines[key] = stanza.Pipeline(language, processors='depparse,tokenize,pos,lemma', tokenize_pretokenized=True, logging_level='error', use_gpu=use_gpu)
+    return _pipelines[key]
+
+
+class DependencyParser(object):
+    r"""batched dependency parsing with a shared stanza pipeline and a per-question cache.
+
+    Texts are pretokenized sentences (tokens split by spaces), every text is parsed as one sentence.
+    Parses are keyed on the digest of language and text, texts not in cache are parsed in batches.
+    New parses are written to cache_path by `save`, not by every `parse`.
+
+    Args:
+        language (str): language of stanza pipeline.
+        use_gpu (bool): run stanza pipeline on gpu.
+        cache_path (str|None): file to persist parses, parses are kept in memory only if None.
+        batch_size (int): number of texts fed to stanza pipeline at once.
+    """
+    def __init__(self, language, use_gpu=True, cache_path=None, batch_size=256):
+        super().__init__()
+        self.language = language
+        self.use_gpu = use_gpu
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self._cache = {}
+        self._dirty = False
+        if cache_path and os.path.exists(cache_path):
+            self.load()
+
+    def text_key(self, text):
+        return hashlib.md5((self.language + '\t' + text).encode('utf-8')).hexdigest()
+
+    def parse(self, texts):
+        r"""parse texts.
+
+        Args:
+            texts (list): pretokenized sentences.
+
+        Returns:
+            list: token list (stanza sentence dict) of every text.
+        """
+        keys = [self.text_key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._cache and key not in missing:
+                missing[key] = text
+        missing = list(missing.items())
+        if missing:
+            nlp = get_pipeline(self.language, self.use_gpu)
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                doc = nlp([text.split() for _, text in batch])
+                for (key, _), token_list in zip(batch, doc.to_dict()):
+                    self._cache[key] = token_list
+            self._dirty = True
+        return [self._cache[key] for key in keys]
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'rb') as f:
+                self._cache.update(pickle.load(f))
+        except:
+            pass
+
+    def save(self):
+        if not self.cache_path or not self._dirty:
+            return
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self._cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.cache_path)
+        self._dirty = False
+
+
+def get_dependency_parser(language, use_gpu=True, cache_path=None):
+    r"""get the process-wide dependency parser of language and cache_path.
+
+    one parser is shared per cache file whatever use_gpu is, so parses of all callers are saved together.
+    """
+    key = (language, cache_path)
+    if key not in _parsers:
+        _parsers[key] = DependencyParser(language, use_gpu, cache_path)
+    _parsers[key].use_gpu = use_gpu
+    return _parsers[key]
+
+
+@atexit.register
+def save_dependency_parsers():
+    r"""write new parses of all dependency parsers to their cache files.
+    """
+    for parser in _parsers.values():
+        try:
+            parser.save()
+        except:
+            pass
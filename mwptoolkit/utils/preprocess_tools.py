@@ -1,17 +1,19 @@
 import re
+import os
 import json
 import random
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from collections import OrderedDict
 from pathlib import Path
 from typing import Tuple, List, Union
 
 import nltk
-import stanza
 
 from mwptoolkit.utils.utils import read_json_data, str2float, lists2dict
 from mwptoolkit.utils.enum_type import MaskSymbol, NumMask, SpecialTokens, EPT
 from mwptoolkit.utils.data_structure import DependencyTree
+from mwptoolkit.utils.parse_service import get_dependency_parser
 
 
 def split_number(text_list):
@@ -583,6 +585,86 @@ def seg_and_tag_hmwp(st, nums_fraction, nums):  # seg the equation and tag the n
     return res
 
 
+def keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep):
+    r'''filter numbers generated in equations by their counts.
+
+    Args:
+        generate_nums: list, generated numbers in order of first appearance.
+        generate_nums_dict: dict, count of every generated number.
+        min_generate_keep: int|None, numbers appearing less than min_generate_keep times are dropped.
+            if None, return counts of all generated numbers, used to merge results of data shards.
+
+    Return:
+        list|dict: kept numbers, or ordered counts if min_generate_keep is None.
+    '''
+    if min_generate_keep is None:
+        return {g: generate_nums_dict[g] for g in generate_nums}
+    generate_number = []
+    for g in generate_nums:
+        if generate_nums_dict[g] >= min_generate_keep:
+            generate_number.append(g)
+    return generate_number
+
+
+def _transfer_shard(args):
+    transfer, shard, mask_type, transfer_args = args
+    return transfer(shard, mask_type, None, *transfer_args)
+
+
+def parallel_number_transfer(transfer, data, mask_type="number", min_generate_keep=0, *transfer_args, workers=None, shard_size=None):
+    r'''run a number transfer function (e.g. number_transfer_ape200k) over shards of data in a process pool.
+
+    Shards are processed independently and their results are streamed back in order.
+    Generated numbers and their counts are merged over all shards before filtering by min_generate_keep,
+    copy_nums is the max of shards and unknown symbols (multi equation datasets) are merged in order,
+    so outputs are the same as running transfer on the whole data.
+
+    Args:
+        transfer: function, number transfer function.
+        data: list.
+        mask_type: str, the way to mask num.
+        min_generate_keep: int, the number to control if the numbers of equations will be kept as generating number.
+        transfer_args: other arguments of transfer, e.g. equ_split_symbol.
+        workers: int|None, number of processes, run in current process if None or workers <= 1.
+        shard_size: int|None, number of records in a shard, default 4 shards per worker to balance them,
+            and at least 2000 records, smaller data is transferred in current process.
+
+    Return:
+        same as transfer.
+    '''
+    if workers is None or workers <= 1:
+        return transfer(data, mask_type, min_generate_keep, *transfer_args)
+    if shard_size is None:
+        shard_size = max(2000, -(-len(data) // (4 * workers)))
+    if len(data) <= shard_size:
+        return transfer(data, mask_type, min_generate_keep, *transfer_args)
+    if transfer in [num_transfer_alg514, num_transfer_draw]:
+        # the first generated number not in canonical form is counted once, which depends on the order of records.
+        return transfer(data, mask_type, min_generate_keep, *transfer_args)
+    tasks = [(transfer, data[i:i + shard_size], mask_type, transfer_args) for i in range(0, len(data), shard_size)]
+
+    processed_datas = []
+    generate_nums_dict = {}
+    copy_nums = 0
+    unk_symbol = None
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        for outputs in executor.map(_transfer_shard, tasks):
+            processed_datas += outputs[0]
+            for g, count in outputs[1].items():
+                generate_nums_dict[g] = generate_nums_dict.get(g, 0) + count
+            copy_nums = max(copy_nums, outputs[2])
+            if len(outputs) > 3:
+                if unk_symbol is None:
+                    unk_symbol = []
+                for s in outputs[3]:
+                    if s not in unk_symbol:
+                        unk_symbol.append(s)
+    generate_number = keep_generate_number(list(generate_nums_dict.keys()), generate_nums_dict, min_generate_keep)
+    if unk_symbol is None:
+        return processed_datas, generate_number, copy_nums
+    return processed_datas, generate_number, copy_nums, unk_symbol
+
+
 def number_transfer_math23k(data, mask_type="number", min_generate_keep=0):
     r'''transfer num process
 
@@ -707,10 +789,7 @@ def number_transfer_math23k(data, mask_type="number", min_generate_keep=0):
         new_data["number position"] = num_pos
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums
 
 
@@ -836,10 +915,7 @@ def number_transfer_ape200k(data, mask_type="number", min_generate_keep=0):
         new_data["number position"] = num_pos
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums
 
 
@@ -968,10 +1044,7 @@ def number_transfer_svamp(data, mask_type="number", min_generate_keep=0):
         new_data["ans"] = d["Answer"]
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums
 
 
@@ -1114,10 +1187,7 @@ def number_transfer_asdiv_a(data, mask_type="number", min_generate_keep=0):
         processed_datas.append(new_data)
         
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums
 
 
@@ -1263,10 +1333,7 @@ def num_transfer_alg514(data, mask_type="number", min_generate_keep=0, equ_split
         
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums, unk_symbol
 
 
@@ -1401,10 +1468,7 @@ def num_transfer_multi(data, mask_type="number", min_generate_keep=0, equ_split_
         new_data["number position"] = num_pos
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums, unk_symbol
 
 
@@ -1575,10 +1639,7 @@ def num_transfer_draw(data, mask_type="number", min_generate_keep=0, equ_split_s
             new_data["number position"] = [-1]
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums, unk_symbol
 
 
@@ -1710,10 +1771,7 @@ def num_transfer_hmwp(data, mask_type="number", min_generate_keep=0, equ_split_s
         new_data["number position"] = num_pos
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums, unk_symbol
 
 
@@ -1935,20 +1993,12 @@ def EN_rule2_(equ_list):
     return new_list
 
 
-def deprel_tree_to_file(train_datas, valid_datas, test_datas, path, language, use_gpu):
-    nlp = stanza.Pipeline(language, processors='depparse,tokenize,pos,lemma', tokenize_pretokenized=True, logging_level='error', use_gpu=use_gpu)
+def deprel_tree_to_file(train_datas, valid_datas, test_datas, path, language, use_gpu, parse_cache=None):
+    datas = train_datas + valid_datas + test_datas
+    parser = get_dependency_parser(language, use_gpu, parse_cache)
+    token_lists = parser.parse([data["ques source 1"] for data in datas])
     new_datas = []
-    for idx, data in enumerate(train_datas):
-        doc = nlp(data["ques source 1"])
-        token_list = doc.to_dict()[0]
-        new_datas.append({'id': data['id'], 'deprel': token_list})
-    for idx, data in enumerate(valid_datas):
-        doc = nlp(data["ques source 1"])
-        token_list = doc.to_dict()[0]
-        new_datas.append({'id': data['id'], 'deprel': token_list})
-    for idx, data in enumerate(test_datas):
-        doc = nlp(data["ques source 1"])
-        token_list = doc.to_dict()[0]
+    for data, token_list in zip(datas, token_lists):
         new_datas.append({'id': data['id'], 'deprel': token_list})
     write_json_data(new_datas, path)
 
@@ -2125,48 +2175,19 @@ def get_group_nums_(train_datas, valid_datas, test_datas, path):
     return train_datas, valid_datas, test_datas
 
 
-def span_level_deprel_tree_to_file(train_datas, valid_datas, test_datas, path, language, use_gpu):
-    nlp = stanza.Pipeline(language, processors='depparse,tokenize,pos,lemma', tokenize_pretokenized=True, logging_level='error')
+def span_level_deprel_tree_to_file(train_datas, valid_datas, test_datas, path, language, use_gpu, parse_cache=None):
+    datas = train_datas + valid_datas + test_datas
+    parser = get_dependency_parser(language, use_gpu, parse_cache)
+    all_sentences = [split_sentence(data["ques source 1"]) for data in datas]
+    token_lists = parser.parse([sentence for sentences in all_sentences for sentence in sentences])
     new_datas = []
-    max_span_size = 0
-    for idx, data in enumerate(train_datas):
-        sentences = split_sentence(data["ques source 1"])
-        dependency_infos = []
-        deprel_trees = []
-        for sentence in sentences:
-            dependency_info = []
-            doc = nlp(sentence)
-            token_list = doc.to_dict()[0]
-            for token in token_list:
-                deprel = token['deprel']
-                father_idx = token['head'] - 1
-                child_idx = token['id'] - 1
-                dependency_info.append([deprel, child_idx, father_idx])
-            dependency_infos.append(dependency_info)
-        new_datas.append({'id': data['id'], 'split sentences source': sentences, 'dependency info': dependency_infos})
-    for idx, data in enumerate(valid_datas):
-        sentences = split_sentence(data["ques source 1"])
-        dependency_infos = []
-        deprel_trees = []
-        for sentence in sentences:
-            dependency_info = []
-            doc = nlp(sentence)
-            token_list = doc.to_dict()[0]
-            for token in token_list:
-                deprel = token['deprel']
-                father_idx = token['head'] - 1
-                child_idx = token['id'] - 1
-                dependency_info.append([deprel, child_idx, father_idx])
-            dependency_infos.append(dependency_info)
-        new_datas.append({'id': data['id'], 'split sentences source': sentences, 'dependency info': dependency_infos})
-    for idx, data in enumerate(test_datas):
-        sentences = split_sentence(data["ques source 1"])
+    sent_idx = 0
+    for data, sentences in zip(datas, all_sentences):
         dependency_infos = []
-        deprel_trees = []
         for sentence in sentences:
             dependency_info = []
-            doc = nlp(sentence)
-            token_list = doc.to_dict()[0]
+            token_list = token_lists[sent_idx]
+            sent_idx += 1
             for token in token_list:
                 deprel = token['deprel']
                 father_idx = token['head'] - 1
@@ -2355,15 +2376,14 @@ def get_deprel_tree_(train_datas, valid_datas, test_datas, path):
     return train_datas, valid_datas, test_datas, deprel_tokens
 
 
-def get_group_nums(datas, language, use_gpu):
-    nlp = stanza.Pipeline(language, processors='depparse,tokenize,pos,lemma', tokenize_pretokenized=True, logging_level='error', use_gpu=use_gpu)
+def get_group_nums(datas, language, use_gpu, parse_cache=None):
+    parser = get_dependency_parser(language, use_gpu, parse_cache)
+    token_lists = parser.parse([data["ques source 1"] for data in datas])
     new_datas = []
-    for idx, data in enumerate(datas):
+    for data, token_list in zip(datas, token_lists):
         group_nums = []
         num_pos = data["number position"]
         sent_len = len(data["question"])
-        doc = nlp(data["ques source 1"])
-        token_list = doc.to_dict()[0]
         for n_pos in num_pos:
             pos_stack = []
             group_num = []
@@ -2422,15 +2442,14 @@ def get_group_nums(datas, language, use_gpu):
     return new_datas
 
 
-def get_deprel_tree(datas, language):
-    nlp = stanza.Pipeline(language, processors='depparse,tokenize,pos,lemma', tokenize_pretokenized=True, logging_level='error')
+def get_deprel_tree(datas, language, use_gpu, parse_cache=None):
+    parser = get_dependency_parser(language, use_gpu, parse_cache)
+    token_lists = parser.parse([data["ques source 1"] for data in datas])
     new_datas = []
     deprel_tokens = []
-    for idx, data in enumerate(datas):
+    for data, token_list in zip(datas, token_lists):
         group_nums = []
         deprel_token = []
-        doc = nlp(data["ques source 1"])
-        token_list = doc.to_dict()[0]
         length = len(data["question"])
         for idx, x in enumerate(token_list):
             token = x['deprel']
@@ -2450,12 +2469,14 @@ def get_deprel_tree(datas, language):
     return new_datas, deprel_tokens
 
 
-def get_span_level_deprel_tree(datas, language):
-    nlp = stanza.Pipeline(language, processors='depparse,tokenize,pos,lemma', tokenize_pretokenized=True, logging_level='error')
+def get_span_level_deprel_tree(datas, language, use_gpu, parse_cache=None):
+    parser = get_dependency_parser(language, use_gpu, parse_cache)
+    all_sentences = [split_sentence(data["ques source 1"]) for data in datas]
+    token_lists = parser.parse([sentence for sentences in all_sentences for sentence in sentences])
     new_datas = []
     max_span_size = 0
-    for idx, data in enumerate(datas):
-        sentences = split_sentence(data["ques source 1"])
+    sent_idx = 0
+    for data, sentences in zip(datas, all_sentences):
         masked_sentences = split_sentence(' '.join(data['question']))
         span_size = len(masked_sentences)
         if span_size > max_span_size:
@@ -2464,8 +2485,8 @@ def get_span_level_deprel_tree(datas, language):
         deprel_trees = []
         for sentence in sentences:
             dependency_info = []
-            doc = nlp(sentence)
-            token_list = doc.to_dict()[0]
+            token_list = token_lists[sent_idx]
+            sent_idx += 1
             for token in token_list:
                 deprel = token['deprel']
                 father_idx = token['head'] - 1
@@ -2769,10 +2790,7 @@ def num_transfer_draw_(data, mask_type="number", min_generate_keep=0, equ_split_
         new_data["number position"] = num_pos
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums, unk_symbol
 
 
@@ -2891,10 +2909,7 @@ def num_transfer_alg514_(data, mask_type="number", min_generate_keep=0, equ_spli
         new_data["number position"] = num_pos
         processed_datas.append(new_data)
 
-    generate_number = []
-    for g in generate_nums:
-        if generate_nums_dict[g] >= min_generate_keep:
-            generate_number.append(g)
+    generate_number = keep_generate_number(generate_nums, generate_nums_dict, min_generate_keep)
     return processed_datas, generate_number, copy_nums, unk_symbol
 
 
@@ -3665,6 +3680,63 @@ def ept_equ_preprocess(formulae, decoder):
 
         return preprocessed
 
+def ept_tokens_with_number_pos(ques, tokenizer, numbers, max_len=510):
+    r'''remove [N] tokens from a tokenized question and mark which tokens represent numbers.
+
+    Args:
+        ques: list, token ids of question, a [N] token follows every number.
+        tokenizer: pretrained tokenizer.
+        numbers: list, numbers of question.
+        max_len: int, max length of tokens without BOS and EOS.
+
+    Return:
+        tuple(list, list): tokens with BOS and EOS, number index of each token (PAD_ID if not a number).
+    '''
+    # Shortcut for BOS, EOS token
+    bos_token = "[CLS]"
+    eos_token = "[SEP]"
+
+    tokens = []
+    number_indicators = []
+    number_index = 0
+    # We add tokens except [NUM], which we added to mark the position of numbers
+    item = tokenizer.convert_ids_to_tokens(ques)
+    for tok in item:
+        if tok != EPT.NUM_TOKEN:
+            # If this is not a [NUM] token, just add it.
+            tokens.append(tok)
+            # We don't know whether the token is representing a number or not yet, so set it as PAD
+            number_indicators.append(EPT.PAD_ID)
+        else:
+            # If this is a [NUM] token, then previous tokens that form a single word are representing numbers.
+            # Set number index until we meet SPIECE_UNDERLINE (Beginning of a word).
+            for i in range(-1, -len(tokens) - 1, -1):
+                # From -1 to -len(tok) (check a token backward)
+                if tokens[i] != EPT.SPIECE_UNDERLINE:
+                    # We ignore SPIECE_UNDERLINE token when marking the position of numbers.
+                    # Note that this code does not ignore tokens starting with SPIECE_UNDERLINE.
+                    number_indicators[i] = number_index
+
+                if tokens[i].startswith(EPT.SPIECE_UNDERLINE):
+                    # Break when we meet the beginning of a word.
+                    break
+
+            # Increase index of written numbers
+            number_index += 1
+
+    # Check whether any number token is discarded.
+    assert max(number_indicators[max_len:], default=EPT.PAD_ID) == EPT.PAD_ID, \
+        "A number token should not be discarded. You should increase the number of input tokens."
+
+    assert number_index == len(numbers) and len(set(number_indicators)) - 1 == number_index, \
+        "The extracted numbers are not the same! %s vs %s" % (number_index, len(numbers))
+
+    # Build tokens
+    tokens = [bos_token] + tokens[:max_len] + [eos_token]
+    number_indicators = [EPT.PAD_ID] + number_indicators[:max_len] + [EPT.PAD_ID]
+    return tokens, number_indicators
+
+
 def pad_token_ept_inp(ques_batch, tokenizer, num_list_batch):
     max_len = max(len(x) - x.count(EPT.NUM_TOKEN) for x in ques_batch)
 
@@ -3677,50 +3749,11 @@ def pad_token_ept_inp(ques_batch, tokenizer, num_list_batch):
     numbers = []
     num_pos = []
 
-    # Shortcut for BOS, EOS, PAD token
-    bos_token = "[CLS]"
-    eos_token = "[SEP]"
+    # Shortcut for PAD token
     pad_token = "<pad>"
 
     for item_id, item in enumerate(ques_batch):
-        tokens = []
-        number_indicators = []
-        number_index = 0
-        # We add tokens except [NUM], which we added to mark the position of numbers
-        item = tokenizer.convert_ids_to_tokens(item)
-        for tok in item:
-            if tok != EPT.NUM_TOKEN:
-                # If this is not a [NUM] token, just add it.
-                tokens.append(tok)
-                # We don't know whether the token is representing a number or not yet, so set it as PAD
-                number_indicators.append(EPT.PAD_ID)
-            else:
-                # If this is a [NUM] token, then previous tokens that form a single word are representing numbers.
-                # Set number index until we meet SPIECE_UNDERLINE (Beginning of a word).
-                for i in range(-1, -len(tokens) - 1, -1):
-                    # From -1 to -len(tok) (check a token backward)
-                    if tokens[i] != EPT.SPIECE_UNDERLINE:
-                        # We ignore SPIECE_UNDERLINE token when marking the position of numbers.
-                        # Note that this code does not ignore tokens starting with SPIECE_UNDERLINE.
-                        number_indicators[i] = number_index
-
-                    if tokens[i].startswith(EPT.SPIECE_UNDERLINE):
-                        # Break when we meet the beginning of a word.
-                        break
-
-                # Increase index of written numbers
-                number_index += 1
-
-        # Check whether any number token is discarded.
-        assert max(number_indicators[max_len:], default=EPT.PAD_ID) == EPT.PAD_ID, \
-            "A number token should not be discarded. You should increase the number of input tokens."
-
-        assert number_index == len(num_list_batch[item_id]) and len(set(number_indicators)) - 1 == number_index, \
-            "The extracted numbers are not the same! %s vs %s" % (number_index, len(num_list_batch[item_id]))
-
-        # Build tokens
-        tokens = [bos_token] + tokens[:max_len] + [eos_token]
-        number_indicators = [EPT.PAD_ID] + number_indicators[:max_len] + [EPT.PAD_ID]
+        tokens, number_indicators = ept_tokens_with_number_pos(item, tokenizer, num_list_batch[item_id], max_len)
 
         # Pad and append the item
         remain_len = max(0, max_len_with_specials - len(tokens))
@@ -9,6 +9,7 @@ import torch
 from collections import OrderedDict
 
 from mwptoolkit.utils.enum_type import TaskType,SupervisingMode
+from mwptoolkit.utils.data_structure import PersistentStack
 
 
 def write_json_data(data, filename):
@@ -69,11 +70,53 @@ def copy_list(l):
     for i in l:
         if isinstance(i,list):
             r.append(copy_list(i))
+        elif isinstance(i,PersistentStack):
+            r.append(i.copy())
         else:
             r.append(i)
     return r
 
 
+def sequence_mask(lengths, max_len=None, device=None):
+    r"""mask of padded positions, built in one tensor op.
+
+    Args:
+        lengths (list|torch.Tensor): valid length of every sequence, shape [batch_size].
+        max_len (int|None): width of mask, max of lengths if None.
+        device (torch.device|None): device of mask.
+
+    Returns:
+        torch.BoolTensor: mask, shape [batch_size, max_len], True at positions >= length.
+    """
+    lengths = torch.as_tensor(lengths, dtype=torch.long)
+    if max_len is None:
+        max_len = int(lengths.max()) if lengths.numel() > 0 else 0
+    lengths = lengths.to(device)
+    return torch.arange(max_len, device=lengths.device).unsqueeze(0) >= lengths.unsqueeze(1)
+
+
+def gather_number_outputs(encoder_outputs, num_pos, num_size):
+    r"""gather encoder outputs at positions of numbers in one op.
+
+    Args:
+        encoder_outputs (torch.Tensor): shape [batch_size, seq_length, hidden_size].
+        num_pos (list|torch.Tensor): positions of numbers of every sequence, -1 or missing entries are padding.
+        num_size (int): number of gathered positions per sequence.
+
+    Returns:
+        tuple(torch.Tensor, torch.BoolTensor):
+            number outputs, shape [batch_size, num_size, hidden_size], zero at padding.
+            padding mask, shape [batch_size, num_size].
+    """
+    if not torch.is_tensor(num_pos):
+        num_pos = torch.LongTensor([list(pos) + [-1] * (num_size - len(pos)) for pos in num_pos])
+    num_pos = num_pos[:, :num_size].to(encoder_outputs.device)
+    masked_index = num_pos.eq(-1)
+    index = num_pos.clamp(min=0).unsqueeze(2).expand(-1, -1, encoder_outputs.size(2))
+    all_num = encoder_outputs.gather(1, index)
+    return all_num.masked_fill(masked_index.unsqueeze(2), 0.0), masked_index
+
+
 def time_since(s):  # compute time
     m = math.floor(s / 60)
     s -= m * 60
@@ -0,0 +1,195 @@
+import argparse
+import random
+import sys
+import os
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.getcwd(), ".")))
+
+from mwptoolkit.model.Seq2Tree import treelstm
+from mwptoolkit.model.Seq2Tree.treelstm import TreeLSTM
+from mwptoolkit.module.Decoder.tree_decoder import HMSDecoder
+from mwptoolkit.module.Embedder.basic_embedder import BaiscEmbedder
+from mwptoolkit.module.Strategy import beam_search
+from mwptoolkit.utils.enum_type import NumMask, SpecialTokens
+from mwptoolkit.utils.utils import copy_list
+
+OPERATORS = ['+', '-', '*', '/', '^']
+GENERATE_LIST = ['1', '2', '3.14', '100']
+
+
+def list_copy_stack(stack):
+    r"""copy of a stack as list, beams were forked like this before persistent stacks.
+    """
+    return copy_list(list(stack))
+
+
+def list_copy_stacks(stacks):
+    return [list_copy_stack(stack) for stack in stacks]
+
+
+# copy_stack, copy_stacks, own_stack and own_stacks of every stack type,
+# beams copied lists they were given before persistent stacks.
+STACKS = {
+    "list": (list_copy_stack, list_copy_stacks, list_copy_stack, list_copy_stacks),
+    "persistent": (beam_search.copy_stack, beam_search.copy_stacks, beam_search.own_stack, beam_search.own_stacks),
+}
+
+
+class ForkCounter():
+    r"""bytes allocated by forking stacks of beams, measured with tracemalloc around every stack copy.
+
+    bytes of a fork grow with the depth of stacks and the length of output if stacks are lists,
+    and are constant if stacks are persistent stacks.
+    """
+    def __init__(self):
+        self.forks = 0
+        self.bytes = 0
+        self._depth = 0
+
+    def wrap(self, copy):
+        def counted(stack):
+            # copy_stacks calls copy_stack, only the outermost copy is counted
+            if self._depth > 0 or not tracemalloc.is_tracing():
+                return copy(stack)
+            self._depth += 1
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                return copy(stack)
+            finally:
+                self.bytes += tracemalloc.get_traced_memory()[0] - before
+                self.forks += 1
+                self._depth -= 1
+        return counted
+
+
+def use_stacks(name, counter=None):
+    r"""make TreeBeam, BeamNode and TreeLSTM beam search fork stacks as lists or persistent stacks.
+    """
+    functions = STACKS[name]
+    if counter is not None:
+        functions = [counter.wrap(function) for function in functions]
+    copy_stack, copy_stacks, own_stack, own_stacks = functions
+    for module in (beam_search, treelstm):
+        module.copy_stack = copy_stack
+        module.copy_stacks = copy_stacks
+    beam_search.own_stack = own_stack
+    beam_search.own_stacks = own_stacks
+
+
+def build_treelstm(args, beam_size):
+    r"""TreeLSTM with random weights, its beam search forks TreeBeam.
+    """
+    out_idx2symbol = OPERATORS + GENERATE_LIST + NumMask.number[:args.num_size] + [SpecialTokens.UNK_TOKEN]
+    dataset = SimpleNamespace(in_idx2word=[str(i) for i in range(args.vocab_size)],
+                              out_idx2symbol=out_idx2symbol,
+                              out_symbol2idx={symbol: idx for idx, symbol in enumerate(out_idx2symbol)},
+                              operator_nums=len(OPERATORS),
+                              generate_list=GENERATE_LIST,
+                              num_start=len(OPERATORS))
+    # decoder hidden size hidden_size * num_layers matches the bidirectional encoder with 2 layers
+    config = {"hidden_size": args.hidden_size, "embedding_size": args.embedding_size, "device": torch.device("cpu"),
+              "beam_size": beam_size, "max_output_len": args.max_length, "num_layers": 2, "dropout_ratio": 0.}
+    model = TreeLSTM(config, dataset)
+    # operators are preferred so that trees grow deep
+    model.decoder.ops.bias.data += args.op_bias
+    model.eval()
+    num_pos = sorted(random.sample(range(args.seq_length), args.num_size))
+    batch = {
+        "question": torch.randint(args.vocab_size, (1, args.seq_length)),
+        "ques len": torch.LongTensor([args.seq_length]),
+        "num stack": [[]],
+        "num size": [args.num_size],
+        "num pos": [num_pos],
+        "equation": torch.LongTensor([[0, len(OPERATORS) + len(GENERATE_LIST), len(OPERATORS) + len(GENERATE_LIST) + 1]]),
+        "equ len": torch.LongTensor([3]),
+        "equ mask": None,
+        "num list": [[str(i + 2) for i in range(args.num_size)]],
+    }
+    return lambda: model.model_test(batch)
+
+
+def build_hms(args, beam_size):
+    r"""HMSDecoder with random weights and encoder outputs, its beam search forks BeamNode.
+    """
+    class_list = OPERATORS + GENERATE_LIST + NumMask.number[:args.num_size] + [SpecialTokens.UNK_TOKEN]
+    vocab_dict = {symbol: idx for idx, symbol in enumerate(OPERATORS + GENERATE_LIST)}
+    embedder = BaiscEmbedder(args.vocab_size, args.embedding_size, 0.)
+    decoder = HMSDecoder(embedder, args.hidden_size, 0., OPERATORS, vocab_dict, class_list, torch.device("cpu"))
+    # generated symbols (mostly operators) are preferred so that trees grow deep
+    decoder.predict.gen_prob.bias.data += args.op_bias
+    decoder.eval()
+    span_size = 2
+    span_output = torch.randn(1, span_size, args.hidden_size)
+    word_outputs = [torch.randn(1, args.seq_length, args.hidden_size) for _ in range(span_size)]
+    input_lengths = [torch.LongTensor([args.seq_length]) for _ in range(span_size)]
+    span_num_pos = torch.full((1, len(class_list)), -1, dtype=torch.long)
+    word_num_poses = [torch.full((1, len(class_list)), -1, dtype=torch.long) for _ in range(span_size)]
+    for i in range(args.num_size):
+        idx = class_list.index(NumMask.number[i])
+        span_num_pos[0, idx] = i % span_size
+        word_num_poses[i % span_size][0, idx] = random.randrange(args.seq_length)
+    encoder_hidden = torch.randn(1, 1, args.hidden_size)
+
+    @torch.no_grad()
+    def decode():
+        return decoder(encoder_hidden=encoder_hidden, encoder_outputs=(span_output, word_outputs), input_lengths=input_lengths,
+                       span_length=torch.LongTensor([span_size]), num_pos=(span_num_pos, word_num_poses),
+                       max_length=args.max_length, beam_width=beam_size)
+
+    return decode
+
+
+def measure(decode, repeats):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        decode()
+    elapsed = (time.perf_counter() - start) / repeats
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--beam_sizes', type=int, nargs='+', default=[5, 10, 20], help='at most the number of output symbols')
+    parser.add_argument('--max_length', type=int, default=30)
+    parser.add_argument('--embedding_size', type=int, default=128)
+    parser.add_argument('--hidden_size', type=int, default=128)
+    parser.add_argument('--vocab_size', type=int, default=100)
+    parser.add_argument('--seq_length', type=int, default=40)
+    parser.add_argument('--num_size', type=int, default=16, help='numbers of a problem, output symbols are operators, constants and numbers')
+    parser.add_argument('--op_bias', type=float, default=2., help='bias towards operators, trees grow deeper with larger bias')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=2021)
+    args, _ = parser.parse_known_args()
+
+    torch.set_grad_enabled(False)
+    symbol_size = len(OPERATORS) + len(GENERATE_LIST) + args.num_size + 1
+    if max(args.beam_sizes) > symbol_size:
+        raise ValueError("beam size must be at most the number of output symbols {}, increase --num_size.".format(symbol_size))
+    print("{:<10}{:<10}{:<12}{:>12}{:>12}{:>10}{:>12}{:>12}".format("decoder", "beam_size", "stack", "time(ms)", "peak(KB)", "forks", "fork(KB)", "bytes/fork"))
+    for name, build in [("treelstm", build_treelstm), ("hms", build_hms)]:
+        for beam_size in args.beam_sizes:
+            outputs = {}
+            for stack in ["list", "persistent"]:
+                random.seed(args.seed)
+                torch.manual_seed(args.seed)
+                decode = build(args, beam_size)
+                use_stacks(stack)
+                outputs[stack] = str(decode())
+                counter = ForkCounter()
+                use_stacks(stack, counter)
+                elapsed, peak = measure(decode, args.repeats)
+                forks = counter.forks // args.repeats
+                fork_bytes = counter.bytes / args.repeats
+                print("{:<10}{:<10}{:<12}{:>12.2f}{:>12.1f}{:>10}{:>12.1f}{:>12.1f}".format(name, beam_size, stack, elapsed * 1000, peak / 1024,
+                                                                                        forks, fork_bytes / 1024, fork_bytes / max(1, forks)))
+            use_stacks("persistent")
+            if outputs["list"] != outputs["persistent"]:
+                print("{:<10}{:<10}outputs of list and persistent stacks differ".format(name, beam_size))
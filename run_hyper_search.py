@@ -3,9 +3,7 @@ import sys
 import os
 from os.path import abspath, dirname
 
-from ray import tune
-
-from mwptoolkit.hyper_search import hyper_search_process
+from mwptoolkit.hyper_search import hyper_search_process, local_search_process, parse_search_space
 from mwptoolkit.utils.utils import read_json_data
 
 
@@ -22,37 +20,18 @@ if __name__ == '__main__':
     parser.add_argument('--task_type', '-t', type=str, default='single_equation', help='name of tasks')
     parser.add_argument('--search_parameter', '-s', type=str, action='append', default=[])
     parser.add_argument('--search_file','-f',type=str,default=None)
+    parser.add_argument('--backend', '-b', type=str, default='ray', choices=['ray', 'local'], help='ray tune, or local process pool without ray')
     #parser.add_argument('--config_files', type=str, default=None, help='config files')
 
     args, _ = parser.parse_known_args()
     config_dict = {}
-    parameter_dict = {}
+    search_parameter = []
     if args.search_file != None:
-        search_parameter=read_json_data(args.search_file)
-        for parameter in search_parameter:
-            value = parameter.split('=')
-            space = eval(value[1])
-            if isinstance(space,list):
-                parameter_dict[value[0]] = tune.grid_search(space)
-            elif isinstance(space,tuple) and len(space)==2:
-                if space[0]==0 and space[1]==1:
-                    parameter_dict[value[0]] = tune.uniform(space[0],space[1])
-                else:
-                    parameter_dict[value[0]] = tune.loguniform(space[0],space[1])
-            else:
-                parameter_dict[value[0]] = space
-    search_parameter = args.search_parameter
-    for parameter in search_parameter:
-        value = parameter.split('=')
-        space = eval(value[1])
-        if isinstance(space,list):
-            parameter_dict[value[0]] = tune.grid_search(space)
-        elif isinstance(space,tuple) and len(space)==2:
-            if space[0]==0 and space==1:
-                parameter_dict[value[0]] = tune.uniform(space[0],space[1])
-            else:
-                parameter_dict[value[0]] = tune.loguniform(space[0],space[1])
-        else:
-            parameter_dict[value[0]] = space
+        search_parameter += read_json_data(args.search_file)
+    search_parameter += args.search_parameter
+    parameter_dict = parse_search_space(search_parameter)
 
-    hyper_search_process(args.model, args.dataset, args.task_type, parameter_dict, config_dict)
+    if args.backend == 'local':
+        local_search_process(args.model, args.dataset, args.task_type, parameter_dict, config_dict)
+    else:
+        hyper_search_process(args.model, args.dataset, args.task_type, parameter_dict, config_dict)
@@ -0,0 +1,92 @@
+import argparse
+import random
+import sys
+import os
+import time
+
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.getcwd(), ".")))
+
+from mwptoolkit.utils.utils import gather_number_outputs
+
+
+def loop_gather(encoder_outputs, num_pos, num_size, hidden_size):
+    r"""former get_all_number_encoder_outputs, indices and mask built with nested python loops.
+    """
+    indices = list()
+    sen_len = encoder_outputs.size(1)
+    batch_size = encoder_outputs.size(0)
+    masked_index = []
+    temp_1 = [1 for _ in range(hidden_size)]
+    temp_0 = [0 for _ in range(hidden_size)]
+    for b in range(batch_size):
+        for i in num_pos[b]:
+            if i == -1:
+                indices.append(0)
+                masked_index.append(temp_1)
+                continue
+            indices.append(i + b * sen_len)
+            masked_index.append(temp_0)
+        indices += [0 for _ in range(len(num_pos[b]), num_size)]
+        masked_index += [temp_1 for _ in range(len(num_pos[b]), num_size)]
+    indices = torch.LongTensor(indices).to(encoder_outputs.device)
+    masked_index = torch.BoolTensor(masked_index).to(encoder_outputs.device)
+
+    masked_index = masked_index.view(batch_size, num_size, hidden_size)
+    all_outputs = encoder_outputs.contiguous()
+    all_embedding = all_outputs.view(-1, encoder_outputs.size(2))
+    all_num = all_embedding.index_select(0, indices)
+    all_num = all_num.view(batch_size, num_size, hidden_size)
+    return all_num.masked_fill_(masked_index, 0.0)
+
+
+def tensor_gather(encoder_outputs, num_pos, num_size, hidden_size):
+    all_num, _ = gather_number_outputs(encoder_outputs, num_pos, num_size)
+    return all_num
+
+
+def make_batch(batch_size, seq_length, hidden_size, max_nums, device, rng):
+    encoder_outputs = torch.randn(batch_size, seq_length, hidden_size, device=device)
+    num_pos = []
+    for _ in range(batch_size):
+        n = rng.randint(1, max_nums)
+        num_pos.append(sorted(rng.sample(range(seq_length), n)))
+    num_size = max(len(pos) for pos in num_pos)
+    return encoder_outputs, num_pos, num_size
+
+
+def measure(fn, encoder_outputs, num_pos, num_size, hidden_size, repeats):
+    fn(encoder_outputs, num_pos, num_size, hidden_size)
+    if encoder_outputs.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(encoder_outputs, num_pos, num_size, hidden_size)
+    if encoder_outputs.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[64, 256])
+    parser.add_argument('--seq_length', type=int, default=100)
+    parser.add_argument('--hidden_size', type=int, default=512)
+    parser.add_argument('--max_nums', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--seed', type=int, default=2021)
+    args, _ = parser.parse_known_args()
+
+    rng = random.Random(args.seed)
+    device = torch.device(args.device)
+    print("{:<12}{:<10}{:>12}{:>10}".format("batch_size", "gather", "time(ms)", "speedup"))
+    for batch_size in args.batch_sizes:
+        encoder_outputs, num_pos, num_size = make_batch(batch_size, args.seq_length, args.hidden_size, args.max_nums, device, rng)
+        expected = loop_gather(encoder_outputs, num_pos, num_size, args.hidden_size)
+        assert torch.equal(expected, tensor_gather(encoder_outputs, num_pos, num_size, args.hidden_size))
+        loop_time = measure(loop_gather, encoder_outputs, num_pos, num_size, args.hidden_size, args.repeats)
+        tensor_time = measure(tensor_gather, encoder_outputs, num_pos, num_size, args.hidden_size, args.repeats)
+        print("{:<12}{:<10}{:>12.3f}{:>10}".format(batch_size, "loop", loop_time * 1000, ""))
+        print("{:<12}{:<10}{:>12.3f}{:>10.1f}".format(batch_size, "tensor", tensor_time * 1000, loop_time / tensor_time))
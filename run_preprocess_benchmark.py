@@ -0,0 +1,68 @@
+import argparse
+import copy
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.getcwd(), ".")))
+
+from mwptoolkit.utils.preprocess_tools import parallel_number_transfer, number_transfer_ape200k, number_transfer_math23k
+
+TRANSFERS = {
+    "ape200k": (number_transfer_ape200k, ["validset.json", "testset.json"]),
+    "math23k": (number_transfer_math23k, ["validset.json", "testset.json"]),
+}
+
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(transfer, data, workers, shard_size):
+    r"""wall time, cpu time of this process and cpu time of worker processes of a number transfer.
+
+    workers run in parallel on a machine with enough cores, this process merges their results, so
+    the wall time on `workers` cores is at least max(cpu of this process, cpu of workers / workers).
+    """
+    # number transfer changes records in place
+    data = [copy.deepcopy(d) for d in data]
+    children = children_cpu_time()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    outputs = parallel_number_transfer(transfer, data, "number", 5, workers=workers, shard_size=shard_size)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    children = children_cpu_time() - children
+    return outputs, elapsed, cpu, children
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='ape200k', choices=list(TRANSFERS))
+    parser.add_argument('--repeat_data', type=int, default=4, help='data is repeated to get a large dataset')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--shard_sizes', type=int, nargs='+', default=[0, 250, 1000, 5000], help='0 for the default shard size')
+    args, _ = parser.parse_known_args()
+
+    transfer, files = TRANSFERS[args.dataset]
+    data = []
+    for file in files:
+        with open(os.path.join("dataset", args.dataset, file), encoding="utf-8") as f:
+            data += json.load(f)
+    data = data * args.repeat_data
+    print("{} records of {}, {} cpu cores".format(len(data), args.dataset, os.cpu_count()))
+
+    serial_outputs, serial_time, _, _ = measure(transfer, data, None, None)
+    print("{:<9}{:<12}{:>10}{:>12}{:>14}{:>14}{:>16}".format("workers", "shard_size", "wall(s)", "speedup", "main cpu(s)", "worker cpu(s)", "speedup bound"))
+    print("{:<9}{:<12}{:>10.2f}{:>12.2f}{:>14}{:>14}{:>16}".format(1, "-", serial_time, 1., "-", "-", "-"))
+    for workers in args.workers:
+        for shard_size in args.shard_sizes:
+            shard_size = shard_size if shard_size > 0 else None
+            outputs, elapsed, cpu, children = measure(transfer, data, workers, shard_size)
+            if outputs != serial_outputs:
+                print("outputs of workers {} and shard_size {} differ from serial outputs".format(workers, shard_size))
+            bound = serial_time / max(cpu, children / workers)
+            print("{:<9}{:<12}{:>10.2f}{:>12.2f}{:>14.2f}{:>14.2f}{:>16.2f}".format(workers, shard_size or "default", elapsed, serial_time / elapsed, cpu, children, bound))